@@ -0,0 +1,2 @@
+# -*- coding: utf-8 -*-
+"""オフラインベンチマーク (スタブサーバー・インメモリ Firestore・計測スクリプト)"""
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+ベンチマーク用のインメモリ Firestore。
+okosy_core.firestore_store が使う範囲 (collection / document / set / update / get / delete /
+select / order_by / limit / start_after / stream / count / batch) だけを実装する (スレッドセーフ)。
+Firestore エミュレーターを使う場合は FIRESTORE_EMULATOR_HOST を設定し、run_benchmark.py に --firestore emulator を指定する。
+"""
+import datetime
+import itertools
+import threading
+import time
+import uuid
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from firebase_admin import firestore
+
+Path = Tuple[str, ...]
+
+
+class FakeSnapshot:
+    def __init__(self, reference: "FakeDocumentReference", data: Optional[Dict[str, Any]]):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self) -> Optional[Dict[str, Any]]:
+        return dict(self._data) if self._data is not None else None
+
+
+class FakeAggregation:
+    def __init__(self, value: int):
+        self.value = value
+
+
+class FakeQuery:
+    def __init__(self, client: "FakeFirestoreClient", path: Path, fields: Optional[List[str]] = None,
+                 orders: Tuple[Tuple[str, str], ...] = (), limit_count: Optional[int] = None,
+                 cursor: Optional[FakeSnapshot] = None):
+        self._client = client
+        self._path = path
+        self._fields = fields
+        self._orders = orders
+        self._limit = limit_count
+        self._cursor = cursor
+
+    def _copy(self, **changes: Any) -> "FakeQuery":
+        values = {"fields": self._fields, "orders": self._orders, "limit_count": self._limit, "cursor": self._cursor}
+        values.update(changes)
+        return FakeQuery(self._client, self._path, **values)
+
+    def select(self, field_paths: List[str]) -> "FakeQuery":
+        return self._copy(fields=list(field_paths))
+
+    def order_by(self, field_path: str, direction: str = "ASCENDING") -> "FakeQuery":
+        return self._copy(orders=self._orders + ((field_path, direction),))
+
+    def limit(self, count: int) -> "FakeQuery":
+        return self._copy(limit_count=count)
+
+    def start_after(self, snapshot: FakeSnapshot) -> "FakeQuery":
+        return self._copy(cursor=snapshot)
+
+    def _sorted_items(self) -> List[Tuple[str, Dict[str, Any]]]:
+        items = self._client._documents_in(self._path)
+        for field_path, direction in reversed(self._orders): # 安定ソートなので後ろのキーから並べる
+            def key(item: Tuple[str, Dict[str, Any]]) -> Any:
+                return item[0] if field_path == "__name__" else (item[1].get(field_path) is None, item[1].get(field_path))
+            items.sort(key=key, reverse=direction == firestore.Query.DESCENDING)
+        return items
+
+    def stream(self) -> Iterator[FakeSnapshot]:
+        items = self._sorted_items()
+        if self._cursor is not None:
+            ids = [doc_id for doc_id, _ in items]
+            items = items[ids.index(self._cursor.id) + 1:] if self._cursor.id in ids else []
+        if self._limit is not None:
+            items = items[:self._limit]
+        for doc_id, data in items:
+            if self._fields is not None:
+                data = {k: v for k, v in data.items() if k in self._fields}
+            yield FakeSnapshot(FakeDocumentReference(self._client, self._path, doc_id), data)
+
+    def count(self) -> "FakeQuery":
+        return self
+
+    def get(self) -> List[List[FakeAggregation]]:
+        """count() の結果 (Firestore の AggregationQuery と同じ形)"""
+        return [[FakeAggregation(len(self._client._documents_in(self._path)))]]
+
+
+class FakeCollectionReference(FakeQuery):
+    def document(self, document_id: Optional[str] = None) -> "FakeDocumentReference":
+        return FakeDocumentReference(self._client, self._path, document_id or uuid.uuid4().hex[:20])
+
+
+class FakeDocumentReference:
+    def __init__(self, client: "FakeFirestoreClient", collection_path: Path, document_id: str):
+        self._client = client
+        self._collection_path = collection_path
+        self.id = document_id
+
+    def collection(self, name: str) -> FakeCollectionReference:
+        return FakeCollectionReference(self._client, self._collection_path + (self.id, name))
+
+    def set(self, data: Dict[str, Any]) -> None:
+        self._client._write(self._collection_path, self.id, data, merge=False)
+
+    def update(self, data: Dict[str, Any]) -> None:
+        self._client._write(self._collection_path, self.id, data, merge=True)
+
+    def get(self, field_paths: Optional[List[str]] = None) -> FakeSnapshot:
+        data = self._client._read(self._collection_path, self.id)
+        if data is not None and field_paths is not None:
+            data = {k: v for k, v in data.items() if k in field_paths}
+        return FakeSnapshot(self, data)
+
+    def delete(self) -> None:
+        self._client._delete(self._collection_path, self.id)
+
+
+class FakeWriteBatch:
+    def __init__(self):
+        self._deletes: List[FakeDocumentReference] = []
+
+    def delete(self, reference: FakeDocumentReference) -> None:
+        self._deletes.append(reference)
+
+    def commit(self) -> None:
+        for reference in self._deletes:
+            reference.delete()
+
+
+class FakeFirestoreClient:
+    """
+    コレクションのパスごとに {ドキュメントID: データ} を保持するインメモリ Firestore。
+    operation_latency_ms を指定すると、読み書き1回ごとに待ち時間を入れる (ネットワーク往復の模擬)
+    """
+    def __init__(self, operation_latency_ms: float = 0.0):
+        self.operation_latency_ms = operation_latency_ms
+        self._collections: Dict[Path, Dict[str, Dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+        self._sequence = itertools.count()
+
+    def collection(self, name: str) -> FakeCollectionReference:
+        return FakeCollectionReference(self, (name,))
+
+    def batch(self) -> FakeWriteBatch:
+        return FakeWriteBatch()
+
+    def _wait(self) -> None:
+        if self.operation_latency_ms > 0:
+            time.sleep(self.operation_latency_ms / 1000)
+
+    def _write(self, path: Path, doc_id: str, data: Dict[str, Any], merge: bool) -> None:
+        self._wait()
+        # SERVER_TIMESTAMP は書き込み順に単調増加する時刻に置き換える (同時刻の書き込みでも並び順が決まるように)
+        now = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(microseconds=next(self._sequence))
+        values = {k: (now if v is firestore.SERVER_TIMESTAMP else v) for k, v in data.items()}
+        deleted = [k for k, v in values.items() if v is firestore.DELETE_FIELD]
+        with self._lock:
+            documents = self._collections.setdefault(path, {})
+            if merge and doc_id in documents:
+                documents[doc_id].update(values)
+            else:
+                documents[doc_id] = values
+            for k in deleted:
+                documents[doc_id].pop(k, None)
+
+    def _read(self, path: Path, doc_id: str) -> Optional[Dict[str, Any]]:
+        self._wait()
+        with self._lock:
+            data = self._collections.get(path, {}).get(doc_id)
+            return dict(data) if data is not None else None
+
+    def _delete(self, path: Path, doc_id: str) -> None:
+        self._wait()
+        with self._lock:
+            self._collections.get(path, {}).pop(doc_id, None)
+
+    def _documents_in(self, path: Path) -> List[Tuple[str, Dict[str, Any]]]:
+        self._wait()
+        with self._lock:
+            return [(doc_id, dict(data)) for doc_id, data in self._collections.get(path, {}).items()]
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+しおり生成パイプラインのオフラインベンチマーク。
+
+記録済みレスポンス (benchmarks/fixtures) を返すスタブサーバーと、インメモリの Firestore (または Firestore エミュレーター) を使い、
+APIキーなしで run_conversation_with_function_calling / search_google_places / Firestore の読み書きを計測する。
+N 人の利用者を模したスレッドから同時に実行し、シナリオごとのスループットとレイテンシのパーセンタイル、
+処理段階ごとの内訳 (okosy_core.tracing のスパン) を表示する。
+
+使い方:
+  python benchmarks/run_benchmark.py [--users 8] [--iterations 5] [--scenario all|generation|places|firestore]
+                                     [--images 1] [--latency-scale 1.0] [--warm-caches]
+                                     [--firestore fake|emulator] [--json-output bench.json] [--max-p95-ms 12000]
+--max-p95-ms を超えたシナリオがあれば終了コード 1 で終わる (デプロイ前の性能劣化の検知用)。
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.fake_firestore import FakeFirestoreClient # noqa: E402
+from benchmarks.stub_server import StubUpstreamServer # noqa: E402
+
+SCENARIOS = ("generation", "places", "firestore")
+BENCH_DESTINATION = "金沢市" # 同梱の都道府県テーブルに無い地名にして、ジオコーディングも計測対象にする
+BENCH_PLANNER = {"name": "ベテラン", "prompt_persona": "経験豊富なプロの旅行プランナーとして、端的かつ的確に"}
+BENCH_PREFERENCES = {
+    "nature": 3, "culture": 4, "art": 3, "welness": 2, "food_local": "地元の名物", "food_style": ["和食", "海鮮"],
+    "accom_type": "旅館", "word": ["落ち着いた", "歴史"], "mbti": "INFJ",
+}
+
+
+def configure_environment(stub_base_url: str, args: argparse.Namespace) -> None:
+    """okosy_core.config を読み込む前に、外部APIの向き先をスタブにし、ベンチマーク用の設定にする"""
+    os.environ.update({
+        "OPENAI_API_KEY": "bench-openai-key",
+        "GOOGLE_PLACES_API_KEY": "bench-places-key",
+        "GOOGLE_APPLICATION_CREDENTIALS": "bench-vision-credentials",
+        "OPENAI_BASE_URL": f"{stub_base_url}/v1",
+        "OKOSY_GOOGLE_MAPS_BASE_URL": stub_base_url,
+        "OKOSY_VISION_BASE_URL": stub_base_url,
+        "ITINERARY_CACHE_ENABLED": "0",
+        "PLACE_DETAILS_ENABLED": os.environ.get("PLACE_DETAILS_ENABLED", "1"), # 任意機能だが、既定で計測に含める
+        "PLACE_DETAILS_CACHE_PATH": ":memory:", # 実行のたびに空のキャッシュから始める
+        "OKOSY_LOG_LEVEL": os.environ.get("OKOSY_LOG_LEVEL", "WARNING"),
+        "OKOSY_TRACE_BUFFER_SIZE": str(max(5000, args.users * args.iterations * 50)),
+        "HTTP_MAX_CONNECTIONS_PER_HOST": os.environ.get("HTTP_MAX_CONNECTIONS_PER_HOST", str(max(20, args.users * 4))),
+    })
+    if not args.warm_caches:
+        # 既定では Places / Place Details / ジオコーディングのキャッシュを効かせず、毎回スタブまで往復させる
+        os.environ.update({"PLACES_CACHE_TTL_SECONDS": "0", "GEOCODE_CACHE_TTL_SECONDS": "0",
+                           "GEOCODE_NEGATIVE_CACHE_TTL_SECONDS": "0"})
+        os.environ.update({f"PLACE_DETAILS_TTL_{field_name.upper()}_SECONDS": "0"
+                           for field_name in ("geometry", "business_status", "opening_hours", "photos")})
+
+
+class BenchVisionCredentials:
+    """Vision API のアクセストークンの代わり (スタブは認証ヘッダーを検証しない)"""
+    def access_token(self) -> str:
+        return "bench-vision-token"
+
+
+def make_sample_images(count: int) -> List[tuple[str, bytes]]:
+    """ラベル検出の前処理 (縮小・再エンコード) を通すための JPEG 画像を生成する"""
+    from PIL import Image
+    images = []
+    for i in range(count):
+        buffer = io.BytesIO()
+        Image.new("RGB", (1600, 1200), (40 + i * 30, 120, 90)).save(buffer, "JPEG", quality=85)
+        images.append((f"bench_{i + 1}.jpg", buffer.getvalue()))
+    return images
+
+
+def patch_app_backends(firestore_mode: str) -> None:
+    """Firestore と Vision の認証情報をベンチマーク用に差し替える"""
+    from okosy_core import firestore_store, vision
+    if firestore_mode == "emulator":
+        if not os.environ.get("FIRESTORE_EMULATOR_HOST"):
+            raise SystemExit("--firestore emulator には FIRESTORE_EMULATOR_HOST の設定が必要です。")
+        from google.cloud import firestore as cloud_firestore
+        client = cloud_firestore.Client(project=os.environ.get("GCLOUD_PROJECT", "okosy-bench"))
+    else:
+        client = FakeFirestoreClient(float(os.environ.get("BENCH_FIRESTORE_LATENCY_MS", "15")))
+    firestore_store.get_firestore_client = lambda: client
+    vision.get_vision_credentials = lambda: BenchVisionCredentials()
+
+
+# --- シナリオ (利用者1人の操作1回分。成功なら True) ---
+def run_generation(user_id: str, images: List[tuple[str, bytes]]) -> bool:
+    from okosy_core import config
+    from okosy_core.conversation import extract_image_labels, run_conversation_with_function_calling
+    from okosy_core.jobs import GenerationRequest
+    from okosy_core.notices import NoticeSink
+    from okosy_core.resilience import Deadline
+    from okosy_core.usage import GenerationUsage
+    request = GenerationRequest(BENCH_PLANNER, BENCH_DESTINATION, "観光", "友人", 2, "普通", BENCH_PREFERENCES, images)
+    notices = NoticeSink()
+    deadline = Deadline(config.GENERATION_DEADLINE_SECONDS)
+    image_labels = extract_image_labels(request.images, deadline, notices)
+    content, _ = run_conversation_with_function_calling(
+        request.messages(), image_labels, on_text=(lambda text: None) if config.OPENAI_STREAM_OUTPUT else None,
+        destination=request.destination, days=request.days, notices=notices, deadline=deadline, usage=GenerationUsage(),
+    )
+    return bool(content) and not any(level == "error" for level, _ in notices.items())
+
+
+def run_places(user_id: str, images: List[tuple[str, bytes]]) -> bool:
+    from okosy_core.places import resolve_coordinates, search_google_places
+    result = json.loads(search_google_places(f"{BENCH_DESTINATION} 観光名所", resolve_coordinates(BENCH_DESTINATION), "tourist_attraction"))
+    return isinstance(result, list)
+
+
+def run_firestore(user_id: str, images: List[tuple[str, bytes]]) -> bool:
+    from okosy_core.firestore_store import (
+        load_itinerary_from_firestore, load_itinerary_summaries_from_firestore, load_memories_from_firestore,
+        save_itinerary_to_firestore,
+    )
+    itinerary_id = save_itinerary_to_firestore(user_id, f"{BENCH_DESTINATION}の旅", BENCH_PREFERENCES,
+                                               "# ベンチマーク用のしおり\n" * 200, [])
+    if itinerary_id is None:
+        return False
+    summaries, _ = load_itinerary_summaries_from_firestore(user_id)
+    itinerary = load_itinerary_from_firestore(user_id, itinerary_id)
+    load_memories_from_firestore(user_id, itinerary_id)
+    return bool(summaries) and itinerary is not None
+
+
+SCENARIO_FUNCTIONS: Dict[str, Callable[[str, List[tuple[str, bytes]]], bool]] = {
+    "generation": run_generation, "places": run_places, "firestore": run_firestore,
+}
+
+
+# --- 実行と集計 ---
+def run_scenario(name: str, users: int, iterations: int, images: List[tuple[str, bytes]]) -> Dict[str, Any]:
+    """users 人が同時に iterations 回ずつシナリオを実行し、スループット・レイテンシ・処理段階ごとの内訳を返す"""
+    from okosy_core.tracing import get_span_buffer, percentile
+    scenario = SCENARIO_FUNCTIONS[name]
+    scenario("bench-warmup", images) # クライアントや接続プールの初期化を計測から外す
+    span_buffer = get_span_buffer()
+    span_buffer.clear()
+    latencies_ms: List[float] = []
+    errors = 0
+    lock = threading.Lock()
+
+    def simulate_user(user_index: int) -> None:
+        nonlocal errors
+        for _ in range(iterations):
+            started = time.perf_counter()
+            try:
+                ok = scenario(f"bench-user-{user_index}", images)
+            except Exception as e:
+                print(f"[{name}] user {user_index}: {e!r}", file=sys.stderr)
+                ok = False
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            with lock:
+                latencies_ms.append(elapsed_ms)
+                errors += 0 if ok else 1
+
+    wall_started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=users, thread_name_prefix="okosy-bench-user") as executor:
+        list(executor.map(simulate_user, range(users)))
+    wall_seconds = time.perf_counter() - wall_started
+    durations = sorted(latencies_ms)
+    return {
+        "scenario": name, "users": users, "operations": len(durations), "errors": errors,
+        "wall_seconds": round(wall_seconds, 3),
+        "throughput_per_second": round(len(durations) / wall_seconds, 3) if wall_seconds else 0.0,
+        "p50_ms": round(percentile(durations, 50), 1), "p95_ms": round(percentile(durations, 95), 1),
+        "p99_ms": round(percentile(durations, 99), 1), "max_ms": round(durations[-1], 1) if durations else 0.0,
+        "stages": span_buffer.stage_summary(),
+    }
+
+
+def print_report(results: List[Dict[str, Any]], request_counts: Dict[str, int]) -> None:
+    print(f"{'scenario':<12}{'users':>6}{'ops':>6}{'errors':>7}{'wall(s)':>9}{'ops/s':>8}"
+          f"{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}{'max(ms)':>10}")
+    for r in results:
+        print(f"{r['scenario']:<12}{r['users']:>6}{r['operations']:>6}{r['errors']:>7}{r['wall_seconds']:>9.2f}"
+              f"{r['throughput_per_second']:>8.2f}{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}{r['p99_ms']:>10.1f}{r['max_ms']:>10.1f}")
+    for r in results:
+        print(f"\n[{r['scenario']}] 処理段階ごとの所要時間 (ms)")
+        print(f"  {'stage':<36}{'count':>7}{'errors':>7}{'p50':>10}{'p95':>10}{'p99':>10}")
+        for s in r["stages"]:
+            print(f"  {s['stage']:<36}{s['count']:>7}{s['errors']:>7}{s['p50_ms']:>10.1f}{s['p95_ms']:>10.1f}{s['p99_ms']:>10.1f}")
+    print(f"\nスタブへのリクエスト数: {json.dumps(request_counts, ensure_ascii=False, sort_keys=True)}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="記録済みレスポンスを使った、しおり生成パイプラインのオフラインベンチマーク")
+    parser.add_argument("--users", type=int, default=8, help="同時に操作する利用者の数")
+    parser.add_argument("--iterations", type=int, default=5, help="利用者1人あたりの実行回数")
+    parser.add_argument("--scenario", choices=("all",) + SCENARIOS, default="all")
+    parser.add_argument("--images", type=int, default=1, help="generation シナリオでアップロードする画像の枚数")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="フィクスチャの latency_ms に掛ける係数 (0 でスタブの待ち時間なし)")
+    parser.add_argument("--warm-caches", action="store_true", help="Places / Place Details / ジオコーディングのキャッシュを有効にしたまま計測する")
+    parser.add_argument("--firestore", choices=("fake", "emulator"), default="fake")
+    parser.add_argument("--json-output", help="結果をJSONで書き出すファイル")
+    parser.add_argument("--max-p95-ms", type=float, help="いずれかのシナリオの p95 がこの値を超えたら終了コード 1")
+    args = parser.parse_args()
+    if args.json_output:
+        args.json_output = os.path.abspath(args.json_output)
+    os.chdir(REPO_ROOT) # アプリと同じく、同梱データ (assets/) をリポジトリ直下からの相対パスで読む
+
+    stub = StubUpstreamServer(latency_scale=args.latency_scale).start()
+    try:
+        configure_environment(stub.base_url, args)
+        patch_app_backends(args.firestore)
+        images = make_sample_images(args.images)
+        scenarios = SCENARIOS if args.scenario == "all" else (args.scenario,)
+        results = [run_scenario(name, args.users, args.iterations, images) for name in scenarios]
+    finally:
+        stub.stop()
+
+    print_report(results, stub.request_counts)
+    if args.json_output:
+        with open(args.json_output, "w", encoding="utf-8") as f:
+            json.dump({"arguments": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+    if args.max_p95_ms is not None:
+        slow = [r["scenario"] for r in results if r["p95_ms"] > args.max_p95_ms]
+        if slow:
+            print(f"p95 が {args.max_p95_ms:.0f}ms を超えました: {', '.join(slow)}", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
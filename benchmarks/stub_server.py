@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+ベンチマーク用のスタブサーバー。
+Geocoding / Places Text Search / Place Details / Vision / OpenAI (chat.completions) の記録済みレスポンス (fixtures/*.json) を
+ローカルの HTTP サーバーから返す。各フィクスチャの latency_ms (× latency_scale) だけ待ってから応答する。
+フィクスチャの形式: {"latency_ms": 応答までの待ち時間, "response": 記録したレスポンスのJSON}
+"""
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional
+from urllib.parse import urlparse
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+# ストリーミング応答 (SSE) で本文を分割する文字数
+STREAM_CHUNK_CHARS = 24
+
+ROUTES = {
+    ("GET", "/maps/api/geocode/json"): "geocode",
+    ("GET", "/maps/api/place/textsearch/json"): "places_textsearch",
+    ("GET", "/maps/api/place/details/json"): "place_details",
+    ("POST", "/v1/images:annotate"): "vision_annotate",
+    ("POST", "/v1/chat/completions"): "openai",
+}
+
+
+def load_fixtures(fixtures_dir: str = FIXTURES_DIR) -> Dict[str, Dict[str, Any]]:
+    """fixtures ディレクトリの *.json を {ファイル名(拡張子なし): 内容} で読み込む"""
+    fixtures = {}
+    for file_name in sorted(os.listdir(fixtures_dir)):
+        if file_name.endswith(".json"):
+            with open(os.path.join(fixtures_dir, file_name), encoding="utf-8") as f:
+                fixtures[file_name[:-len(".json")]] = json.load(f)
+    return fixtures
+
+
+class StubUpstreamServer:
+    """記録済みレスポンスを返す外部APIのスタブ (別スレッドで動く ThreadingHTTPServer)"""
+    def __init__(self, fixtures: Optional[Dict[str, Dict[str, Any]]] = None, latency_scale: float = 1.0,
+                 host: str = "127.0.0.1", port: int = 0):
+        self.fixtures = fixtures if fixtures is not None else load_fixtures()
+        self.latency_scale = latency_scale
+        self.request_counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="okosy-bench-stub", daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "StubUpstreamServer":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def _count(self, route: str) -> None:
+        with self._lock:
+            self.request_counts[route] = self.request_counts.get(route, 0) + 1
+
+    def _sleep(self, fixture: Dict[str, Any], fraction: float = 1.0) -> None:
+        delay = fixture.get("latency_ms", 0) / 1000 * self.latency_scale * fraction
+        if delay > 0:
+            time.sleep(delay)
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1" # keep-alive (アプリ側の接続プールを有効に使う)
+
+            def log_message(self, format: str, *args: Any) -> None:
+                pass # リクエストごとのアクセスログは出さない
+
+            def _send_json(self, body: Any, status: int = 200) -> None:
+                data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _read_json(self) -> Dict[str, Any]:
+                length = int(self.headers.get("Content-Length") or 0)
+                return json.loads(self.rfile.read(length) or b"{}")
+
+            def _dispatch(self, method: str) -> None:
+                route = ROUTES.get((method, urlparse(self.path).path))
+                if route is None:
+                    self._send_json({"error": f"no stub for {method} {self.path}"}, 404)
+                    return
+                server._count(route)
+                if route == "openai":
+                    self._chat_completions(self._read_json())
+                    return
+                fixture = server.fixtures[route]
+                if route == "vision_annotate":
+                    # リクエストの画像枚数分だけ同じ注釈を返す
+                    image_count = len(self._read_json().get("requests", []))
+                    body = {"responses": [fixture["response"]] * image_count}
+                else:
+                    body = fixture["response"]
+                server._sleep(fixture)
+                self._send_json(body)
+
+            def _chat_completions(self, request: Dict[str, Any]) -> None:
+                # Tool Call の結果を含む2回目の呼び出しには、しおり本文の応答を返す
+                has_tool_results = any(m.get("role") == "tool" for m in request.get("messages", []))
+                fixture = server.fixtures["openai_itinerary" if has_tool_results else "openai_tool_calls"]
+                if not request.get("stream"):
+                    server._sleep(fixture)
+                    self._send_json(fixture["response"])
+                    return
+                self._stream_chat_completion(fixture, bool((request.get("stream_options") or {}).get("include_usage")))
+
+            def _stream_chat_completion(self, fixture: Dict[str, Any], include_usage: bool) -> None:
+                """記録済みの応答を SSE のチャンクに分けて返す (待ち時間は最初のチャンクまでに2割、残りを本文に配分)"""
+                response = fixture["response"]
+                choice = response["choices"][0]
+                content = choice["message"].get("content") or ""
+                pieces = [content[i:i + STREAM_CHUNK_CHARS] for i in range(0, len(content), STREAM_CHUNK_CHARS)] or [""]
+                base = {"id": response["id"], "object": "chat.completion.chunk", "created": response["created"], "model": response["model"]}
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                server._sleep(fixture, 0.2)
+                for i, piece in enumerate(pieces):
+                    delta = {"role": "assistant", "content": piece} if i == 0 else {"content": piece}
+                    self._write_event({**base, "choices": [{"index": 0, "delta": delta, "finish_reason": None}]})
+                    server._sleep(fixture, 0.8 / len(pieces))
+                self._write_event({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": choice["finish_reason"]}]})
+                if include_usage:
+                    self._write_event({**base, "choices": [], "usage": response.get("usage")})
+                self._write_chunk(b"data: [DONE]\n\n")
+                self._write_chunk(b"")
+
+            def _write_event(self, event: Dict[str, Any]) -> None:
+                self._write_chunk(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode("utf-8"))
+
+            def _write_chunk(self, data: bytes) -> None:
+                self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+                self.wfile.flush()
+
+            def do_GET(self) -> None:
+                self._dispatch("GET")
+
+            def do_POST(self) -> None:
+                self._dispatch("POST")
+
+        return Handler
@@ -0,0 +1,5 @@
+# -*- coding: utf-8 -*-
+"""
+Okosy のアプリ本体 (okosy.py) から使う、Firestore / Places / Vision / OpenAI の各レイヤー。
+各モジュールはプロセスで一度だけ読み込まれ、重いクライアントは okosy_core.clients で遅延初期化される。
+"""
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""思い出写真などのバイナリを保存する写真ストレージ (Blob Store)"""
+import os
+from typing import Any, Dict, Optional
+
+import streamlit as st
+
+from okosy_core import config
+from okosy_core.clients import init_firebase_admin
+from okosy_core.logs import get_logger
+
+logger = get_logger("blob_store")
+
+
+class BlobStore:
+    """思い出写真などのバイナリを保存するストレージの共通インターフェース"""
+    def put(self, key: str, data: bytes, content_type: str) -> None:
+        raise NotImplementedError
+
+    def get(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+class LocalFileBlobStore(BlobStore):
+    """ローカルファイルシステムに保存する実装 (開発・テスト用)"""
+    def __init__(self, root_dir: str):
+        self.root_dir = os.path.abspath(root_dir)
+
+    def _path(self, key: str) -> str:
+        path = os.path.abspath(os.path.join(self.root_dir, key))
+        if not path.startswith(self.root_dir + os.sep):
+            raise ValueError(f"Invalid blob key: {key}")
+        return path
+
+    def put(self, key: str, data: bytes, content_type: str) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def delete(self, key: str) -> None:
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+class FirebaseStorageBlobStore(BlobStore):
+    """Firebase Storage (Cloud Storage) に保存する実装"""
+    def __init__(self, bucket_name: Optional[str] = None):
+        from firebase_admin import storage
+        init_firebase_admin()
+        self.bucket = storage.bucket(bucket_name)
+
+    def put(self, key: str, data: bytes, content_type: str) -> None:
+        blob = self.bucket.blob(key)
+        blob.cache_control = "private, max-age=86400"
+        blob.upload_from_string(data, content_type=content_type)
+
+    def get(self, key: str) -> Optional[bytes]:
+        blob = self.bucket.blob(key)
+        try:
+            return blob.download_as_bytes()
+        except Exception as e:
+            logger.warning(f"Failed to download blob {key}: {e}")
+            return None
+
+    def delete(self, key: str) -> None:
+        try:
+            self.bucket.blob(key).delete()
+        except Exception as e:
+            logger.warning(f"Failed to delete blob {key}: {e}")
+
+@st.cache_resource
+def get_blob_store() -> BlobStore:
+    """
+    設定に応じた写真ストレージを返す (プロセス全体で共有)。
+    Firebase Storage のバケットが未設定の場合は、ローカルに保存せず RuntimeError を送出する (起動時に呼んで検知する)
+    """
+    if config.BLOB_STORE_BACKEND == "local":
+        logger.warning(f"Using local blob store: {config.BLOB_STORE_LOCAL_DIR} (development/testing only; not shared between instances).")
+        return LocalFileBlobStore(config.BLOB_STORE_LOCAL_DIR)
+    if config.BLOB_STORE_BACKEND != "firebase":
+        raise RuntimeError(f"BLOB_STORE_BACKEND の値が不正です: {config.BLOB_STORE_BACKEND} (firebase または local)")
+    if not config.FIREBASE_STORAGE_BUCKET:
+        raise RuntimeError(
+            "FIREBASE_STORAGE_BUCKET が設定されていません。思い出写真を保存する Firebase Storage のバケットを設定してください"
+            " (開発・テストでローカルに保存する場合は BLOB_STORE_BACKEND=local を指定してください)。"
+        )
+    logger.info(f"Using Firebase Storage blob store (bucket: {config.FIREBASE_STORAGE_BUCKET}).")
+    return FirebaseStorageBlobStore(config.FIREBASE_STORAGE_BUCKET)
+
+@st.cache_data(ttl=3600, max_entries=500, show_spinner=False)
+def fetch_blob(key: str) -> Optional[bytes]:
+    """写真ストレージからバイナリを取得する (再実行ごとに取得し直さないようキャッシュ)"""
+    return get_blob_store().get(key)
+
+def memory_blob_key(user_id: str, itinerary_id: str, memory_id: str, variant: str, content_type: str) -> str:
+    """思い出写真の保存キーを作る (variant: "photo" または "thumbnail")"""
+    extension = content_type.split("/")[-1]
+    return f"users/{user_id}/itineraries/{itinerary_id}/memories/{memory_id}/{variant}.{extension}"
+
+def delete_memory_blobs(memory_data: Dict[str, Any]) -> None:
+    """思い出ドキュメントが参照している写真を写真ストレージから削除する"""
+    for ref_field in ("photo_ref", "thumbnail_ref"):
+        blob_key = memory_data.get(ref_field)
+        if blob_key:
+            get_blob_store().delete(blob_key)
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+重いクライアント (OpenAI(非同期) / Firebase Admin / Firestore / Firebase Auth コンポーネント / Vision 認証情報) の初期化。
+いずれも st.cache_resource でプロセス全体に1つだけ生成し、Streamlit の再実行ごとには作り直さない。
+初期化に失敗した場合は例外を送出する (キャッシュされないため、次回の呼び出しで再試行される)。
+"""
+import json
+import os
+import threading
+from typing import Any, Dict
+
+import streamlit as st
+
+from okosy_core import config
+from okosy_core.http_engine import get_http_engine
+from okosy_core.logs import get_logger
+
+logger = get_logger("clients")
+
+
+@st.cache_resource(show_spinner=False)
+def get_async_openai_client():
+    """
+    OpenAI の非同期クライアントを返す (HTTPエンジンの接続プールとホストごとの同時実行数の制限を共有し、
+    エンジンのイベントループ上で使う)。
+    再試行は okosy_core.resilience で期限・サーキットブレーカーと合わせて行うため、SDK 側の再試行は無効にする。
+    """
+    from openai import AsyncOpenAI
+    return AsyncOpenAI(api_key=config.OPENAI_API_KEY, base_url=config.OPENAI_BASE_URL,
+                       http_client=get_http_engine().client, max_retries=0)
+
+
+@st.cache_resource(show_spinner=False)
+def init_firebase_admin():
+    """Firebase Admin SDK を初期化し、アプリを返す"""
+    import firebase_admin
+    from firebase_admin import credentials
+    if firebase_admin._apps:
+        return firebase_admin.get_app()
+    if not os.path.exists(config.SERVICE_ACCOUNT_KEY_PATH):
+        raise FileNotFoundError(
+            f"Firebase サービスアカウントキーが見つかりません: {config.SERVICE_ACCOUNT_KEY_PATH}\n"
+            ".envファイルで FIREBASE_SERVICE_ACCOUNT_KEY_PATH を設定するか、パスを直接指定してください。"
+        )
+    cred = credentials.Certificate(config.SERVICE_ACCOUNT_KEY_PATH)
+    firebase_options = {"storageBucket": config.FIREBASE_STORAGE_BUCKET} if config.FIREBASE_STORAGE_BUCKET else None
+    app = firebase_admin.initialize_app(cred, firebase_options)
+    logger.info("Firebase Admin SDK initialized successfully.")
+    return app
+
+
+@st.cache_resource(show_spinner=False)
+def get_firestore_client():
+    """Firestore クライアントを返す"""
+    from firebase_admin import firestore
+    init_firebase_admin()
+    db = firestore.client()
+    logger.info("Firestore client initialized successfully.")
+    return db
+
+
+@st.cache_resource(show_spinner=False)
+def get_firebase_web_config() -> Dict[str, Any]:
+    """Firebase Web アプリ設定を読み込む"""
+    if not os.path.exists(config.FIREBASE_CONFIG_PATH):
+        raise FileNotFoundError(
+            f"Firebase Web 設定ファイルが見つかりません: {config.FIREBASE_CONFIG_PATH}\n"
+            ".envファイルで FIREBASE_CONFIG_PATH を設定するか、パスを直接指定してください。"
+        )
+    with open(config.FIREBASE_CONFIG_PATH) as f:
+        return json.load(f)
+
+
+@st.cache_resource(show_spinner=False)
+def get_auth_component():
+    """streamlit-firebase-auth の認証コンポーネントを返す"""
+    try:
+        import streamlit_firebase_auth as sfa
+    except ImportError as e:
+        raise ImportError("認証ライブラリが見つかりません。`pip install streamlit-firebase-auth` を実行してください。") from e
+    return sfa.FirebaseAuth(get_firebase_web_config())
+
+
+class VisionCredentials:
+    """Vision API 用のサービスアカウント認証情報。アクセストークンは期限切れ時のみ更新する (スレッドセーフ)"""
+    def __init__(self, key_path: str):
+        from google.oauth2 import service_account
+        self._credentials = service_account.Credentials.from_service_account_file(
+            key_path,
+            scopes=["https://www.googleapis.com/auth/cloud-platform"],
+        )
+        self._lock = threading.Lock()
+
+    def access_token(self) -> str:
+        with self._lock:
+            # トークンが有効か確認し、必要ならリフレッシュ
+            if not self._credentials.valid:
+                from google.auth.transport.requests import Request
+                self._credentials.refresh(Request())
+            return self._credentials.token
+
+
+@st.cache_resource(show_spinner=False)
+def get_vision_credentials() -> VisionCredentials:
+    """Vision API 用の認証情報を返す (GOOGLE_APPLICATION_CREDENTIALS が未設定なら例外)"""
+    if not config.GOOGLE_APPLICATION_CREDENTIALS:
+        raise RuntimeError("環境変数 GOOGLE_APPLICATION_CREDENTIALS が設定されていません。")
+    return VisionCredentials(config.GOOGLE_APPLICATION_CREDENTIALS)
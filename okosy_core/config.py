@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""環境変数の読み込みと設定値 (プロセスで一度だけ読み込まれる)"""
+import os
+
+from dotenv import load_dotenv
+
+# --- 環境変数の読み込みと初期設定 ---
+load_dotenv()
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+GOOGLE_PLACES_API_KEY = os.getenv("GOOGLE_PLACES_API_KEY")
+SERVICE_ACCOUNT_KEY_PATH = os.getenv("FIREBASE_SERVICE_ACCOUNT_KEY_PATH", "path/to/your/serviceAccountKey.json")
+FIREBASE_CONFIG_PATH = os.getenv("FIREBASE_CONFIG_PATH", "path/to/your/firebase_config.json")
+GOOGLE_APPLICATION_CREDENTIALS = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
+# 思い出写真の保存先 ("firebase": Firebase Storage (FIREBASE_STORAGE_BUCKET が必須) / "local": ローカルファイル)。
+# "local" はコンテナのディスクに保存され、再起動やインスタンス間で共有されないため、開発・テスト用に明示的に指定した場合のみ使う
+FIREBASE_STORAGE_BUCKET = os.getenv("FIREBASE_STORAGE_BUCKET")
+BLOB_STORE_BACKEND = os.getenv("BLOB_STORE_BACKEND", "firebase").lower()
+BLOB_STORE_LOCAL_DIR = os.getenv("BLOB_STORE_LOCAL_DIR", "blob_store")
+# しおり・思い出データの保存先 ("firestore" / "sqlite": ローカルの SQLite ファイル。単一ノードでの運用・開発用)
+STORAGE_BACKEND = os.getenv("OKOSY_STORAGE_BACKEND", "firestore").lower()
+SQLITE_STORE_PATH = os.getenv("OKOSY_SQLITE_STORE_PATH", "okosy_data_noauth.db")
+# 過去のしおり一覧で1回に読み込む件数
+ITINERARY_PAGE_SIZE = int(os.getenv("ITINERARY_PAGE_SIZE", "20"))
+# Firestore のスナップショットリスナーで他タブ・他端末での変更を検知し、読み込みキャッシュを破棄するか
+FIRESTORE_SNAPSHOT_LISTENERS = os.getenv("FIRESTORE_SNAPSHOT_LISTENERS", "0") in ("1", "true", "True")
+# Firestore のバッチ書き込み上限 (1バッチ500件) と、しおり削除時に並列コミットするバッチ数
+FIRESTORE_BATCH_LIMIT = 500
+CASCADE_DELETE_MAX_WORKERS = max(1, int(os.getenv("CASCADE_DELETE_MAX_WORKERS", "4")))
+# 1回のモデル応答に含まれるTool Callを並列実行する際の、セッションあたりの最大並列数
+PLACES_MAX_CONCURRENCY = max(1, int(os.getenv("PLACES_MAX_CONCURRENCY", "4")))
+# Places Text Search レスポンスキャッシュの有効期限(秒)とメモリ予算(バイト)
+PLACES_CACHE_TTL_SECONDS = float(os.getenv("PLACES_CACHE_TTL_SECONDS", str(6 * 60 * 60)))
+PLACES_CACHE_MAX_BYTES = int(os.getenv("PLACES_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+# 都道府県の代表座標テーブル (refresh_prefecture_centroids.py で再生成)
+PREFECTURE_CENTROIDS_PATH = os.getenv("PREFECTURE_CENTROIDS_PATH", "assets/prefecture_centroids.json")
+# ジオコーディング結果のメモ化期間(秒)。見つからなかった住所は短めに保持する
+GEOCODE_CACHE_TTL_SECONDS = float(os.getenv("GEOCODE_CACHE_TTL_SECONDS", str(24 * 60 * 60)))
+GEOCODE_NEGATIVE_CACHE_TTL_SECONDS = float(os.getenv("GEOCODE_NEGATIVE_CACHE_TTL_SECONDS", str(60 * 60)))
+# しおり生成(2回目のOpenAI呼び出し)をストリーミングで逐次表示するか、およびその再描画間隔(秒)
+OPENAI_STREAM_OUTPUT = os.getenv("OPENAI_STREAM_OUTPUT", "1") not in ("0", "false", "False")
+STREAM_RENDER_INTERVAL_SECONDS = float(os.getenv("STREAM_RENDER_INTERVAL_SECONDS", "0.1"))
+# しおり生成ジョブ (同時に実行するジョブ数 / 完了したジョブを保持する秒数 / 画面側のポーリング間隔(秒))
+GENERATION_JOB_WORKERS = max(1, int(os.getenv("GENERATION_JOB_WORKERS", "4")))
+GENERATION_JOB_RETENTION_SECONDS = float(os.getenv("GENERATION_JOB_RETENTION_SECONDS", str(60 * 60)))
+GENERATION_POLL_INTERVAL_SECONDS = float(os.getenv("GENERATION_POLL_INTERVAL_SECONDS", "0.3"))
+# しおり生成に使う OpenAI のモデル
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o")
+# 推定コスト計算に使う単価 (USD / 100万トークン。既定値は gpt-4o)
+OPENAI_PRICE_INPUT_PER_1M_TOKENS = float(os.getenv("OPENAI_PRICE_INPUT_PER_1M_TOKENS", "2.50"))
+OPENAI_PRICE_OUTPUT_PER_1M_TOKENS = float(os.getenv("OPENAI_PRICE_OUTPUT_PER_1M_TOKENS", "10.00"))
+# 2回目のOpenAI呼び出しに送るTool Callの結果を、モデルが必要とする項目 (name, place_id, rating, 営業状況, 営業時間) だけに絞るか
+OPENAI_COMPACT_TOOL_RESULTS = os.getenv("OPENAI_COMPACT_TOOL_RESULTS", "0") in ("1", "true", "True")
+# 利用状況 (トークン数・コスト) を閲覧できる管理者のメールアドレス (カンマ区切り) と、画面に表示する直近の生成件数
+ADMIN_EMAILS = {e.strip().casefold() for e in os.getenv("OKOSY_ADMIN_EMAILS", "").split(",") if e.strip()}
+USAGE_LOG_MAX_ENTRIES = int(os.getenv("USAGE_LOG_MAX_ENTRIES", "200"))
+# 生成済みしおりのキャッシュ (任意機能: 有効にするか / SQLiteファイル / 有効期限(秒) / サイズ上限(バイト))
+ITINERARY_CACHE_ENABLED = os.getenv("ITINERARY_CACHE_ENABLED", "0") in ("1", "true", "True")
+ITINERARY_CACHE_PATH = os.getenv("ITINERARY_CACHE_PATH", "okosy_itinerary_cache.db")
+ITINERARY_CACHE_TTL_SECONDS = float(os.getenv("ITINERARY_CACHE_TTL_SECONDS", str(7 * 24 * 60 * 60)))
+ITINERARY_CACHE_MAX_BYTES = int(os.getenv("ITINERARY_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Place Details による場所データの補完 (任意機能: 有効にするか / SQLiteファイル / 1回の生成で補完する最大件数 /
+# 1回の呼び出しのタイムアウト(秒) / 補完全体に使う最大秒数)。
+# Place Details は1件ごとに課金され (opening_hours を含むため Basic に加えて Contact Data の料金もかかる)、
+# 2回目の OpenAI 呼び出しの前に待ち時間が増える。有効にすると、1回の生成でキャッシュに無い場所を最大 PLACE_DETAILS_MAX_PLACES 件取得する
+PLACE_DETAILS_ENABLED = os.getenv("PLACE_DETAILS_ENABLED", "0") in ("1", "true", "True")
+PLACE_DETAILS_CACHE_PATH = os.getenv("PLACE_DETAILS_CACHE_PATH", "okosy_place_details.db")
+PLACE_DETAILS_MAX_PLACES = int(os.getenv("PLACE_DETAILS_MAX_PLACES", "8"))
+PLACE_DETAILS_TIMEOUT_SECONDS = float(os.getenv("PLACE_DETAILS_TIMEOUT_SECONDS", "10"))
+PLACE_DETAILS_BUDGET_SECONDS = float(os.getenv("PLACE_DETAILS_BUDGET_SECONDS", "20"))
+# Place Details のキャッシュの項目ごとの有効期限(秒)。営業時間・営業状況は変わりやすいので短めにする
+PLACE_DETAILS_FIELD_TTL_SECONDS = {
+    "geometry": float(os.getenv("PLACE_DETAILS_TTL_GEOMETRY_SECONDS", str(30 * 24 * 60 * 60))),
+    "business_status": float(os.getenv("PLACE_DETAILS_TTL_BUSINESS_STATUS_SECONDS", str(24 * 60 * 60))),
+    "opening_hours": float(os.getenv("PLACE_DETAILS_TTL_OPENING_HOURS_SECONDS", str(24 * 60 * 60))),
+    "photos": float(os.getenv("PLACE_DETAILS_TTL_PHOTOS_SECONDS", str(7 * 24 * 60 * 60))),
+}
+# 場所の座標から日ごとの訪問順を計算し、2回目のOpenAI呼び出しにルート案として渡すか
+ROUTE_PLANNING_ENABLED = os.getenv("ROUTE_PLANNING_ENABLED", "1") not in ("0", "false", "False")
+# 外部APIのベースURL (ベンチマークなどでローカルのスタブサーバーに向ける場合に変更する。OpenAI は未指定なら SDK の既定値)
+GOOGLE_MAPS_BASE_URL = os.getenv("OKOSY_GOOGLE_MAPS_BASE_URL", "https://maps.googleapis.com").rstrip("/")
+VISION_BASE_URL = os.getenv("OKOSY_VISION_BASE_URL", "https://vision.googleapis.com").rstrip("/")
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+# 外部API呼び出しの接続プール (全体の最大接続数 / ホストごとの同時リクエスト数 / HTTP/2 を使うか)
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_CONNECTIONS_PER_HOST = int(os.getenv("HTTP_MAX_CONNECTIONS_PER_HOST", "20"))
+HTTP_ENABLE_HTTP2 = os.getenv("HTTP_ENABLE_HTTP2", "1") not in ("0", "false", "False")
+# 外部API呼び出しの再試行 (最大試行回数 / ジッター付き指数バックオフの初期値・上限(秒))
+RETRY_MAX_ATTEMPTS = max(1, int(os.getenv("RETRY_MAX_ATTEMPTS", "3")))
+RETRY_BASE_DELAY_SECONDS = float(os.getenv("RETRY_BASE_DELAY_SECONDS", "0.5"))
+RETRY_MAX_DELAY_SECONDS = float(os.getenv("RETRY_MAX_DELAY_SECONDS", "4"))
+# サーキットブレーカー (連続失敗回数の閾値 / 遮断してから再試行を許可するまでの秒数)
+CIRCUIT_FAILURE_THRESHOLD = max(1, int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5")))
+CIRCUIT_RESET_SECONDS = float(os.getenv("CIRCUIT_RESET_SECONDS", "30"))
+# しおり生成1回あたりの期限(秒)と、そのうち最後のOpenAI呼び出し(しおり本文の生成)のために残しておく秒数
+GENERATION_DEADLINE_SECONDS = float(os.getenv("OKOSY_GENERATION_DEADLINE_SECONDS", "180"))
+GENERATION_FINAL_CALL_RESERVE_SECONDS = float(os.getenv("OKOSY_GENERATION_FINAL_CALL_RESERVE_SECONDS", "90"))
+# 外部API 1回あたりのタイムアウト(秒)。期限の残り時間が短い場合はそちらを優先する
+OPENAI_TIMEOUT_SECONDS = float(os.getenv("OPENAI_TIMEOUT_SECONDS", "120"))
+PLACES_TIMEOUT_SECONDS = float(os.getenv("PLACES_TIMEOUT_SECONDS", "15"))
+GEOCODE_TIMEOUT_SECONDS = float(os.getenv("GEOCODE_TIMEOUT_SECONDS", "10"))
+VISION_TIMEOUT_SECONDS = float(os.getenv("VISION_TIMEOUT_SECONDS", "30"))
+# Vision API images:annotate の1リクエストあたりの上限 (画像枚数 / JSONサイズ)
+VISION_MAX_IMAGES_PER_REQUEST = int(os.getenv("VISION_MAX_IMAGES_PER_REQUEST", "16"))
+VISION_MAX_REQUEST_BYTES = int(os.getenv("VISION_MAX_REQUEST_BYTES", str(10 * 1024 * 1024)))
+# アップロード画像の前処理プロファイル (長辺の最大px / 出力形式 / 画質)
+IMAGE_PROFILES = {
+    # ラベル検出用: Vision API はこの程度の解像度で十分
+    "label": {"max_side": int(os.getenv("IMAGE_LABEL_MAX_SIDE", "640")), "format": "JPEG", "quality": 80},
+    # 思い出アルバムの表示用
+    "album": {"max_side": int(os.getenv("IMAGE_ALBUM_MAX_SIDE", "1600")), "format": "WEBP", "quality": 82},
+    # 思い出アルバムの一覧(3カラム)用サムネイル
+    "thumbnail": {"max_side": int(os.getenv("IMAGE_THUMBNAIL_MAX_SIDE", "480")), "format": "WEBP", "quality": 75},
+}
+
+# ログ (レベル / 処理段階ごとの所要時間などを書き出す JSON Lines ファイル (空なら出力しない) /
+# ペイロードのプレビューの最大文字数 / DEBUG 時にペイロードを出力する割合)
+LOG_LEVEL = os.getenv("OKOSY_LOG_LEVEL", "INFO").upper()
+LOG_JSONL_PATH = os.getenv("OKOSY_LOG_JSONL_PATH", "")
+LOG_PREVIEW_CHARS = int(os.getenv("OKOSY_LOG_PREVIEW_CHARS", "2000"))
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv("OKOSY_LOG_PAYLOAD_SAMPLE_RATE", "0.1"))
+# トレース (管理者画面で集計するスパンの保持件数 / OpenTelemetry への出力の有無 / サービス名)
+TRACE_BUFFER_SIZE = int(os.getenv("OKOSY_TRACE_BUFFER_SIZE", "5000"))
+OTEL_EXPORT_ENABLED = os.getenv("OKOSY_OTEL_EXPORT", "0").lower() in ("1", "true", "yes")
+OTEL_SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "okosy")
+
+# --- 認証設定 (Vision API用) ---
+if GOOGLE_APPLICATION_CREDENTIALS:
+    os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = GOOGLE_APPLICATION_CREDENTIALS
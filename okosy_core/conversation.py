@@ -0,0 +1,374 @@
+# -*- coding: utf-8 -*-
+"""OpenAI Function Calling (Tool Calling) によるしおり生成"""
+import json
+import math
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+import openai
+
+from okosy_core import config
+from okosy_core.clients import get_async_openai_client
+from okosy_core.http_engine import get_http_engine
+from okosy_core.notices import STREAMLIT_NOTICES
+from okosy_core.place_details import enrich_place_groups
+from okosy_core.place_records import PlaceGroup, place_group_from_tool_result
+from okosy_core.places import resolve_coordinates, search_google_places
+from okosy_core.resilience import Deadline, UpstreamUnavailableError, call_with_resilience
+from okosy_core.routing import plan_routes, route_guidance
+from okosy_core.usage import GenerationUsage
+from okosy_core.vision import get_vision_labels_from_uploaded_images
+from okosy_core.logs import get_logger, log_payload, preview, redact, stage_timer
+
+logger = get_logger("conversation")
+
+
+# --- OpenAI Function Calling (Tool Calling) 準備 ---
+tools = [
+    {
+        "type": "function",
+        "function": {
+            "name": "search_google_places",
+            "description": "Google Places APIを使って観光名所、レストラン、宿泊施設などを検索します。特定の場所（例: 静かなカフェ、評価の高い旅館）の情報が必要な場合に使用してください。",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "query": {"type": "string", "description": "検索キーワード (例: '京都 抹茶 スイーツ', '箱根 温泉旅館 露天風呂付き')"},
+                    "location_bias": {"type": "string", "description": "検索の中心とする緯度経度 (例: '35.0116,135.7681')。目的地の座標を指定すると精度が向上します。"},
+                    "place_type": {
+                        "type": "string",
+                        "description": "検索する場所の種類。適切なものを選択してください。",
+                        "enum": [
+                            "tourist_attraction", "restaurant", "lodging", "cafe",
+                            "museum", "park", "art_gallery", "store", "bar", "spa"
+                        ]
+                    },
+                    "min_rating": {"type": "number", "description": "結果に含める最低評価 (例: 4.0)。指定しない場合は評価でフィルタリングしません。"},
+                    "price_levels": {"type": "string", "description": "結果に含める価格帯。カンマ区切りで指定します (例: '1,2')。1:安い, 2:普通, 3:やや高い, 4:高い。"}
+                },
+                "required": ["query", "place_type"]
+            }
+        }
+    }
+]
+available_functions = {
+    "search_google_places": search_google_places
+}
+
+# --- Tool Call 実行関数 (ワーカースレッドから呼ばれる) ---
+def execute_tool_call(tool_call: Any, default_location_bias: Optional[str], deadline: Optional[Deadline] = None) -> str:
+    """1件のTool Callを実行し、ツールメッセージに載せるJSON文字列を返す (例外は送出しない)。deadline はこの呼び出しに割り当てた期限"""
+    function_name = tool_call.function.name
+    function_to_call = available_functions.get(function_name)
+    if not function_to_call:
+        logger.warning(f"Error: Function '{function_name}' not found.")
+        return json.dumps({"error": f"Function '{function_name}' not found."}, ensure_ascii=False)
+    try:
+        function_args = json.loads(tool_call.function.arguments)
+        logger.info("Calling function: %s with args: %s", function_name, preview(function_args, 500))
+        if function_name == 'search_google_places' and 'location_bias' not in function_args and default_location_bias:
+            function_args['location_bias'] = default_location_bias
+            logger.info(f"Added location_bias: {default_location_bias}")
+        function_args['deadline'] = deadline # モデルの引数ではなく、呼び出し側が割り当てた期限を渡す
+        with stage_timer(f"tool.{function_name}"):
+            function_response_str = function_to_call(**function_args)
+        log_payload(logger, f"Function response ({function_name})", function_response_str)
+        return function_response_str
+    except json.JSONDecodeError as json_err:
+        logger.warning(f"Error decoding JSON arguments for {function_name}: {preview(tool_call.function.arguments, 500)}. Error: {json_err}")
+        return json.dumps({"error": f"Argument decoding error: {json_err}"}, ensure_ascii=False)
+    except Exception as e:
+        logger.exception(f"Error executing function {function_name} or processing its response: {e}")
+        return json.dumps({"error": f"Function execution error: {redact(str(e))}"}, ensure_ascii=False)
+
+def _tool_arguments(tool_call: Any) -> Dict[str, Any]:
+    """Tool Call の引数 (JSON) を辞書で返す (不正な場合は空の辞書)"""
+    try:
+        arguments = json.loads(tool_call.function.arguments)
+    except (json.JSONDecodeError, TypeError):
+        return {}
+    return arguments if isinstance(arguments, dict) else {}
+
+# --- Tool Call 結果への補完項目の追加 / 圧縮 ---
+DETAIL_PLACE_FIELDS = ("lat", "lng", "business_status", "opening_hours")
+COMPACT_PLACE_FIELDS = ("name", "place_id", "rating", "business_status", "opening_hours")
+
+def merge_place_details(result_str: str, group: PlaceGroup, drop_fields: tuple = ()) -> str:
+    """
+    場所のリストに、Place Details で補完した項目 (座標・営業状況・営業時間) を加える (それ以外の結果はそのまま)。
+    drop_fields の項目は除く (ルート案を渡す場合は座標をモデルに送らない)
+    """
+    try:
+        result = json.loads(result_str)
+    except json.JSONDecodeError:
+        return result_str
+    if not isinstance(result, list):
+        return result_str
+    records = {record.place_id: record for record in group.records if record.place_id}
+    for place in result:
+        record = records.get(place.get("place_id")) if isinstance(place, dict) else None
+        if record is not None:
+            place.update({k: getattr(record, k) for k in DETAIL_PLACE_FIELDS if getattr(record, k) is not None})
+        if isinstance(place, dict):
+            for k in drop_fields:
+                place.pop(k, None)
+    return json.dumps(result, ensure_ascii=False)
+
+def compact_tool_result(result_str: str) -> str:
+    """場所のリストを、しおり本文の生成に必要な項目 (name, place_id, rating, 営業状況, 営業時間) だけに絞る (それ以外の結果はそのまま)"""
+    try:
+        result = json.loads(result_str)
+    except json.JSONDecodeError:
+        return result_str
+    if not isinstance(result, list):
+        return result_str
+    compacted = [{k: place.get(k) for k in COMPACT_PLACE_FIELDS} if isinstance(place, dict) else place for place in result]
+    return json.dumps(compacted, ensure_ascii=False)
+
+# --- OpenAI 呼び出し / ストリーミング応答の逐次描画 ---
+def create_chat_completion(deadline: Optional[Deadline] = None, usage: Optional[GenerationUsage] = None,
+                           stage: str = "", **kwargs: Any) -> Any:
+    """
+    chat.completions.create を再試行 (429/5xx/接続エラー)・サーキットブレーカー・期限付きで呼び出す。
+    usage を渡すと、応答の使用量とレイテンシを stage として記録する (ストリーミングは stream_chat_completion 側で記録)
+    """
+    engine = get_http_engine()
+    client = get_async_openai_client()
+    def call() -> Any:
+        return call_with_resilience(
+            "openai",
+            lambda timeout: engine.run(client.chat.completions.create(timeout=timeout, **kwargs)),
+            config.OPENAI_TIMEOUT_SECONDS, deadline,
+        )
+    if kwargs.get("stream"):
+        return call() # ストリーミングは本文の受信まで含めて stream_chat_completion 側で計測する
+    started = time.monotonic()
+    with stage_timer(f"openai.{stage or 'call'}", model=kwargs.get("model")) as event:
+        response = call()
+        event["prompt_tokens"] = getattr(response.usage, "prompt_tokens", None)
+        event["completion_tokens"] = getattr(response.usage, "completion_tokens", None)
+    if usage is not None:
+        usage.record(stage, kwargs.get("model", ""), response.usage, time.monotonic() - started)
+    return response
+
+def stream_chat_completion(messages: List[Dict[str, Any]], on_text: Callable[[str], None],
+                           deadline: Optional[Deadline] = None,
+                           usage: Optional[GenerationUsage] = None) -> tuple[str, Optional[str]]:
+    """OpenAIの応答をストリーミングで受け取り、届いた分までの本文を on_text に渡す。(全文, finish_reason) を返す"""
+    with stage_timer("openai.second_call", model=config.OPENAI_MODEL, stream=True) as event:
+        content, finish_reason, stream_usage, latency = _read_chat_stream(messages, on_text, deadline)
+        event["prompt_tokens"] = getattr(stream_usage, "prompt_tokens", None)
+        event["completion_tokens"] = getattr(stream_usage, "completion_tokens", None)
+    if usage is not None:
+        usage.record("second_call", config.OPENAI_MODEL, stream_usage, latency)
+    return content, finish_reason
+
+def _read_chat_stream(messages: List[Dict[str, Any]], on_text: Callable[[str], None],
+                      deadline: Optional[Deadline]) -> tuple[str, Optional[str], Any, float]:
+    engine = get_http_engine()
+    started = time.monotonic()
+    # 再試行するのはストリームの開始まで (本文を受信し始めた後は再試行しない)
+    # include_usage を指定すると、最後のチャンク (choices が空) に使用量が載る
+    stream = create_chat_completion(deadline, model=config.OPENAI_MODEL, messages=messages, stream=True,
+                                    stream_options={"include_usage": True})
+    chunks: List[str] = []
+    finish_reason = None
+    stream_usage = None
+    last_render = 0.0
+    try:
+        for chunk in engine.iterate(stream):
+            if getattr(chunk, "usage", None) is not None:
+                stream_usage = chunk.usage
+            if not chunk.choices:
+                continue
+            choice = chunk.choices[0]
+            if choice.delta and choice.delta.content:
+                chunks.append(choice.delta.content)
+                # 途中経過の通知はトークンごとではなく一定間隔で行う
+                now = time.monotonic()
+                if now - last_render >= config.STREAM_RENDER_INTERVAL_SECONDS:
+                    on_text("".join(chunks))
+                    last_render = now
+            if choice.finish_reason:
+                finish_reason = choice.finish_reason
+    finally:
+        engine.run(stream.close()) # 途中で失敗しても接続とホストの同時実行枠を返す
+    content = "".join(chunks)
+    on_text(content)
+    return content, finish_reason, stream_usage, time.monotonic() - started
+
+# --- Vision APIによる画像ラベル抽出 ---
+def extract_image_labels(images: List[tuple[str, bytes]], deadline: Optional[Deadline] = None, notices=None) -> List[str]:
+    """画像 ((ファイル名, バイト列) のリスト) からVision APIでラベルを抽出する (失敗時は警告を出して空リスト)"""
+    notices = notices or STREAMLIT_NOTICES
+    if not images:
+        return []
+    logger.info(f"Processing {len(images)} images with Vision API")
+    try:
+        return get_vision_labels_from_uploaded_images(images, deadline, notices)
+    except Exception as vision_e:
+        notices.warning(f"Vision APIでの画像処理中にエラーが発生しました: {vision_e}")
+        logger.warning(f"Error during Vision API processing: {vision_e}")
+        return []
+
+# --- OpenAI API 会話実行関数 (Vision API連携版) ---
+def run_conversation_with_function_calling(messages: List[Dict[str, Any]],
+                                           image_labels: Optional[List[str]] = None,
+                                           on_text: Optional[Callable[[str], None]] = None,
+                                           destination: Optional[str] = None,
+                                           days: Optional[int] = None,
+                                           notices=None,
+                                           deadline: Optional[Deadline] = None,
+                                           usage: Optional[GenerationUsage] = None) -> tuple[Optional[str], Optional[List[PlaceGroup]]]:
+    """
+    OpenAIにメッセージを送信し、Tool Callがあれば実行して結果を返し、最終的な応答を得る。
+    image_labels (extract_image_labels で抽出した画像ラベル) がある場合、テキストとしてプロンプトに追加する。
+    on_text を渡すと、Tool Call後の応答をストリーミングで受け取り、途中までの本文を逐次渡す。
+    警告・エラーは notices に出す (バックグラウンドジョブでは NoticeSink、省略時は st.warning / st.error)。
+    destination (行き先) の座標は、location_bias を指定しなかったTool Callの検索中心に使う。
+    days (旅行日数) を渡すと、見つかった場所の座標から日ごとの訪問順を計算し、ルート案として2回目の呼び出しに含める (ROUTE_PLANNING_ENABLED)。
+    生成全体の期限 (deadline, 省略時は GENERATION_DEADLINE_SECONDS) のうち、最後の呼び出し用の時間を残して各Tool Callに残り時間を配分する。
+    usage を渡すと、各OpenAI呼び出しのトークン数とレイテンシを記録する。
+    見つかった場所は Place Details で営業時間・座標などを補完し、2回目の呼び出しと戻り値の場所データの両方に含める。
+    OPENAI_COMPACT_TOOL_RESULTS が有効なら、2回目の呼び出しに送るTool Callの結果を必要な項目だけに絞る (戻り値の場所データは絞らない)。
+    (しおり本文, 場所検索の結果 (Tool Call ごとの PlaceGroup の一覧) or None) を返す。
+    """
+    notices = notices or STREAMLIT_NOTICES
+    deadline = deadline or Deadline(config.GENERATION_DEADLINE_SECONDS)
+    try:
+        # --- 画像ラベルのプロンプトへの追加 ---
+        if image_labels:
+            label_text = "【画像から読み取れた特徴（参考）】\n" + ", ".join(image_labels)
+            logger.info(f"Vision API labels: {', '.join(image_labels)}")
+            # 最後のメッセージ(ユーザープロンプト)にラベル情報を追記
+            last_message = messages[-1]
+            # content が文字列の場合、リストに変換して追記
+            if isinstance(last_message.get('content'), str):
+                 if "【画像から読み取れた特徴（参考）】" not in last_message['content']:
+                     last_message['content'] += "\n\n" + label_text
+            # content がリストの場合 (GPT-4o/Vision用) - テキスト要素に追記
+            elif isinstance(last_message.get('content'), list):
+                 text_found = False
+                 for item in last_message['content']:
+                     if item.get("type") == "text":
+                         if "【画像から読み取れた特徴（参考）】" not in item.get("text",""):
+                             item["text"] = item.get("text","") + "\n\n" + label_text
+                         text_found = True
+                         break
+                 if not text_found: # テキスト要素がない場合(画像のみの場合など)は新規追加
+                     last_message['content'].append({"type": "text", "text": label_text})
+            else: # 想定外の形式
+                 logger.warning(f"Last message content is of unexpected type: {type(last_message.get('content'))}")
+                 # 文字列として追記を試みる
+                 try:
+                     current_content_str = json.dumps(last_message.get('content'))
+                 except TypeError:
+                     current_content_str = str(last_message.get('content', ''))
+                 last_message['content'] = current_content_str + "\n\n" + label_text
+
+        # --- 1回目のOpenAI API呼び出し ---
+        logger.info("Calling OpenAI API (1st call, %d messages)", len(messages))
+        log_payload(logger, "Messages sent (1st call)", messages)
+        response = create_chat_completion(deadline, usage, "first_call",
+                                          model=config.OPENAI_MODEL, messages=messages, tools=tools, tool_choice="auto")
+        response_message = response.choices[0].message
+        log_payload(logger, "OpenAI response (1st call)", response_message.model_dump())
+
+        finish_reason = response.choices[0].finish_reason
+        if finish_reason == "length":
+            notices.warning("⚠️ AIの応答が長すぎて途中で終了しました。プロンプトの指示を簡潔にするか、文字数制限を緩めてみてください。")
+            logger.warning("OpenAI response finished due to length.")
+        elif finish_reason != "stop" and finish_reason != "tool_calls":
+             logger.warning(f"Unexpected finish reason: {finish_reason}")
+
+        tool_calls = response_message.tool_calls
+        place_groups: List[PlaceGroup] = []
+
+        if tool_calls:
+            messages.append(response_message.model_dump())
+            # 行き先の座標は全Tool Callで共通なので一度だけ解決する
+            default_location_bias = resolve_coordinates(destination, deadline)
+            if destination and not default_location_bias:
+                logger.warning(f"Could not get coordinates for {destination}, proceeding without location_bias.")
+            max_workers = min(config.PLACES_MAX_CONCURRENCY, len(tool_calls))
+            # 最後の呼び出し用の時間を残し、残りを並列実行の段数 (waves) で割って各Tool Callの期限とする
+            waves = math.ceil(len(tool_calls) / max_workers)
+            per_call_seconds = max(0.0, deadline.remaining() - config.GENERATION_FINAL_CALL_RESERVE_SECONDS) / waves
+            logger.info(f"Executing {len(tool_calls)} tool calls (max_workers={max_workers}, budget={per_call_seconds:.1f}s each)")
+            # 全Tool Callを並列実行 (map は入力順に結果を返すため tool_call_id の順序は保たれる)
+            with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="okosy-tool") as executor:
+                tool_results = list(executor.map(
+                    lambda tc: execute_tool_call(tc, default_location_bias, deadline.child(per_call_seconds)), tool_calls
+                ))
+            groups_by_call: Dict[str, PlaceGroup] = {}
+            for tool_call, function_response_str in zip(tool_calls, tool_results):
+                if tool_call.function.name == "search_google_places":
+                    groups_by_call[tool_call.id] = place_group_from_tool_result(_tool_arguments(tool_call), function_response_str)
+            place_groups = list(groups_by_call.values())
+            # 見つかった場所の営業時間・座標などを Place Details で補完する (最後の呼び出し用の時間は残す)
+            enrich_seconds = min(config.PLACE_DETAILS_BUDGET_SECONDS,
+                                 max(0.0, deadline.remaining() - config.GENERATION_FINAL_CALL_RESERVE_SECONDS))
+            enrich_place_groups(place_groups, deadline.child(enrich_seconds))
+            # 座標から日ごとの訪問順を計算し、ルート案として渡す (モデルには座標を送らない)
+            # ルート案は参考情報なので、計算に失敗してもルート案なしで生成を続ける
+            route_plan = None
+            if config.ROUTE_PLANNING_ENABLED and days:
+                try:
+                    route_plan = plan_routes(place_groups, days, default_location_bias)
+                except Exception as e:
+                    logger.exception(f"Route planning failed; continuing without a route plan: {e}")
+            drop_fields = ("lat", "lng") if route_plan is not None else ()
+            for tool_call, function_response_str in zip(tool_calls, tool_results):
+                if tool_call.id in groups_by_call:
+                    function_response_str = merge_place_details(function_response_str, groups_by_call[tool_call.id], drop_fields)
+                messages.append({
+                    "tool_call_id": tool_call.id, "role": "tool", "name": tool_call.function.name,
+                    "content": compact_tool_result(function_response_str) if config.OPENAI_COMPACT_TOOL_RESULTS else function_response_str,
+                })
+
+            if route_plan is not None:
+                messages.append({"role": "system", "content": route_guidance(route_plan)})
+                if route_plan.skipped:
+                    logger.info(f"Route plan excludes {route_plan.skipped} places without coordinates.")
+
+            logger.info("Sending tool results back to OpenAI (2nd call, %d messages)", len(messages))
+            log_payload(logger, "Messages sent (2nd call)", messages)
+            if on_text is not None:
+                final_content, finish_reason_2 = stream_chat_completion(messages, on_text, deadline, usage)
+            else:
+                second_response = create_chat_completion(deadline, usage, "second_call", model=config.OPENAI_MODEL, messages=messages)
+                final_content = second_response.choices[0].message.content
+                finish_reason_2 = second_response.choices[0].finish_reason
+            logger.info("OpenAI response (2nd call): %d chars", len(final_content or ""))
+            log_payload(logger, "OpenAI response (2nd call)", final_content)
+
+            if finish_reason_2 == "length":
+                notices.warning("⚠️ AIの応答が長すぎて途中で終了しました。プロンプトの指示を簡潔にするか、文字数制限を緩めてみてください。")
+                logger.warning("OpenAI response (2nd call) finished due to length.")
+            elif finish_reason_2 != "stop":
+                 logger.warning(f"Unexpected finish reason (2nd call): {finish_reason_2}")
+
+            return final_content, place_groups or None
+
+        else:
+            logger.info("No tool call requested by OpenAI")
+            final_content = response_message.content
+            return final_content, None
+
+    except UpstreamUnavailableError as e:
+        notices.error(f"AIサービスが混雑しているか、時間内に応答がありませんでした。しばらくしてから再度お試しください。({e})")
+        logger.warning(f"OpenAI unavailable: {e}")
+        return "申し訳ありません、AIサービスが一時的に利用できないため、しおりを作成できませんでした。", None
+    except openai.APIError as e:
+        status_code = getattr(e, "status_code", None) # 接続エラーには HTTP ステータスがない
+        notices.error(f"OpenAI APIエラーが発生しました: HTTP Status={status_code}, Message={e.message}")
+        logger.warning(f"OpenAI API Error: Status={status_code}, Type={e.type}, Message={e.message}")
+        if getattr(e, "response", None) is not None and hasattr(e.response, 'text'): logger.warning(f"API Response Body: {preview(e.response.text, 1000)}")
+        return f"申し訳ありません、AIとの通信中にAPIエラーが発生しました。詳細: {e.message}", None
+    except Exception as e:
+        notices.error(f"AIとの通信または関数実行中に予期せぬエラーが発生しました: {e}")
+        notices.error(traceback.format_exc())
+        logger.exception("Unexpected error during conversation")
+        return "申し訳ありません、処理中に予期せぬエラーが発生しました。", None
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+行き先を決める質問 (好み入力フォームの Q1〜Q3) と、回答から都道府県を選ぶ処理。
+各回答に合う都道府県の集合を、47都道府県を1ビットずつに割り当てたビットマスク (1回答につき64bit整数1個) に
+プロセスごとに一度だけ変換しておき、候補の絞り込みはビット演算 (AND) で行う。
+候補からは、スライダーの好み (自然・歴史文化・アート・ウェルネス) と都道府県の特徴の一致度で重み付けして選ぶ。
+すべての回答に合う都道府県が無い場合は、合う回答の数が多い都道府県から選ぶ。
+"""
+import random
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import streamlit as st
+
+from okosy_core.logs import get_logger
+
+logger = get_logger("destination_quiz")
+
+PREFECTURES: Tuple[str, ...] = (
+    "北海道", "青森県", "岩手県", "宮城県", "秋田県", "山形県", "福島県", "茨城県", "栃木県", "群馬県", "埼玉県", "千葉県",
+    "東京都", "神奈川県", "新潟県", "富山県", "石川県", "福井県", "山梨県", "長野県", "岐阜県", "静岡県", "愛知県", "三重県",
+    "滋賀県", "京都府", "大阪府", "兵庫県", "奈良県", "和歌山県", "鳥取県", "島根県", "岡山県", "広島県", "山口県", "徳島県",
+    "香川県", "愛媛県", "高知県", "福岡県", "佐賀県", "長崎県", "熊本県", "大分県", "宮崎県", "鹿児島県", "沖縄県",
+)
+UNANSWERED = "選択してください"
+
+
+@dataclass(frozen=True)
+class QuizQuestion:
+    """行き先を決める質問1問。mapping の値が None の選択肢はすべての都道府県に合う"""
+    key: str
+    q: str
+    options: Tuple[str, ...]
+    mapping: Dict[str, Optional[Tuple[str, ...]]]
+
+
+QUIZ_QUESTIONS: Tuple[QuizQuestion, ...] = (
+    QuizQuestion("q0_sea_mountain", "Q1: 海と山、どっち派？", ("海", "山", "どちらでも"), {
+        "海": ("茨城県", "千葉県", "神奈川県", "静岡県", "愛知県", "三重県", "徳島県", "香川県", "高知県", "福岡県", "佐賀県", "沖縄県", "和歌山県", "兵庫県", "岡山県", "広島県", "山口県", "愛媛県", "大分県", "宮崎県", "鹿児島県", "長崎県", "熊本県", "福井県", "石川県", "富山県", "新潟県", "東京都", "宮城県", "岩手県", "青森県", "北海道"),
+        "山": ("山形県", "栃木県", "群馬県", "山梨県", "長野県", "岐阜県", "滋賀県", "奈良県", "埼玉県", "福島県", "秋田県"),
+        "どちらでも": None,
+    }),
+    QuizQuestion("q1_style", "Q2: 旅のスタイルは？", ("アクティブに観光", "ゆったり過ごす"), {
+        "アクティブに観光": ("北海道", "青森県", "岩手県", "宮城県", "秋田県", "山形県", "福島県", "茨城県", "栃木県", "群馬県", "埼玉県", "千葉県", "東京都", "神奈川県", "新潟県", "富山県", "石川県", "福井県", "長野県", "岐阜県", "静岡県", "愛知県", "三重県", "大阪府", "兵庫県", "広島県", "福岡県", "熊本県", "沖縄県"),
+        "ゆったり過ごす": ("山梨県", "滋賀県", "京都府", "奈良県", "和歌山県", "鳥取県", "島根県", "岡山県", "山口県", "徳島県", "香川県", "愛媛県", "高知県", "佐賀県", "長崎県", "大分県", "宮崎県", "鹿児島県", "沖縄県", "北海道", "青森県", "秋田県", "岩手県", "山形県", "福島県", "群馬県", "栃木県", "長野県", "岐阜県", "石川県", "富山県", "三重県", "和歌山県"),
+    }),
+    QuizQuestion("q2_atmosphere", "Q3: どんな雰囲気を感じたい？", ("和の雰囲気", "モダン・都会的", "特にこだわらない"), {
+        "和の雰囲気": ("青森県", "岩手県", "秋田県", "山形県", "福島県", "栃木県", "群馬県", "新潟県", "富山県", "石川県", "福井県", "岐阜県", "三重県", "滋賀県", "京都府", "奈良県", "和歌山県", "鳥取県", "島根県", "山口県", "徳島県", "愛媛県", "佐賀県", "長崎県", "熊本県", "大分県", "鹿児島県", "岡山県", "広島県", "香川県", "高知県"),
+        "モダン・都会的": ("北海道", "宮城県", "埼玉県", "千葉県", "東京都", "神奈川県", "静岡県", "愛知県", "京都府", "大阪府", "兵庫県", "広島県", "福岡県"),
+        "特にこだわらない": None,
+    }),
+)
+
+# スライダーの好みの項目 (preferences のキー) と、各都道府県の特徴の強さ (1〜3, 項目の順)
+PREFERENCE_TRAITS = ("nature", "culture", "art", "welness")
+PREFECTURE_TRAITS: Dict[str, Tuple[int, int, int, int]] = {
+    "北海道": (3, 1, 2, 3), "青森県": (3, 2, 2, 2), "岩手県": (3, 2, 1, 2), "宮城県": (2, 2, 1, 2), "秋田県": (3, 2, 1, 3),
+    "山形県": (3, 2, 1, 3), "福島県": (3, 2, 1, 2), "茨城県": (2, 1, 1, 1), "栃木県": (3, 3, 1, 3), "群馬県": (3, 1, 1, 3),
+    "埼玉県": (1, 2, 1, 1), "千葉県": (2, 1, 1, 1), "東京都": (1, 3, 3, 1), "神奈川県": (2, 3, 2, 3), "新潟県": (3, 2, 2, 2),
+    "富山県": (3, 2, 2, 2), "石川県": (2, 3, 3, 2), "福井県": (2, 2, 1, 1), "山梨県": (3, 1, 1, 2), "長野県": (3, 2, 1, 3),
+    "岐阜県": (3, 3, 1, 3), "静岡県": (3, 2, 1, 3), "愛知県": (1, 2, 2, 1), "三重県": (2, 3, 1, 2), "滋賀県": (2, 3, 1, 1),
+    "京都府": (1, 3, 3, 1), "大阪府": (1, 2, 2, 1), "兵庫県": (2, 2, 2, 3), "奈良県": (2, 3, 1, 1), "和歌山県": (3, 3, 1, 3),
+    "鳥取県": (3, 1, 1, 2), "島根県": (2, 3, 2, 2), "岡山県": (2, 2, 2, 1), "広島県": (2, 3, 2, 1), "山口県": (2, 2, 1, 1),
+    "徳島県": (3, 1, 2, 1), "香川県": (2, 2, 3, 1), "愛媛県": (2, 2, 1, 3), "高知県": (3, 2, 1, 1), "福岡県": (1, 2, 2, 1),
+    "佐賀県": (2, 2, 2, 2), "長崎県": (2, 3, 1, 1), "熊本県": (3, 2, 1, 3), "大分県": (3, 1, 1, 3), "宮崎県": (3, 2, 1, 1),
+    "鹿児島県": (3, 2, 1, 3), "沖縄県": (3, 2, 1, 1),
+}
+# 重み付けの強さ (一致度をこの指数で強調してから抽選する。大きいほど一致度の高い都道府県に偏る)
+SCORE_SHARPNESS = 4.0
+
+
+class DestinationQuizIndex:
+    """回答ごとの都道府県のビットマスクと、都道府県の特徴の行列 (プロセスごとに一度だけ作る)"""
+    def __init__(self, questions: Tuple[QuizQuestion, ...] = QUIZ_QUESTIONS,
+                 prefectures: Tuple[str, ...] = PREFECTURES):
+        self.questions = questions
+        self.prefectures = prefectures
+        self.all_mask = (1 << len(prefectures)) - 1
+        bit = {name: 1 << i for i, name in enumerate(prefectures)}
+        self.answer_masks: Dict[Tuple[str, str], int] = {}
+        self.answer_vectors: Dict[Tuple[str, str], np.ndarray] = {} # 同じ内容の 0/1 配列 (合う回答の数の集計用)
+        for question in questions:
+            for option in question.options:
+                names = question.mapping.get(option)
+                mask = self.all_mask if names is None else 0
+                for name in names or ():
+                    mask |= bit[name]
+                self.answer_masks[(question.key, option)] = mask
+                self.answer_vectors[(question.key, option)] = np.array([mask >> i & 1 for i in range(len(prefectures))])
+        self.traits = np.array([PREFECTURE_TRAITS[name] for name in prefectures], dtype=float)
+
+    def mask_members(self, mask: int) -> List[int]:
+        """ビットマスクに含まれる都道府県の番号"""
+        return [i for i in range(len(self.prefectures)) if mask >> i & 1]
+
+    def candidate_mask(self, answers: Dict[str, str]) -> int:
+        """すべての回答に合う都道府県のビットマスク ({質問のキー: 選択肢}。未回答の質問は絞り込まない)"""
+        mask = self.all_mask
+        for (key, option), answer_mask in self.answer_masks.items():
+            if answers.get(key) == option:
+                mask &= answer_mask
+        return mask
+
+    def matched_answer_counts(self, answers: Dict[str, str]) -> np.ndarray:
+        """都道府県ごとの、合う回答の数"""
+        counts = np.zeros(len(self.prefectures), dtype=int)
+        for (key, option), vector in self.answer_vectors.items():
+            if answers.get(key) == option:
+                counts += vector
+        return counts
+
+    def preference_scores(self, preferences: Dict[str, int]) -> np.ndarray:
+        """スライダーの好み (1〜5) と都道府県の特徴の一致度 (特徴の加重平均, 1〜3)"""
+        weights = np.array([float(preferences.get(trait) or 3) for trait in PREFERENCE_TRAITS])
+        return self.traits @ weights / weights.sum()
+
+    def choose_destination(self, answers: Dict[str, str], preferences: Dict[str, int],
+                           rng: Optional[random.Random] = None) -> Tuple[str, bool]:
+        """
+        回答と好みから行き先を1つ選び、(都道府県名, すべての回答に合う候補から選んだか) を返す。
+        候補は好みとの一致度で重み付けして抽選する (同じ回答でも毎回同じ行き先にはならない)
+        """
+        rng = rng or random
+        candidates = self.mask_members(self.candidate_mask(answers))
+        matched_all = bool(candidates)
+        if not matched_all:
+            # すべての回答に合う都道府県が無い: 合う回答の数が最も多い都道府県を候補にする
+            counts = self.matched_answer_counts(answers)
+            candidates = [int(i) for i in np.flatnonzero(counts == counts.max())]
+        scores = self.preference_scores(preferences)[candidates] ** SCORE_SHARPNESS
+        chosen = candidates[rng.choices(range(len(candidates)), weights=scores.tolist())[0]]
+        return self.prefectures[chosen], matched_all
+
+
+@st.cache_resource
+def get_quiz_index() -> DestinationQuizIndex:
+    """プロセス全体で共有する行き先の質問のインデックスを返す"""
+    index = DestinationQuizIndex()
+    logger.info(f"Compiled destination quiz index ({len(index.answer_masks)} answers x {len(index.prefectures)} prefectures).")
+    return index
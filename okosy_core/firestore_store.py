@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+"""Firestore のしおり・思い出データ操作 (okosy_core.storage の FirestoreStore から使う)"""
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, List, Optional
+
+import streamlit as st
+from firebase_admin import firestore
+
+from okosy_core import config
+from okosy_core.blob_store import delete_memory_blobs, get_blob_store, memory_blob_key
+from okosy_core.clients import get_firestore_client
+from okosy_core.logs import get_logger, stage_timer
+from okosy_core.place_records import (
+    PLACES_SCHEMA_VERSION, PlaceGroup, load_place_groups, place_groups_to_documents,
+)
+
+logger = get_logger("firestore")
+
+# しおり一覧で読み込む項目 (本文・場所データは一覧では読まない)
+ITINERARY_SUMMARY_FIELDS = ("name", "creation_date", "deletion_pending")
+
+
+# --- Firestore データ操作関数 ---
+@stage_timer("firestore.save_itinerary")
+def save_itinerary_to_firestore(user_id: str, name: str, preferences: dict, generated_content: str,
+                                place_groups: Optional[List[PlaceGroup]], usage: Optional[dict] = None):
+    """しおりデータをFirestoreに保存する (場所データは配列・マップのまま保存する。usage: 生成時の OpenAI 使用量・推定コスト)"""
+    db = get_firestore_client()
+    try:
+        doc_ref = db.collection("users").document(user_id).collection("itineraries").document()
+        doc_ref.set({
+            "name": name,
+            "preferences": json.dumps(preferences, ensure_ascii=False),
+            "generated_content": generated_content,
+            "places": place_groups_to_documents(place_groups),
+            "places_schema_version": PLACES_SCHEMA_VERSION,
+            "usage": usage,
+            "creation_date": firestore.SERVER_TIMESTAMP # type: ignore
+        })
+        logger.info(f"Itinerary saved to Firestore for user {user_id}, doc_id: {doc_ref.id}")
+        return doc_ref.id
+    except Exception as e:
+        st.error(f"Firestoreへのしおり保存中にエラー: {e}")
+        logger.exception("Firestoreへのしおり保存中にエラー")
+        return None
+
+@stage_timer("firestore.load_itinerary_summaries")
+def load_itinerary_summaries_from_firestore(user_id: str, page_size: int = config.ITINERARY_PAGE_SIZE, start_after: Optional[Any] = None):
+    """
+    指定したユーザーのしおり一覧を、一覧表示に必要な項目(名前・作成日時)だけ新しい順に1ページ分読み込む。
+    (しおりのリスト, 次ページのカーソル or None) を返す。
+    """
+    try:
+        query = itinerary_summaries_query(user_id, page_size)
+        if start_after is not None:
+            query = query.start_after(start_after)
+        docs = list(query.stream())
+        summaries = []
+        for doc in docs:
+            data = doc.to_dict() or {}
+            data['id'] = doc.id
+            summaries.append(data)
+        next_cursor = docs[-1] if len(docs) == page_size else None
+        return summaries, next_cursor
+    except Exception as e:
+        st.error(f"Firestoreからのしおり一覧読み込み中にエラー: {e}")
+        logger.exception("Firestoreからのしおり一覧読み込み中にエラー")
+        return [], None
+
+@stage_timer("firestore.load_itinerary")
+def load_itinerary_from_firestore(user_id: str, itinerary_id: str):
+    """指定したしおりの本文を含む全データをFirestoreから読み込む"""
+    db = get_firestore_client()
+    try:
+        doc = db.collection("users").document(user_id).collection("itineraries").document(itinerary_id).get()
+        if not doc.exists:
+            return None
+        data = doc.to_dict() or {}
+        data['id'] = doc.id
+        try:
+            # JSON文字列から辞書に変換
+            data['preferences_dict'] = json.loads(data.get('preferences', '{}'))
+        except (json.JSONDecodeError, TypeError):
+            data['preferences_dict'] = {} # エラー時は空の辞書
+        if data.get("places_schema_version") == PLACES_SCHEMA_VERSION:
+            data["place_groups"] = load_place_groups(data.get("places"))
+        else:
+            data["place_groups"] = load_place_groups(data.get("places_data"))
+            if data.get("places_data"):
+                migrate_places_data(doc.reference, data["place_groups"])
+        return data
+    except Exception as e:
+        st.error(f"Firestoreからのしおり読み込み中にエラー: {e}")
+        logger.exception("Firestoreからのしおり読み込み中にエラー")
+        return None
+
+def migrate_places_data(itinerary_ref: Any, place_groups: List[PlaceGroup]) -> None:
+    """旧形式 (places_data: JSON文字列の配列) の場所データを現在の形式で保存し直す (失敗しても読み込みは続ける)"""
+    try:
+        itinerary_ref.update({
+            "places": place_groups_to_documents(place_groups),
+            "places_schema_version": PLACES_SCHEMA_VERSION,
+            "places_data": firestore.DELETE_FIELD, # type: ignore
+        })
+        logger.info(f"Migrated places data of itinerary {itinerary_ref.id} to schema version {PLACES_SCHEMA_VERSION}")
+    except Exception as e:
+        logger.warning(f"Failed to migrate places data of itinerary {itinerary_ref.id}: {e}")
+
+def delete_memories_page(memory_docs: List[Any]) -> int:
+    """1ページ分(最大500件)の思い出を写真ごと1バッチで削除し、削除件数を返す (ワーカースレッドから呼ばれる)"""
+    batch = get_firestore_client().batch()
+    for mem_doc in memory_docs:
+        # 写真を先に消す (途中で失敗しても、参照の切れた写真が残らないように)
+        delete_memory_blobs(mem_doc.to_dict() or {})
+        batch.delete(mem_doc.reference)
+    batch.commit()
+    return len(memory_docs)
+
+def delete_itinerary_from_firestore(user_id: str, itinerary_id: str, progress_callback=None):
+    """
+    指定したしおりと関連する思い出をFirestoreから削除する。
+    思い出は500件ずつページングし、ページごとのバッチを並列にコミットする (写真ストレージの写真も削除)。
+    削除前にしおりへ deletion_pending を立てておくため、途中で失敗しても再実行すれば残りから削除を再開できる。
+    progress_callback(削除済み件数, 全件数 or None) で進捗を通知する。
+    """
+    db = get_firestore_client()
+    try:
+        itinerary_ref = db.collection("users").document(user_id).collection("itineraries").document(itinerary_id)
+        memories_collection = itinerary_ref.collection("memories")
+        # 削除中であることを記録 (中断された削除は一覧に表示され、再実行で再開できる)
+        if itinerary_ref.get(["deletion_pending"]).exists:
+            itinerary_ref.update({"deletion_pending": True})
+
+        total_count = None
+        try:
+            total_count = memories_collection.count().get()[0][0].value
+        except Exception as count_e:
+            logger.warning(f"Could not count memories for itinerary {itinerary_id}: {count_e}")
+
+        # まずサブコレクション(memories)を削除 (ページ単位で並列にバッチコミット)
+        deleted_count = 0
+        with ThreadPoolExecutor(max_workers=config.CASCADE_DELETE_MAX_WORKERS, thread_name_prefix="okosy-delete") as executor:
+            futures = []
+            last_doc = None
+            while True:
+                # 写真の参照だけを取得する (旧形式のBase64写真はダウンロードしない)
+                page_query = memories_collection.select(["photo_ref", "thumbnail_ref"]).order_by("__name__").limit(config.FIRESTORE_BATCH_LIMIT)
+                if last_doc is not None:
+                    page_query = page_query.start_after(last_doc)
+                page_docs = list(page_query.stream())
+                if not page_docs:
+                    break
+                futures.append(executor.submit(delete_memories_page, page_docs))
+                last_doc = page_docs[-1]
+                if len(page_docs) < config.FIRESTORE_BATCH_LIMIT:
+                    break
+            for future in as_completed(futures):
+                deleted_count += future.result() # 失敗したバッチがあれば例外を送出 (しおり本体は残す)
+                if progress_callback:
+                    progress_callback(deleted_count, total_count)
+        if deleted_count > 0:
+            logger.info(f"Deleted {deleted_count} memories for itinerary {itinerary_id}")
+
+        # 全ての思い出を削除できたらしおり本体を削除
+        itinerary_ref.delete()
+
+        logger.info(f"Itinerary {itinerary_id} deleted from Firestore for user {user_id}")
+        return True
+    except Exception as e:
+        st.error(f"Firestoreからのしおり削除中にエラー: {e}")
+        logger.exception("Firestoreからのしおり削除中にエラー")
+        return False
+
+def save_memory_to_firestore(user_id: str, itinerary_id: str, caption: str,
+                             photo: Optional[Dict[str, Any]] = None, thumbnail: Optional[Dict[str, Any]] = None):
+    """
+    思い出データをFirestoreに保存する。
+    写真は写真ストレージに保存し、ドキュメントには参照キーと画像サイズのみを持たせる。
+    photo / thumbnail は {"data": bytes, "content_type": str, "size": (幅, 高さ)} 形式。
+    """
+    db = get_firestore_client()
+    try:
+        doc_ref = db.collection("users").document(user_id).collection("itineraries").document(itinerary_id).collection("memories").document()
+        memory_data: Dict[str, Any] = {
+            "caption": caption,
+            "photo_ref": None,
+            "thumbnail_ref": None,
+            "creation_date": firestore.SERVER_TIMESTAMP # type: ignore
+        }
+        blob_store = get_blob_store()
+        for variant, image in (("photo", photo), ("thumbnail", thumbnail)):
+            if image:
+                blob_key = memory_blob_key(user_id, itinerary_id, doc_ref.id, variant, image["content_type"])
+                blob_store.put(blob_key, image["data"], image["content_type"])
+                memory_data[f"{variant}_ref"] = blob_key
+        if photo:
+            memory_data["photo_width"], memory_data["photo_height"] = photo["size"]
+        doc_ref.set(memory_data)
+        logger.info(f"Memory saved to Firestore for itinerary {itinerary_id}, doc_id: {doc_ref.id}")
+        return doc_ref.id
+    except Exception as e:
+        st.error(f"Firestoreへの思い出保存中にエラー: {e}")
+        logger.exception("Firestoreへの思い出保存中にエラー")
+        return None
+
+@stage_timer("firestore.load_memories")
+def load_memories_from_firestore(user_id: str, itinerary_id: str):
+    """指定したしおりの思い出一覧をFirestoreから読み込む (写真本体は読み込まない)"""
+    db = get_firestore_client()
+    memories = []
+    try:
+        memories_ref = db.collection("users").document(user_id).collection("itineraries").document(itinerary_id).collection("memories").order_by(
+            "creation_date", direction=firestore.Query.DESCENDING # type: ignore
+        ).stream()
+        for doc in memories_ref:
+            data = doc.to_dict()
+            if data:
+                data['id'] = doc.id
+                memories.append(data)
+        return memories
+    except Exception as e:
+        st.error(f"Firestoreからの思い出読み込み中にエラー: {e}")
+        logger.exception("Firestoreからの思い出読み込み中にエラー")
+        return []
+
+def delete_memory_from_firestore(user_id: str, itinerary_id: str, memory_id: str):
+    """指定した思い出をFirestoreから削除する"""
+    db = get_firestore_client()
+    try:
+        memory_ref = db.collection("users").document(user_id).collection("itineraries").document(itinerary_id).collection("memories").document(memory_id)
+        memory_snapshot = memory_ref.get()
+        if memory_snapshot.exists:
+            delete_memory_blobs(memory_snapshot.to_dict() or {})
+        memory_ref.delete()
+        logger.info(f"Memory {memory_id} deleted from Firestore for itinerary {itinerary_id}")
+        return True
+    except Exception as e:
+        st.error(f"Firestoreからの思い出削除中にエラー: {e}")
+        logger.exception("Firestoreからの思い出削除中にエラー")
+        return False
+
+# --- スナップショットリスナーの監視対象 ---
+def itineraries_collection(user_id: str):
+    return get_firestore_client().collection("users").document(user_id).collection("itineraries")
+
+def itinerary_summaries_query(user_id: str, page_size: int):
+    """しおり一覧の1ページ目のクエリ (一覧表示に必要な項目だけを読む。スナップショットリスナーでも同じクエリを使う)"""
+    return itineraries_collection(user_id).select(list(ITINERARY_SUMMARY_FIELDS)).order_by(
+        "creation_date", direction=firestore.Query.DESCENDING # type: ignore
+    ).limit(page_size)
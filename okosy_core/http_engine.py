@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+外部API (Places / Geocoding / Vision / OpenAI) 呼び出し用の非同期HTTPエンジン。
+専用スレッドで asyncio のイベントループを1つ動かし、接続プール (keep-alive, 利用可能なら HTTP/2) を
+全セッションで共有する。Streamlit のスクリプトスレッドからは同期ファサード (get / post / run / iterate) で呼び出す。
+ホストごとの同時リクエスト数の制限はトランスポートで行うため、engine.client を直接使う OpenAI SDK の通信にも適用される。
+"""
+import asyncio
+import importlib.util
+import threading
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, Optional
+
+import httpx
+import streamlit as st
+
+from okosy_core import config
+from okosy_core.logs import get_logger
+
+logger = get_logger("http")
+
+
+class _SemaphoreReleasingStream(httpx.AsyncByteStream):
+    """レスポンス本文を読み終えて閉じたときに、ホストの同時実行枠を返す (ストリーミング応答は受信が終わるまで枠を使う)"""
+    def __init__(self, stream: httpx.AsyncByteStream, semaphore: asyncio.Semaphore):
+        self._stream = stream
+        self._semaphore = semaphore
+        self._released = False
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            if not self._released:
+                self._released = True
+                self._semaphore.release()
+
+class HostLimitedTransport(httpx.AsyncBaseTransport):
+    """リクエストの送信からレスポンスを閉じるまで、宛先ホストのセマフォを確保するトランスポート"""
+    def __init__(self, transport: httpx.AsyncBaseTransport, semaphore_for: Callable[[str], asyncio.Semaphore]):
+        self._transport = transport
+        self._semaphore_for = semaphore_for
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        semaphore = self._semaphore_for(request.url.host)
+        await semaphore.acquire()
+        try:
+            response = await self._transport.handle_async_request(request)
+        except BaseException:
+            semaphore.release()
+            raise
+        if response.is_closed:
+            semaphore.release() # 本文を読み込み済みのレスポンス (閉じる処理が呼ばれない)
+        else:
+            response.stream = _SemaphoreReleasingStream(response.stream, semaphore)
+        return response
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+
+class AsyncHttpEngine:
+    """
+    イベントループ・接続プール・ホストごとの同時接続数制限をまとめたHTTPエンジン。
+    transport は接続プールの代わりに使うトランスポート (テスト用。通常は指定しない)
+    """
+    def __init__(self, max_connections: int, max_connections_per_host: int, enable_http2: bool,
+                 transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.max_connections_per_host = max_connections_per_host
+        # h2 パッケージが入っている場合のみ HTTP/2 を使う
+        self.http2 = enable_http2 and importlib.util.find_spec("h2") is not None
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="okosy-http-loop", daemon=True)
+        self._thread.start()
+        self._host_semaphores: Dict[str, asyncio.Semaphore] = {}
+        if transport is None:
+            transport = httpx.AsyncHTTPTransport(
+                http2=self.http2,
+                limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            )
+        # engine.client を使うすべての通信 (OpenAI SDK を含む) にホストごとの同時実行数の制限をかける
+        self.client = httpx.AsyncClient(transport=HostLimitedTransport(transport, self._semaphore))
+        logger.info(f"HTTP engine started (http2={self.http2}, max_connections={max_connections}, per_host={max_connections_per_host}).")
+
+    def run(self, coro, timeout: Optional[float] = None) -> Any:
+        """コルーチンをエンジンのイベントループで実行し、結果を待って返す (同期ファサード)"""
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result(timeout)
+
+    def iterate(self, async_iterable: AsyncIterator[Any]) -> Iterator[Any]:
+        """非同期イテレータ (ストリーミング応答など) を同期イテレータとして読み出す"""
+        iterator = async_iterable.__aiter__()
+        while True:
+            try:
+                yield self.run(iterator.__anext__())
+            except StopAsyncIteration:
+                return
+
+    def _semaphore(self, host: str) -> asyncio.Semaphore:
+        # イベントループのスレッドからのみ呼ばれるためロック不要
+        semaphore = self._host_semaphores.get(host)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.max_connections_per_host)
+            self._host_semaphores[host] = semaphore
+        return semaphore
+
+    async def request(self, method: str, url: str, **kwargs: Any) -> httpx.Response:
+        """リクエストを送り、本文まで読み込んだレスポンスを返す (ホストごとの同時実行数はトランスポートで制限する)"""
+        return await self.client.request(method, url, **kwargs)
+
+    def get(self, url: str, params: Optional[Dict[str, Any]] = None, timeout: Optional[float] = None) -> httpx.Response:
+        return self.run(self.request("GET", url, params=params, timeout=timeout))
+
+    def post(self, url: str, json: Optional[Any] = None, headers: Optional[Dict[str, str]] = None,
+             timeout: Optional[float] = None) -> httpx.Response:
+        return self.run(self.request("POST", url, json=json, headers=headers, timeout=timeout))
+
+
+@st.cache_resource(show_spinner=False)
+def get_http_engine() -> AsyncHttpEngine:
+    """プロセス全体で共有するHTTPエンジンを返す"""
+    return AsyncHttpEngine(config.HTTP_MAX_CONNECTIONS, config.HTTP_MAX_CONNECTIONS_PER_HOST, config.HTTP_ENABLE_HTTP2)
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""アップロード画像の前処理 (縮小・EXIF除去・再エンコード)"""
+import io
+
+from PIL import Image, ImageOps
+
+from okosy_core import config
+
+
+def preprocess_image(image_bytes: bytes, profile_name: str) -> tuple[bytes, str, tuple[int, int]]:
+    """
+    画像をプロファイルに従って縮小・再エンコードし、(画像バイト列, MIMEタイプ, (幅, 高さ)) を返す。
+    EXIFの向き情報は画素に反映したうえで、メタデータ(位置情報など)は保存しない。
+    """
+    profile = config.IMAGE_PROFILES[profile_name]
+    with Image.open(io.BytesIO(image_bytes)) as original:
+        img = ImageOps.exif_transpose(original) # 向きを補正 (EXIFはここで破棄される)
+        img.thumbnail((profile["max_side"], profile["max_side"]), Image.Resampling.LANCZOS)
+        image_format = profile["format"]
+        if image_format == "JPEG" and img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        elif img.mode not in ("RGB", "RGBA", "L"):
+            img = img.convert("RGBA" if "A" in img.getbands() else "RGB")
+        output = io.BytesIO()
+        try:
+            img.save(output, format=image_format, quality=profile["quality"], optimize=True)
+        except (KeyError, OSError):
+            # WebP 非対応の Pillow ビルドでは JPEG にフォールバック
+            image_format = "JPEG"
+            output = io.BytesIO()
+            img.convert("RGB").save(output, format=image_format, quality=profile["quality"], optimize=True)
+    return output.getvalue(), f"image/{image_format.lower()}", img.size
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+生成済みしおりのキャッシュ (SQLite, 任意機能)。
+同じ入力 (プランナー・行き先・基本情報・好み・画像ラベル・モデル) の依頼には保存済みの結果を返し、
+OpenAI / Places を呼ばずに済ませる。有効期限とサイズ上限を超えたものは最終利用が古い順に削除する。
+"""
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+import streamlit as st
+
+from okosy_core import config
+from okosy_core.logs import get_logger
+
+logger = get_logger("itinerary_cache")
+
+
+class ItineraryCache:
+    """キー -> (しおり本文, 場所データ) を保持する SQLite キャッシュ (TTL + サイズ上限付き LRU, スレッドセーフ)"""
+    def __init__(self, path: str, ttl_seconds: float, max_bytes: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS itinerary_cache ("
+                " key TEXT PRIMARY KEY, content TEXT NOT NULL, places_data TEXT,"
+                " size INTEGER NOT NULL, created_at REAL NOT NULL, last_access REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_itinerary_cache_last_access ON itinerary_cache(last_access)")
+
+    def get(self, key: str) -> Optional[tuple[str, Optional[str]]]:
+        """(しおり本文, 場所データ) を返す。無い・期限切れなら None"""
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT content, places_data, created_at FROM itinerary_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            content, places_data, created_at = row
+            if now - created_at > self.ttl_seconds:
+                self._conn.execute("DELETE FROM itinerary_cache WHERE key = ?", (key,))
+                return None
+            self._conn.execute("UPDATE itinerary_cache SET last_access = ? WHERE key = ?", (now, key))
+            return content, places_data
+
+    def put(self, key: str, content: str, places_data: Optional[str]) -> None:
+        size = len(content.encode("utf-8")) + len((places_data or "").encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO itinerary_cache (key, content, places_data, size, created_at, last_access)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (key, content, places_data, size, now, now),
+            )
+            self._conn.execute("DELETE FROM itinerary_cache WHERE created_at < ?", (now - self.ttl_seconds,))
+            # サイズ上限に収まるまで、最終利用が古いものから削除する
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM itinerary_cache").fetchone()[0]
+            if total > self.max_bytes:
+                evicted = 0
+                for old_key, old_size in self._conn.execute(
+                    "SELECT key, size FROM itinerary_cache ORDER BY last_access ASC"
+                ).fetchall():
+                    if total <= self.max_bytes:
+                        break
+                    self._conn.execute("DELETE FROM itinerary_cache WHERE key = ?", (old_key,))
+                    total -= old_size
+                    evicted += 1
+                logger.info(f"Itinerary cache evicted {evicted} entries (total {total} bytes).")
+
+
+@st.cache_resource(show_spinner=False)
+def get_itinerary_cache() -> Optional[ItineraryCache]:
+    """プロセス全体で共有するしおりキャッシュを返す (ITINERARY_CACHE_ENABLED が無効なら None)"""
+    if not config.ITINERARY_CACHE_ENABLED:
+        return None
+    return ItineraryCache(config.ITINERARY_CACHE_PATH, config.ITINERARY_CACHE_TTL_SECONDS, config.ITINERARY_CACHE_MAX_BYTES)
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+しおり生成のバックグラウンドジョブ。
+生成 (Vision / OpenAI 2回 / Places 検索) を Streamlit のスクリプトスレッドから切り離し、
+プロセス共有のワーカープールで実行する。ブラウザの再接続や画面操作による再実行でも処理は継続し、
+同じ内容 (プランナー・行き先・基本情報・好み・画像) の依頼は1つのジョブにまとめる。
+"""
+import hashlib
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+import streamlit as st
+
+from okosy_core import config
+from okosy_core.conversation import extract_image_labels, run_conversation_with_function_calling
+from okosy_core.itinerary_cache import get_itinerary_cache
+from okosy_core.notices import NoticeSink
+from okosy_core.place_records import PlaceGroup, load_place_groups, place_groups_to_json
+from okosy_core.prompts import build_itinerary_prompt
+from okosy_core.resilience import Deadline
+from okosy_core.usage import GenerationUsage, get_usage_log
+from okosy_core.logs import get_logger, stage_timer
+
+logger = get_logger("jobs")
+
+
+@dataclass
+class GenerationRequest:
+    """しおり生成の入力。画像はスクリプトスレッドで読み出した (ファイル名, バイト列)"""
+    planner: Dict[str, Any]
+    destination: str
+    purpose: str
+    companion: str
+    days: int
+    budget: str
+    preferences: Dict[str, Any]
+    images: List[tuple[str, bytes]] = field(default_factory=list)
+    regenerate: bool = False # True ならしおりキャッシュを使わずに生成し直す
+
+    def _hash(self, extra: Dict[str, Any]) -> str:
+        canonical = json.dumps({
+            "planner": self.planner.get("name"), "persona": self.planner.get("prompt_persona"),
+            "destination": self.destination,
+            "purpose": self.purpose, "companion": self.companion, "days": self.days, "budget": self.budget,
+            "preferences": self.preferences, **extra,
+        }, ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def job_key(self) -> str:
+        """入力内容のハッシュ (同じ内容の依頼は同じキーになる)"""
+        return self._hash({"images": [hashlib.sha256(data).hexdigest() for _, data in self.images]})
+
+    def fingerprint(self, image_labels: List[str], model: str) -> str:
+        """しおりキャッシュのキー (プロンプトを決める入力 + 画像ラベル + モデル名のハッシュ)"""
+        return self._hash({"image_labels": image_labels, "model": model})
+
+    def messages(self) -> List[Dict[str, Any]]:
+        prompt = build_itinerary_prompt(
+            self.planner, self.destination, self.purpose, self.companion, self.days, self.budget, self.preferences
+        )
+        return [{"role": "user", "content": prompt}]
+
+
+@dataclass
+class GenerationResult:
+    """生成結果 (しおり本文と、Tool Call で取得した場所データ)"""
+    content: Optional[str]
+    place_groups: Optional[List[PlaceGroup]]
+    cached: bool = False # しおりキャッシュから返した結果か
+    usage: Optional[Dict[str, Any]] = None # OpenAI の使用量 (GenerationUsage.to_dict())。キャッシュから返した場合は None
+
+    @property
+    def succeeded(self) -> bool:
+        return bool(self.content) and "申し訳ありません" not in self.content
+
+
+class GenerationJob:
+    """1件の生成ジョブの状態。ワーカースレッドが更新し、画面側はポーリングで読み出す"""
+    def __init__(self, job_id: str, request: GenerationRequest):
+        self.job_id = job_id
+        self.request = request
+        self.status = "queued" # queued / running / succeeded / failed
+        self.partial_content = "" # ストリーミング中の途中経過
+        self.result: Optional[GenerationResult] = None
+        self.notices = NoticeSink()
+        self.created_at = time.monotonic()
+        self.finished_at: Optional[float] = None
+
+    @property
+    def done(self) -> bool:
+        return self.status in ("succeeded", "failed")
+
+
+class GenerationJobQueue:
+    """ジョブの登録・重複排除・実行 (ワーカースレッドのプール + ローカルキュー)"""
+    def __init__(self, max_workers: int, retention_seconds: float):
+        self.retention_seconds = retention_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="okosy-job")
+        self._jobs: Dict[str, GenerationJob] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, request: GenerationRequest) -> GenerationJob:
+        """
+        ジョブを登録して返す。同じ内容のジョブが実行中・成功済みならそれを返す (失敗したものは再実行)。
+        regenerate の依頼は、実行中のジョブがあればそれを返し、完了済みなら新しく実行する
+        """
+        job_id = request.job_key()
+        with self._lock:
+            self._prune()
+            existing = self._jobs.get(job_id)
+            if existing is not None and existing.status != "failed" and not (request.regenerate and existing.done):
+                logger.info(f"Generation job {job_id[:12]} already {existing.status}, reusing it.")
+                return existing
+            job = GenerationJob(job_id, request)
+            self._jobs[job_id] = job
+        self._executor.submit(self._run, job)
+        logger.info(f"Generation job {job_id[:12]} queued (destination={request.destination}).")
+        return job
+
+    def get(self, job_id: str) -> Optional[GenerationJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _prune(self) -> None:
+        # 完了後、保持期間を過ぎたジョブを破棄する (ロック取得済みで呼ぶ)
+        now = time.monotonic()
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished_at is not None and now - job.finished_at > self.retention_seconds]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def _run(self, job: GenerationJob) -> None:
+        with stage_timer("generation.job", regenerate=job.request.regenerate) as event:
+            job.status = "running"
+            try:
+                request = job.request
+                deadline = Deadline(config.GENERATION_DEADLINE_SECONDS)
+                # 画像ラベルもプロンプトの一部なので、キャッシュを引く前に抽出する
+                image_labels = extract_image_labels(request.images, deadline, job.notices)
+                cache = get_itinerary_cache()
+                cache_key = request.fingerprint(image_labels, config.OPENAI_MODEL)
+                cached = cache.get(cache_key) if cache is not None and not request.regenerate else None
+                if cached is not None:
+                    logger.info(f"Itinerary cache hit: {cache_key[:12]}")
+                    job.notices.info("同じ条件で以前に作成したしおりを表示しています。別の提案が欲しい場合は「別の提案を生成する」を押してください。")
+                    job.result = GenerationResult(cached[0], load_place_groups(cached[1]) or None, cached=True)
+                else:
+                    def on_text(text: str) -> None:
+                        job.partial_content = text
+                    usage = GenerationUsage()
+                    content, place_groups = run_conversation_with_function_calling(
+                        request.messages(), image_labels,
+                        on_text=on_text if config.OPENAI_STREAM_OUTPUT else None,
+                        destination=request.destination, days=request.days, notices=job.notices, deadline=deadline, usage=usage,
+                    )
+                    job.result = GenerationResult(content, place_groups, usage=usage.to_dict())
+                    if cache is not None and job.result.succeeded:
+                        cache.put(cache_key, content, place_groups_to_json(place_groups))
+                job.status = "succeeded" if job.result.succeeded else "failed"
+                get_usage_log().record(request.destination, job.result.usage or GenerationUsage().to_dict(), cached=job.result.cached)
+            except Exception as e:
+                job.notices.error(f"しおりの生成中に予期せぬエラーが発生しました: {e}")
+                logger.exception(f"Generation job {job.job_id[:12]} crashed")
+                job.result = GenerationResult(None, None)
+                job.status = "failed"
+            finally:
+                job.finished_at = time.monotonic()
+                event.update(status=job.status, cached=bool(job.result and job.result.cached))
+                logger.info(f"Generation job {job.job_id[:12]} finished: {job.status}")
+
+
+@st.cache_resource(show_spinner=False)
+def get_generation_queue() -> GenerationJobQueue:
+    """プロセス全体で共有する生成ジョブのキューを返す"""
+    return GenerationJobQueue(config.GENERATION_JOB_WORKERS, config.GENERATION_JOB_RETENTION_SECONDS)
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+構造化ログ。
+- レベル付きのロガー (okosy.*)。出力時に APIキー・Bearer トークン・Base64 データを伏せ字にする
+- ペイロード (メッセージ一覧など) はサイズ上限付きのプレビューとして、DEBUG かつサンプリングされた場合のみ出力する
+- 外部API呼び出しなどの処理段階ごとの所要時間を stage_timer で計測し、JSON Lines ファイルにも書き出す
+  (計測結果はスパンとして okosy_core.tracing のリングバッファにも記録する)
+"""
+import contextlib
+import datetime
+import json
+import logging
+import random
+import re
+import sys
+import threading
+import time
+from typing import Any, Dict, Iterator
+
+from okosy_core import config
+
+# --- 伏せ字 (秘密情報・大きなデータ) ---
+_REDACTION_PATTERNS = [
+    (re.compile(r"(?i)(Bearer\s+)[A-Za-z0-9._~+/=-]+"), r"\1***"),
+    (re.compile(r"(?i)([?&]key=)[^&\s'\"]+"), r"\1***"),
+    (re.compile(r"(?i)(\b['\"]?(?:key|api_key|apikey|access_token|token)['\"]?\s*[:=]\s*['\"]?)[A-Za-z0-9._~+/=-]{8,}"), r"\1***"),
+    # data URI や画像の Base64 (長い英数字の連続) は長さだけ残す
+    (re.compile(r"[A-Za-z0-9+/]{200,}={0,2}"), lambda m: f"<base64 {len(m.group(0))} chars>"),
+]
+
+def redact(text: str) -> str:
+    """文字列中の APIキー・トークン・長い Base64 を伏せ字にする"""
+    for secret in (config.OPENAI_API_KEY, config.GOOGLE_PLACES_API_KEY):
+        if secret:
+            text = text.replace(secret, "***")
+    for pattern, replacement in _REDACTION_PATTERNS:
+        text = pattern.sub(replacement, text)
+    return text
+
+def preview(payload: Any, limit: int = config.LOG_PREVIEW_CHARS) -> str:
+    """ペイロードを1行のJSONにし、伏せ字にした上で limit 文字までに切り詰める"""
+    try:
+        text = payload if isinstance(payload, str) else json.dumps(payload, ensure_ascii=False, default=str)
+    except (TypeError, ValueError):
+        text = str(payload)
+    text = redact(text)
+    if len(text) > limit:
+        return f"{text[:limit]}...(+{len(text) - limit} chars)"
+    return text
+
+
+# --- フォーマッタ / ハンドラ ---
+class RedactingFormatter(logging.Formatter):
+    """通常のテキスト形式。出力直前に伏せ字処理をかける"""
+    def format(self, record: logging.LogRecord) -> str:
+        return redact(super().format(record))
+
+class JsonLinesFormatter(logging.Formatter):
+    """1レコード1行のJSON。stage_timer の計測値 (stage_event) はトップレベルに展開する"""
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "ts": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": redact(record.getMessage()),
+        }
+        entry.update(getattr(record, "stage_event", {}))
+        if record.exc_info:
+            entry["exc"] = redact(self.formatException(record.exc_info))
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+_configure_lock = threading.Lock()
+_configured = False
+
+def configure_logging() -> None:
+    """okosy.* ロガーの出力先を設定する (プロセスで一度だけ)"""
+    global _configured
+    with _configure_lock:
+        if _configured:
+            return
+        root = logging.getLogger("okosy")
+        root.setLevel(getattr(logging, config.LOG_LEVEL, logging.INFO))
+        root.propagate = False
+        console = logging.StreamHandler(sys.stdout)
+        console.setFormatter(RedactingFormatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+        root.addHandler(console)
+        if config.LOG_JSONL_PATH:
+            jsonl = logging.FileHandler(config.LOG_JSONL_PATH, encoding="utf-8")
+            jsonl.setFormatter(JsonLinesFormatter())
+            root.addHandler(jsonl)
+        _configured = True
+
+def get_logger(name: str) -> logging.Logger:
+    """okosy.<name> ロガーを返す"""
+    configure_logging()
+    return logging.getLogger(f"okosy.{name}")
+
+
+# --- サンプリング付きペイロード出力 ---
+def log_payload(logger: logging.Logger, label: str, payload: Any) -> None:
+    """DEBUG が有効で、かつ LOG_PAYLOAD_SAMPLE_RATE でサンプリングされた場合のみペイロードのプレビューを出力する"""
+    if not logger.isEnabledFor(logging.DEBUG) or random.random() >= config.LOG_PAYLOAD_SAMPLE_RATE:
+        return
+    logger.debug("%s: %s", label, preview(payload))
+
+
+# --- 処理段階ごとの所要時間 ---
+_stage_logger = logging.getLogger("okosy.stage")
+
+@contextlib.contextmanager
+def stage_timer(stage: str, **fields: Any) -> Iterator[Dict[str, Any]]:
+    """
+    with ブロックの所要時間を計測し、{stage, duration_ms, ok, ...fields} をログとスパンのリングバッファに記録する。
+    yield した辞書に項目を追加すると記録に含まれる (例: ステータスや件数)
+    """
+    from okosy_core import tracing # tracing が logs を使うため、ここで読み込む
+    configure_logging()
+    event: Dict[str, Any] = dict(fields)
+    with tracing.otel_span(stage) as otel:
+        started = time.perf_counter()
+        ok = True
+        try:
+            yield event
+        except BaseException:
+            ok = False
+            raise
+        finally:
+            duration_ms = round((time.perf_counter() - started) * 1000, 1)
+            stage_event = {"stage": stage, "duration_ms": duration_ms, "ok": ok, **event}
+            _stage_logger.info("%s %.1fms ok=%s %s", stage, duration_ms, ok, preview(event, 300) if event else "",
+                               extra={"stage_event": stage_event})
+            tracing.record_span(stage, duration_ms, ok, event, otel)
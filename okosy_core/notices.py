@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+ユーザー向けの警告・エラー表示の出し先。
+スクリプトスレッドからは st.warning / st.error にそのまま出し、
+バックグラウンドジョブでは NoticeSink に溜めておき、後で画面側 (スクリプトスレッド) から表示する。
+"""
+import threading
+from typing import List
+
+import streamlit as st
+
+
+class StreamlitNotices:
+    """st.info / st.warning / st.error に直接表示する (スクリプトスレッド専用)"""
+    def info(self, message: str) -> None:
+        st.info(message)
+
+    def warning(self, message: str) -> None:
+        st.warning(message)
+
+    def error(self, message: str) -> None:
+        st.error(message)
+
+
+class NoticeSink:
+    """ワーカースレッドで発生したメッセージを (レベル, 本文) として溜める (スレッドセーフ)"""
+    def __init__(self):
+        self._items: List[tuple[str, str]] = []
+        self._lock = threading.Lock()
+
+    def info(self, message: str) -> None:
+        with self._lock:
+            self._items.append(("info", message))
+
+    def warning(self, message: str) -> None:
+        with self._lock:
+            self._items.append(("warning", message))
+
+    def error(self, message: str) -> None:
+        with self._lock:
+            self._items.append(("error", message))
+
+    def items(self) -> List[tuple[str, str]]:
+        with self._lock:
+            return list(self._items)
+
+    def render(self) -> None:
+        """溜めたメッセージを表示する (スクリプトスレッドから呼ぶ)"""
+        for level, message in self.items():
+            if level == "error":
+                st.error(message)
+            elif level == "info":
+                st.info(message)
+            else:
+                st.warning(message)
+
+
+STREAMLIT_NOTICES = StreamlitNotices()
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""
+Place Details による場所データの補完。
+Text Search の結果には営業時間が含まれないため、Tool Call で見つかった場所の営業時間・座標・営業状況・写真を
+Place Details で取得して PlaceRecord に書き込む (2回目の OpenAI 呼び出しと、保存する場所データの両方に使う)。
+取得結果は place_id ごと・項目ごとに有効期限付きで SQLite に保存し、全ユーザーで共有する。
+Place Details は1件ごとに課金され生成の待ち時間も増えるため、既定では無効 (PLACE_DETAILS_ENABLED) で、1回の生成で取得する件数にも上限がある。
+"""
+import json
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import zip_longest
+from typing import Any, Dict, List, Optional
+
+import httpx
+import streamlit as st
+
+from okosy_core import config
+from okosy_core.http_engine import get_http_engine
+from okosy_core.place_records import PlaceGroup, PlaceRecord
+from okosy_core.resilience import Deadline, RetryableError, UpstreamUnavailableError, call_with_resilience
+from okosy_core.logs import get_logger, stage_timer
+
+logger = get_logger("place_details")
+
+# 補完する項目 -> Place Details の fields に指定する値
+DETAIL_FIELDS = {
+    "geometry": "geometry/location",
+    "business_status": "business_status",
+    "opening_hours": "opening_hours",
+    "photos": "photos",
+}
+
+
+# --- place_id ごとの Place Details キャッシュ (全ユーザーで共有) ---
+class PlaceDetailsCache:
+    """(place_id, 項目) -> 値 を保持する SQLite キャッシュ (項目ごとの TTL 付き, スレッドセーフ)。値が無いことも保存する"""
+    def __init__(self, path: str, field_ttl_seconds: Dict[str, float]):
+        self.field_ttl_seconds = field_ttl_seconds
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS place_details ("
+                " place_id TEXT NOT NULL, field TEXT NOT NULL, value TEXT, fetched_at REAL NOT NULL,"
+                " PRIMARY KEY (place_id, field))"
+            )
+
+    def get_many(self, place_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """{place_id: {項目: 値}} を返す (有効期限内の項目のみ)"""
+        if not place_ids:
+            return {}
+        now = time.time()
+        placeholders = ",".join("?" * len(place_ids))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT place_id, field, value, fetched_at FROM place_details WHERE place_id IN ({placeholders})",
+                list(place_ids),
+            ).fetchall()
+        details: Dict[str, Dict[str, Any]] = {}
+        for place_id, field_name, value, fetched_at in rows:
+            if now - fetched_at <= self.field_ttl_seconds.get(field_name, 0):
+                details.setdefault(place_id, {})[field_name] = json.loads(value) if value is not None else None
+        return details
+
+    def put(self, place_id: str, values: Dict[str, Any]) -> None:
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO place_details (place_id, field, value, fetched_at) VALUES (?, ?, ?, ?)",
+                [(place_id, field_name, json.dumps(value, ensure_ascii=False) if value is not None else None, now)
+                 for field_name, value in values.items()],
+            )
+
+    def purge_expired(self) -> int:
+        """最も長い有効期限も過ぎた行を削除し、削除した件数を返す"""
+        oldest = time.time() - max(self.field_ttl_seconds.values(), default=0)
+        with self._lock, self._conn:
+            return self._conn.execute("DELETE FROM place_details WHERE fetched_at < ?", (oldest,)).rowcount
+
+@st.cache_resource(show_spinner=False)
+def get_place_details_cache() -> PlaceDetailsCache:
+    """プロセス全体で共有する Place Details キャッシュを返す (起動時に期限切れの行を削除する)"""
+    cache = PlaceDetailsCache(config.PLACE_DETAILS_CACHE_PATH, config.PLACE_DETAILS_FIELD_TTL_SECONDS)
+    purged = cache.purge_expired()
+    if purged:
+        logger.info(f"Purged {purged} expired place details.")
+    return cache
+
+
+# --- Place Details の取得 ---
+def _parse_details(result: Dict[str, Any], fields: List[str]) -> Dict[str, Any]:
+    """Place Details の result から、要求した項目の値を取り出す (無い項目は None)"""
+    values: Dict[str, Any] = {}
+    for field_name in fields:
+        if field_name == "geometry":
+            location = (result.get("geometry") or {}).get("location") or {}
+            values[field_name] = {"lat": location["lat"], "lng": location["lng"]} if "lat" in location and "lng" in location else None
+        elif field_name == "opening_hours":
+            values[field_name] = (result.get("opening_hours") or {}).get("weekday_text") or None
+        elif field_name == "photos":
+            photos = result.get("photos") or []
+            values[field_name] = photos[0].get("photo_reference") if photos else None
+        else:
+            values[field_name] = result.get(field_name)
+    return values
+
+def fetch_place_details(place_id: str, fields: List[str], deadline: Optional[Deadline] = None) -> Optional[Dict[str, Any]]:
+    """
+    place_id の指定した項目を Place Details で取得し、{項目: 値} を返す。
+    場所が見つからない場合は全項目 None、取得に失敗した場合は None (例外は送出しない)
+    """
+    url = f"{config.GOOGLE_MAPS_BASE_URL}/maps/api/place/details/json"
+    params = {
+        "place_id": place_id,
+        "fields": ",".join(DETAIL_FIELDS[f] for f in fields),
+        "key": config.GOOGLE_PLACES_API_KEY,
+        "language": "ja",
+    }
+    def attempt(timeout: float) -> dict:
+        response = get_http_engine().get(url, params=params, timeout=timeout)
+        response.raise_for_status()
+        results = response.json()
+        if results.get("status") == "OVER_QUERY_LIMIT":
+            raise RetryableError(f"Place Details OVER_QUERY_LIMIT: {results.get('error_message', '')}")
+        return results
+
+    try:
+        with stage_timer("places.details") as event:
+            results = call_with_resilience("places", attempt, config.PLACE_DETAILS_TIMEOUT_SECONDS, deadline)
+            event["status"] = results.get("status")
+    except UpstreamUnavailableError as e:
+        logger.warning(f"Place Details unavailable for {place_id}: {e}")
+        return None
+    except httpx.HTTPError as e:
+        logger.warning(f"Place Details HTTP error for {place_id}: {e}")
+        return None
+    except Exception as e:
+        logger.warning(f"Place Details unexpected error for {place_id}: {e}")
+        return None
+    status = results.get("status")
+    if status == "OK":
+        return _parse_details(results.get("result") or {}, fields)
+    if status == "NOT_FOUND":
+        return {f: None for f in fields} # 閉業などで無くなった場所は、有効期限まで問い合わせない
+    logger.warning(f"Place Details error for {place_id}: Status={status}, Message={results.get('error_message', '')}")
+    return None
+
+
+# --- PlaceRecord への反映 ---
+def _has_field(record: PlaceRecord, field_name: str) -> bool:
+    """レコードがその項目を既に持っているか (Text Search の結果に含まれていた場合など)"""
+    if field_name == "geometry":
+        return record.lat is not None and record.lng is not None
+    if field_name == "photos":
+        return record.photo_reference is not None
+    return getattr(record, field_name) is not None
+
+def _apply_details(record: PlaceRecord, values: Dict[str, Any]) -> None:
+    """取得・キャッシュした項目のうち、レコードに無いものを書き込む"""
+    for field_name, value in values.items():
+        if value is None or _has_field(record, field_name):
+            continue
+        if field_name == "geometry":
+            record.lat, record.lng = value["lat"], value["lng"]
+        elif field_name == "photos":
+            record.photo_reference = value
+        else:
+            setattr(record, field_name, value)
+
+def enrich_place_groups(place_groups: List[PlaceGroup], deadline: Optional[Deadline] = None) -> None:
+    """
+    場所データの各レコードを Place Details で補完する (レコードを直接書き換える)。
+    キャッシュに無い・期限切れの項目だけを、place_id ごとに並列で取得する (最大 PLACE_DETAILS_MAX_PLACES 件)。
+    件数が上限を超える場合は、各 Tool Call の上位の候補から順に (昼食・夕食・宿泊・観光地を1件ずつ交互に) 取得する。
+    取得できなかった場所は補完せずにそのまま残す
+    """
+    if not config.PLACE_DETAILS_ENABLED:
+        return
+    records_by_id: Dict[str, List[PlaceRecord]] = {}
+    for rank_records in zip_longest(*(group.records for group in place_groups)):
+        for record in rank_records:
+            if record is not None and record.place_id:
+                records_by_id.setdefault(record.place_id, []).append(record)
+    if not records_by_id:
+        return
+
+    with stage_timer("places.enrich") as event:
+        cache = get_place_details_cache()
+        cached = cache.get_many(list(records_by_id))
+        missing: Dict[str, List[str]] = {}
+        for place_id, records in records_by_id.items():
+            values = cached.get(place_id, {})
+            for record in records:
+                _apply_details(record, values)
+            fields = [f for f in DETAIL_FIELDS if f not in values and not all(_has_field(r, f) for r in records)]
+            if fields:
+                missing[place_id] = fields
+        if len(missing) > config.PLACE_DETAILS_MAX_PLACES:
+            logger.info(f"Enriching only {config.PLACE_DETAILS_MAX_PLACES} of {len(missing)} places.")
+            missing = dict(list(missing.items())[:config.PLACE_DETAILS_MAX_PLACES])
+        event["places"] = len(records_by_id)
+        event["fetched"] = len(missing)
+
+        if missing:
+            max_workers = min(config.PLACES_MAX_CONCURRENCY, len(missing))
+            with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="okosy-details") as executor:
+                fetched = list(executor.map(lambda item: fetch_place_details(item[0], item[1], deadline), missing.items()))
+            for place_id, values in zip(missing, fetched):
+                if values is None:
+                    continue
+                cache.put(place_id, values)
+                for record in records_by_id[place_id]:
+                    _apply_details(record, values)
+            event["failed"] = sum(1 for values in fetched if values is None)
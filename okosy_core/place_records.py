@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+Tool Call (search_google_places) で取得した場所データの型付きレコード。
+しおりには Tool Call 1回分を PlaceGroup (検索の種類・クエリ・結果の PlaceRecord 一覧・メッセージ) として保存する。
+
+保存形式の版 (PLACES_SCHEMA_VERSION):
+- 1: 「各要素が Tool Call の結果の JSON 文字列」である JSON 配列の文字列 (places_data)
+- 2: PlaceGroup の辞書の配列 (Firestore では配列・マップのまま、SQLite / しおりキャッシュでは JSON 文字列)
+読み込み時は版を判定して PlaceGroup に変換する。版1のデータは読み込んだ時点で版2に書き換える (各保存先で実施)。
+座標・営業時間などの補完項目 (place_details で追加) は版2のまま任意の項目として扱い、無いデータは None とする。
+"""
+import json
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional
+
+from okosy_core.logs import get_logger, preview
+
+logger = get_logger("place_records")
+
+PLACES_SCHEMA_VERSION = 2
+
+
+@dataclass
+class PlaceRecord:
+    """検索で見つかった場所1件"""
+    category: str # 検索した場所の種類 (place_type)
+    name: str
+    address: Optional[str] = None
+    rating: Optional[float] = None
+    price_level: Optional[int] = None
+    place_id: Optional[str] = None
+    # Text Search の結果 / Place Details で補完する項目
+    lat: Optional[float] = None
+    lng: Optional[float] = None
+    business_status: Optional[str] = None # OPERATIONAL / CLOSED_TEMPORARILY / CLOSED_PERMANENTLY
+    opening_hours: Optional[List[str]] = None # 曜日ごとの営業時間 (例: "月曜日: 9時00分～17時00分")
+    photo_reference: Optional[str] = None
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], category: str) -> "PlaceRecord":
+        rating, price_level = data.get("rating"), data.get("price_level")
+        opening_hours = data.get("opening_hours")
+        return cls(
+            category=data.get("category") or category,
+            name=str(data.get("name") or ""),
+            address=data.get("address"),
+            rating=float(rating) if isinstance(rating, (int, float)) else None,
+            price_level=int(price_level) if isinstance(price_level, (int, float)) else None,
+            place_id=data.get("place_id"),
+            lat=_float_or_none(data.get("lat")),
+            lng=_float_or_none(data.get("lng")),
+            business_status=data.get("business_status"),
+            opening_hours=[str(line) for line in opening_hours] if isinstance(opening_hours, list) else None,
+            photo_reference=data.get("photo_reference"),
+        )
+
+
+@dataclass
+class PlaceGroup:
+    """Tool Call 1回分の検索結果。見つからなかった場合は message、失敗した場合は error に理由が入る"""
+    category: str
+    query: Optional[str] = None
+    records: List[PlaceRecord] = field(default_factory=list)
+    message: Optional[str] = None
+    error: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "category": self.category, "query": self.query, "message": self.message, "error": self.error,
+            # 各レコードの category はグループと同じなので保存しない (値の無い項目も保存しない)
+            "records": [{k: v for k, v in asdict(r).items() if k != "category" and v is not None} for r in self.records],
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "PlaceGroup":
+        category = data.get("category") or "unknown"
+        return cls(
+            category=category, query=data.get("query"), message=data.get("message"), error=data.get("error"),
+            records=[PlaceRecord.from_dict(r, category) for r in data.get("records") or [] if isinstance(r, dict)],
+        )
+
+
+def _float_or_none(value: Any) -> Optional[float]:
+    return float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+
+def place_group_from_tool_result(arguments: Dict[str, Any], result: Any) -> PlaceGroup:
+    """search_google_places の引数と結果 (JSON文字列 or パース済みの値) から PlaceGroup を作る"""
+    category = arguments.get("place_type") or "unknown"
+    group = PlaceGroup(category=category, query=arguments.get("query"))
+    if isinstance(result, str):
+        try:
+            result = json.loads(result)
+        except json.JSONDecodeError:
+            logger.warning(f"Skipping invalid JSON in tool result: {preview(result, 200)}")
+            group.error = "場所データの形式が不正です。"
+            return group
+    if isinstance(result, list):
+        group.records = [PlaceRecord.from_dict(place, category) for place in result if isinstance(place, dict)]
+    elif isinstance(result, dict):
+        group.error = result.get("error")
+        group.message = result.get("message")
+    return group
+
+
+# --- 保存形式との変換 ---
+def place_groups_to_documents(groups: Optional[List[PlaceGroup]]) -> List[Dict[str, Any]]:
+    """保存形式 (版2) の辞書の配列にする"""
+    return [group.to_dict() for group in groups or []]
+
+def place_groups_to_json(groups: Optional[List[PlaceGroup]]) -> Optional[str]:
+    """SQLite / しおりキャッシュに保存する JSON 文字列 (版2) にする。データが無ければ None"""
+    return json.dumps(place_groups_to_documents(groups), ensure_ascii=False) if groups else None
+
+def load_place_groups(stored: Any) -> List[PlaceGroup]:
+    """
+    保存されている場所データ (版1・版2のどちらでも、JSON文字列でもパース済みでもよい) を PlaceGroup の一覧にする。
+    版1 (Tool Call の結果の JSON 文字列の配列) は検索の種類が分からないため category を "unknown" とする
+    """
+    if not stored:
+        return []
+    if isinstance(stored, str):
+        try:
+            stored = json.loads(stored)
+        except json.JSONDecodeError:
+            logger.warning(f"Stored places data is not valid JSON: {preview(stored, 200)}")
+            return []
+    if not isinstance(stored, list):
+        return []
+    groups = []
+    for item in stored:
+        if isinstance(item, dict) and "records" in item:
+            groups.append(PlaceGroup.from_dict(item)) # 版2
+        else:
+            groups.append(place_group_from_tool_result({}, item)) # 版1: 要素は JSON 文字列
+    return groups
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+Tool Call で取得した場所データ (PlaceGroup) の表示。
+新しいしおりの画面と過去のしおりの画面で共通に使う。
+表はトグルを開いたときだけ作成し、しおりごとにセッション内でキャッシュする (再実行のたびに作り直さない)。
+"""
+from collections import OrderedDict
+from typing import Any, List, Optional, Tuple
+
+import streamlit as st
+
+from okosy_core.place_records import PlaceGroup, PlaceRecord
+
+# Tool Call の呼び出し順の見出し (それ以降は「Tool Call n 結果」)
+TOOL_CALL_TITLES = ["① 昼食候補", "② 夕食候補", "③ 宿泊候補", "④ 観光地候補"]
+MAP_LINK_COLUMN = "マップリンク"
+# セッションごとに表をキャッシュしておくしおりの数 (古いものから捨てる)
+PLACE_TABLE_CACHE_SIZE = 8
+
+# 1グループ分の表示内容: (見出し, 種類 "table" / "error" / "info", 表 or メッセージ, 元のグループ)
+Section = Tuple[str, str, Any, PlaceGroup]
+
+
+def place_map_url(place_id: Optional[str]) -> str:
+    """PlaceID から Google マップの URL を作る"""
+    return f"https://www.google.com/maps/place/?q=place_id:{place_id}"
+
+def build_place_table(records: List[PlaceRecord]) -> Any:
+    """場所レコードの一覧を表示用の DataFrame にする (列ごとに内包表記で作り、行ごとの apply はしない)"""
+    import pandas as pd # 表示時にのみ読み込む
+    return pd.DataFrame({
+        "name": [r.name for r in records],
+        "rating": [r.rating for r in records],
+        "address": [r.address for r in records],
+        MAP_LINK_COLUMN: [f"[{r.name}]({place_map_url(r.place_id)})" for r in records],
+    })
+
+def _build_sections(place_groups: List[PlaceGroup]) -> List[Section]:
+    sections = []
+    for i, group in enumerate(place_groups):
+        title = TOOL_CALL_TITLES[i] if i < len(TOOL_CALL_TITLES) else f"Tool Call {i+1} 結果"
+        if group.error:
+            sections.append((title, "error", f"エラー: {group.error}", group))
+        elif not group.records:
+            sections.append((title, "info", group.message or "場所データが空です。", group))
+        else:
+            try:
+                sections.append((title, "table", build_place_table(group.records), group))
+            except Exception as df_e:
+                sections.append((title, "error", f"データフレーム変換/表示中にエラー: {df_e}", group))
+    return sections
+
+def _cached_sections(cache_key: str, place_groups: List[PlaceGroup]) -> List[Section]:
+    """しおりごとの表示内容をセッション内でキャッシュする (LRU)"""
+    cache: OrderedDict = st.session_state.setdefault("place_table_cache", OrderedDict())
+    sections = cache.get(cache_key)
+    if sections is None:
+        sections = _build_sections(place_groups)
+        cache[cache_key] = sections
+        while len(cache) > PLACE_TABLE_CACHE_SIZE:
+            cache.popitem(last=False)
+    else:
+        cache.move_to_end(cache_key)
+    return sections
+
+
+def render_place_groups(cache_key: str, place_groups: Optional[List[PlaceGroup]], label: str, empty_message: str) -> None:
+    """
+    場所データの表を表示する。cache_key は表示する場所データを識別する文字列 (保存済みならしおりID、生成直後なら生成結果ごとのID)。
+    トグルが閉じている間は表を作らない
+    """
+    if not st.toggle(label, value=False, key=f"place_table_toggle_{cache_key}"):
+        return
+    if not place_groups:
+        st.info(empty_message)
+        return
+    for title, kind, payload, group in _cached_sections(cache_key, place_groups):
+        st.subheader(title)
+        if kind == "table":
+            st.dataframe(payload, use_container_width=True, hide_index=True)
+        elif kind == "error":
+            st.error(payload)
+            if group.records:
+                st.json(group.to_dict())
+        else:
+            st.info(payload)
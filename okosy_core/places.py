@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+"""Google Maps (Geocoding / Places Text Search) 関連のヘルパー"""
+import json
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import httpx
+import streamlit as st
+
+from okosy_core import config
+from okosy_core.http_engine import get_http_engine
+from okosy_core.resilience import Deadline, RetryableError, UpstreamUnavailableError, call_with_resilience
+from okosy_core.logs import get_logger, redact, stage_timer
+
+logger = get_logger("places")
+
+
+# --- 都道府県の代表座標 / ジオコーディング ---
+@st.cache_resource
+def load_prefecture_centroids() -> Dict[str, str]:
+    """同梱の都道府県代表座標テーブルを読み込み、{都道府県名: "lat,lng"} を返す"""
+    try:
+        with open(config.PREFECTURE_CENTROIDS_PATH, encoding="utf-8") as f:
+            table = json.load(f)
+        centroids = {name: f"{c['lat']},{c['lng']}" for name, c in table.get("prefectures", {}).items()}
+        logger.info(f"Loaded {len(centroids)} prefecture centroids (version {table.get('version')}).")
+        return centroids
+    except Exception as e:
+        logger.warning(f"Failed to load prefecture centroids from {config.PREFECTURE_CENTROIDS_PATH}: {e}")
+        return {}
+
+class GeocodeMemo:
+    """住所 -> 座標 のメモ (スレッドセーフ)。見つからなかった住所も短いTTLで保持する (ネガティブキャッシュ)"""
+    def __init__(self, ttl_seconds: float, negative_ttl_seconds: float):
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self._entries: Dict[str, tuple[float, Optional[str]]] = {} # 住所 -> (有効期限, 座標 or None)
+        self._lock = threading.Lock()
+
+    def get(self, address: str) -> tuple[bool, Optional[str]]:
+        """(ヒットしたか, 座標) を返す"""
+        with self._lock:
+            entry = self._entries.get(address)
+            if entry is None:
+                return False, None
+            expires_at, coords = entry
+            if time.monotonic() > expires_at:
+                del self._entries[address]
+                return False, None
+            return True, coords
+
+    def put(self, address: str, coords: Optional[str]) -> None:
+        ttl = self.ttl_seconds if coords else self.negative_ttl_seconds
+        with self._lock:
+            self._entries[address] = (time.monotonic() + ttl, coords)
+
+@st.cache_resource
+def get_geocode_memo() -> GeocodeMemo:
+    """プロセス全体で共有するジオコーディング結果のメモを返す"""
+    return GeocodeMemo(config.GEOCODE_CACHE_TTL_SECONDS, config.GEOCODE_NEGATIVE_CACHE_TTL_SECONDS)
+
+def get_coordinates(address, deadline: Optional[Deadline] = None):
+    """Google Geocoding APIを使用して住所から緯度経度を取得する (結果はメモ化)"""
+    memo = get_geocode_memo()
+    hit, cached_coords = memo.get(address)
+    if hit:
+        return cached_coords
+
+    geocode_url = f"{config.GOOGLE_MAPS_BASE_URL}/maps/api/geocode/json"
+    params = {
+        "address": address,
+        "key": config.GOOGLE_PLACES_API_KEY,
+        "language": "ja",
+        "region": "JP"
+    }
+    def attempt(timeout: float) -> dict:
+        response = get_http_engine().get(geocode_url, params=params, timeout=timeout)
+        response.raise_for_status()
+        results = response.json()
+        if results.get("status") == "OVER_QUERY_LIMIT":
+            raise RetryableError(f"Geocoding OVER_QUERY_LIMIT: {results.get('error_message', '')}")
+        return results
+
+    try:
+        with stage_timer("geocoding") as event:
+            results = call_with_resilience("geocoding", attempt, config.GEOCODE_TIMEOUT_SECONDS, deadline)
+            event["status"] = results.get("status")
+        if results["status"] == "OK" and results["results"]:
+            location = results["results"][0]["geometry"]["location"]
+            coords = f"{location['lat']},{location['lng']}"
+            memo.put(address, coords)
+            return coords
+        else:
+            logger.warning(f"Geocoding failed: Status={results.get('status')}, Error={results.get('error_message', '')}")
+            if results.get("status") == "ZERO_RESULTS":
+                memo.put(address, None) # 存在しない住所は一定時間問い合わせない
+            return None
+    except UpstreamUnavailableError as e:
+        logger.warning(f"Geocoding unavailable for address {address}: {e}")
+        return None
+    except httpx.HTTPError as e:
+        logger.warning(f"Geocoding HTTP error: {e}")
+        return None
+    except Exception as e:
+        logger.warning(f"Geocoding unexpected error: {e}")
+        return None
+
+def resolve_coordinates(address: Optional[str], deadline: Optional[Deadline] = None) -> Optional[str]:
+    """住所を "lat,lng" に解決する。都道府県名は同梱テーブルから引き、ネットワーク通信を行わない"""
+    if not address:
+        return None
+    centroid = load_prefecture_centroids().get(address.strip())
+    if centroid:
+        return centroid
+    return get_coordinates(address, deadline)
+
+# --- Google Places API レスポンスキャッシュ (全セッションで共有) ---
+class PlacesResponseCache:
+    """Text Search の生レスポンスを保持する LRU + TTL キャッシュ (メモリ予算付き, スレッドセーフ)"""
+    def __init__(self, ttl_seconds: float, max_bytes: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[tuple, tuple[float, int, dict]]" = OrderedDict() # key -> (格納時刻, サイズ, レスポンス)
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, size, value = entry
+            if time.monotonic() - stored_at > self.ttl_seconds:
+                del self._entries[key]
+                self._total_bytes -= size
+                return None
+            self._entries.move_to_end(key) # LRU: 最近使ったものを末尾へ
+            return value
+
+    def put(self, key: tuple, value: dict) -> None:
+        size = len(json.dumps(value, ensure_ascii=False).encode("utf-8"))
+        if size > self.max_bytes:
+            return # 予算を超える単一レスポンスはキャッシュしない
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._total_bytes -= old[1]
+            self._entries[key] = (time.monotonic(), size, value)
+            self._total_bytes += size
+            # 予算内に収まるまで古いものから削除
+            while self._total_bytes > self.max_bytes and self._entries:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self._total_bytes -= evicted_size
+
+@st.cache_resource
+def get_places_cache() -> PlacesResponseCache:
+    """プロセス全体で共有する Places レスポンスキャッシュを返す"""
+    return PlacesResponseCache(config.PLACES_CACHE_TTL_SECONDS, config.PLACES_CACHE_MAX_BYTES)
+
+def normalize_places_query_key(query: str, location_bias: Optional[str], place_type: str) -> tuple:
+    """表記ゆれ(全角/半角・大文字小文字・空白)と座標の細かな差を吸収したキャッシュキーを作る"""
+    normalized_query = " ".join(unicodedata.normalize("NFKC", query).casefold().split())
+    normalized_location = None
+    if location_bias:
+        try:
+            lat, lng = (float(v) for v in location_bias.split(","))
+            normalized_location = f"{lat:.2f},{lng:.2f}" # 約1km単位 (検索半径は20km)
+        except ValueError:
+            normalized_location = location_bias.strip()
+    return (normalized_query, normalized_location, place_type)
+
+def fetch_places_text_search(query: str, location_bias: Optional[str], place_type: str,
+                             deadline: Optional[Deadline] = None) -> dict:
+    """
+    Text Search の生レスポンスを返す (キャッシュ経由)。429/5xx/OVER_QUERY_LIMIT/タイムアウトは再試行し、
+    再試行しても回復しない場合は UpstreamUnavailableError、再試行対象外のHTTPエラー (4xx) は httpx の例外として送出する
+    """
+    cache = get_places_cache()
+    cache_key = normalize_places_query_key(query, location_bias, place_type)
+    cached = cache.get(cache_key)
+    if cached is not None:
+        logger.debug(f"Places cache hit: {cache_key}")
+        return cached
+
+    base_url = f"{config.GOOGLE_MAPS_BASE_URL}/maps/api/place/textsearch/json"
+    params = {
+        "query": query,
+        "key": config.GOOGLE_PLACES_API_KEY,
+        "language": "ja",
+        "region": "JP",
+        "type": place_type,
+    }
+    if location_bias:
+        params["location"] = location_bias
+        params["radius"] = 20000 # 20km圏内をバイアス
+
+    logger.debug("Request parameters: %s", {k: v for k, v in params.items() if k != "key"})
+
+    def attempt(timeout: float) -> dict:
+        response = get_http_engine().get(base_url, params=params, timeout=timeout)
+        response.raise_for_status()
+        results = response.json()
+        if results.get("status") == "OVER_QUERY_LIMIT":
+            raise RetryableError(f"Google Places API OVER_QUERY_LIMIT: {results.get('error_message', '')}")
+        return results
+
+    with stage_timer("places.text_search", place_type=place_type) as event:
+        results = call_with_resilience("places", attempt, config.PLACES_TIMEOUT_SECONDS, deadline)
+        event["status"] = results.get("status")
+        event["results"] = len(results.get("results", []))
+    # 正常応答のみキャッシュする (OVER_QUERY_LIMIT などは次回再試行させる)
+    if results.get("status") in ("OK", "ZERO_RESULTS"):
+        cache.put(cache_key, results)
+    return results
+
+# --- Google Places API 検索関数 ---
+def search_google_places(query: str,
+                         location_bias: Optional[str] = None,
+                         place_type: str = "tourist_attraction",
+                         min_rating: Optional[float] = 4.0, # <<< Optionalに変更
+                         price_levels: Optional[str] = None,
+                         deadline: Optional[Deadline] = None) -> str:
+    """
+    Google Places API (Text Search) を使用して場所を検索し、結果をJSON文字列で返す。
+    deadline はモデルが指定する引数ではなく、呼び出し側 (Tool Call 実行) が割り当てた期限
+    """
+    logger.info(f"Google Places search: query={query}, location_bias={location_bias}, type={place_type}, rating={min_rating}, price={price_levels}")
+
+    try:
+        # 評価・価格帯フィルタはキャッシュ済みデータに対して適用する
+        results = fetch_places_text_search(query, location_bias, place_type, deadline)
+        status = results.get("status")
+
+        if status == "OK":
+            filtered_places = []
+            count = 0
+            for place in results.get("results", []):
+                place_rating = place.get("rating", 0)
+                place_price = place.get("price_level")
+
+                # 評価フィルタ (min_rating が指定されている場合のみ適用)
+                if min_rating is not None and place_rating < min_rating: # <<< None チェック追加
+                    continue
+
+                # 価格帯フィルタ
+                if price_levels:
+                    try:
+                        allowed_levels = [int(x.strip()) for x in price_levels.split(',') if x.strip().isdigit()]
+                        if place_price is not None and place_price not in allowed_levels:
+                            continue
+                    except ValueError:
+                        logger.warning(f"Invalid price_levels format: {price_levels}")
+
+                location = (place.get("geometry") or {}).get("location") or {}
+                photos = place.get("photos") or []
+                filtered_places.append({
+                    "name": place.get("name"), "address": place.get("formatted_address"),
+                    "rating": place_rating, "price_level": place_price,
+                    "types": place.get("types", []), "place_id": place.get("place_id"),
+                    # Place Details での補完を省けるよう、Text Search に含まれる座標・営業状況・写真も残す
+                    "lat": location.get("lat"), "lng": location.get("lng"),
+                    "business_status": place.get("business_status"),
+                    "photo_reference": photos[0].get("photo_reference") if photos else None,
+                })
+                count += 1
+                if count >= 5: break
+
+            if not filtered_places:
+                logger.info("No places found matching the criteria.")
+                return json.dumps({"message": "条件に合致する場所が見つかりませんでした。"}, ensure_ascii=False)
+            else:
+                logger.info(f"Found {len(filtered_places)} places.")
+                return json.dumps(filtered_places, ensure_ascii=False)
+
+        elif status == "ZERO_RESULTS":
+             logger.info("Google Places API returned ZERO_RESULTS.")
+             return json.dumps({"message": "検索条件に合致する場所が見つかりませんでした。"}, ensure_ascii=False)
+        else:
+            error_msg = results.get('error_message', '')
+            logger.warning(f"Google Places API error: Status={status}, Message={error_msg}")
+            return json.dumps({"error": f"Google Places API Error: {status}, {redact(error_msg)}"}, ensure_ascii=False)
+
+    except UpstreamUnavailableError as e:
+        # 混雑 (429/OVER_QUERY_LIMIT)・障害 (5xx)・タイムアウトが再試行後も続いた場合と、サーキットブレーカー・期限切れ
+        logger.warning(f"Google Places API unavailable for query {query}: {e}")
+        return json.dumps({"error": f"Google Places APIが一時的に利用できないため検索できませんでした: {redact(str(e))}"}, ensure_ascii=False)
+    except httpx.HTTPError as e:
+        logger.warning(f"Google Places API HTTP request error: {e}")
+        return json.dumps({"error": f"Google Places APIへの接続中にHTTPエラーが発生しました: {redact(str(e))}"}, ensure_ascii=False)
+    except Exception as e:
+        logger.exception(f"Unexpected error during Google Places search: {e}")
+        return json.dumps({"error": f"場所検索中に予期せぬエラーが発生しました: {redact(str(e))}"}, ensure_ascii=False)
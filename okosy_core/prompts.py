@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""しおり生成用のプロンプト組み立て"""
+import json
+from typing import Any, Dict
+
+
+def build_itinerary_prompt(planner: Dict[str, Any], destination: str, purpose: str, companion: str,
+                           days: int, budget: str, preferences: Dict[str, Any]) -> str:
+    """プランナー・行き先・基本情報・好みから、しおり生成の指示プロンプトを組み立てる"""
+    navigator_persona = planner.get("prompt_persona", "プロの旅行プランナーとして")
+    food_style_list = preferences.get('food_style', [])
+    food_style_example = food_style_list[0] if food_style_list else "食事"
+    word_list = preferences.get('word', [])
+    first_word_example = word_list[0] if word_list else '観光'
+
+    return f"""
+あなたは旅のプランナー「Okosy」です。ユーザーの入力情報をもとに、SNS映えや定番から少し離れた、ユーザー自身の感性に寄り添うような、パーソナルな旅のしおりを作成してください。
+**ユーザーに最高の旅体験をデザインすることを最優先としてください。**
+**【重要】ユーザーは具体的で最新の場所情報を求めています。そのため、以下の指示に従って必ず `search_google_places` ツールを使用してください。**
+
+【基本情報】
+- 行き先: {destination}
+- 目的・気分: {purpose}
+- 同行者: {companion}
+- 旅行日数: {days}日
+- 予算感: {budget}
+
+【ユーザーの好み】
+{json.dumps(preferences, ensure_ascii=False, indent=2)}
+★★★ 上記の好み（特に「自然」「歴史文化」「アート」「ウェルネス」の度合い、「気になるワード」、「MBTI（もしあれば）」）や、ユーザーがアップロードした好みの画像（もしあれば、画像ラベルとして後述）も考慮して、雰囲気や場所選びの参考にしてください。★★★
+
+【出力指示】
+1.  **構成:** 冒頭に、{planner['name']}として、なぜこの目的地({destination})を選んだのか、どんな旅になりそうか、全体の総括を **{navigator_persona}** 言葉で語ってください。その後、{days}日間の旅程を、各日ごとに「午前」「午後」「夜」のセクションに分けて提案してください。時間的な流れが自然になるようにプランを組んでください。
+
+2.  **内容:**
+    * なぜその場所や過ごし方がユーザーの目的・気分・好みに合っているか、**{navigator_persona}言葉**で理由や提案コメントを添えてください。「気になるワード」の要素を意識的にプランに盛り込んでください。MBTIタイプも性格傾向を考慮するヒントにしてください。画像から読み取れた特徴も踏まえてください。
+    * 隠れ家/定番のバランスはユーザーの好みに合わせてください。
+    * 食事や宿泊の好みも反映してください。
+    * **【説明の詳細度】** 各場所や体験について、情景が目に浮かぶような、**{navigator_persona}として感情豊かに、魅力的で詳細な説明**を心がけてください。単なるリストアップではなく、そこで感じられるであろう雰囲気や感情、おすすめのポイントなどを描写してください。ユーザーの好みを反映した説明をお願いします。（文字数の目安は設けませんが、十分な情報量を提供してください）
+
+3.  **【場所検索の実行 - 必須】** 以下の4種類の場所について、それぞれ **必ず `search_google_places` ツールを呼び出して** 最新の情報を取得してください。取得した情報は行程提案に **必ず** 反映させる必要があります。
+    * **① 昼食:** `place_type`を 'restaurant' または 'cafe' として、ユーザーの好みに合う昼食場所を検索してください。（クエリ例: "{destination} ランチ {preferences.get('word', ['おしゃれ'])[0]}"）**ツール呼び出しを実行してください。**
+    * **② 夕食:** `place_type`を 'restaurant' として、ユーザーの好みに合う夕食場所を検索してください。（クエリ例: "{destination} ディナー {food_style_example} 人気"）**ツール呼び出しを実行してください。**
+    * **③ 宿泊:** `place_type`を 'lodging' として、ユーザーの宿泊タイプや好みに合う宿泊施設を検索してください。（クエリ例: "{destination} {preferences.get('accom_type','宿')} {preferences.get('word', ['温泉', '静か'])[0]}"）**ツール呼び出しを実行してください。**（宿泊タイプが「こだわらない」でも検索は実行すること）
+    * **④ 観光地:** `place_type`を 'tourist_attraction', 'museum', 'park', 'art_gallery' 等からユーザーの好みに合うものを選択し、関連する観光スポットを検索してください。（クエリ例: "{destination} {first_word_example} スポット"）**ツール呼び出しを実行してください。**
+
+4.  **【検索結果の利用と表示】**
+    * `search_google_places` ツールで得られた場所（レストラン、カフェ、宿、観光地など）を提案に含める際は、その場所名にGoogle Mapsへのリンクを **Markdown形式** で付与してください。**リンクのURLは `https://www.google.com/maps/place/?q=place_id:<PLACE_ID>` の形式**とし、`<PLACE_ID>` はツールの結果に含まれる `place_id` を使用してください。例: `[レストラン名](https://www.google.com/maps/place/?q=place_id:ChIJN1t_tDeuEmsRUsoyG83frY4)`
+    * **【重要】** 場所名は**Markdownリンクの中にのみ**含めてください。リンクの前後で場所名を繰り返さないでください。
+    * デバック表示で出てくるお店に関しても、同じように場所名に対してリンクが着くようにしてください(そレができればマップコードは出力不要です)
+    * **各日の夜のパートには、ステップ③のツール検索結果から**、**必ず**最適な宿泊施設を1つ選び、その名前と上記形式のGoogle Mapsリンクを記載してください。もし検索結果がない場合や検索しなかった場合でも、一般的な宿泊エリアやタイプの提案をしてください。
+    * ツールの結果に `opening_hours`（曜日ごとの営業時間）や `business_status` が含まれる場合は、営業時間外や定休日の時間帯にその場所を組み込まないでください。`business_status` が `CLOSED_TEMPORARILY` / `CLOSED_PERMANENTLY` の場所は提案しないでください。
+    * 初日は必ず午前から始め、その際にホテルは出さないでください。また最終日は夜の情報を出力せずに午後で帰るようにしてください。
+    * ツール検索でエラーが出たり、場所が見つからなかったりした場合は、無理に場所名を記載せず、その旨を行程中に記載してください。（例：「残念ながら条件に合う隠れ家カフェは見つかりませんでしたが、このエリアには素敵なカフェがたくさんありますよ。」）
+
+5.  **形式:** 全体を読みやすい**Markdown形式**で出力してください。各日の区切り（例: `--- 1日目 ---`）、午前/午後/夜のセクション（例: `**午前:**`）などを明確にしてください。
+
+{planner['name']}として、ユーザーに最高の旅体験をデザインしてください。
+"""
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+外部API呼び出しの再試行・サーキットブレーカー・期限 (デッドライン) 管理。
+429 / 5xx / OVER_QUERY_LIMIT / タイムアウトはジッター付き指数バックオフで再試行し、
+失敗が続く上流 (places / geocoding / vision / openai) はサーキットブレーカーで一定時間呼び出しを止める。
+"""
+import random
+import threading
+import time
+from typing import Callable, Dict, Optional, TypeVar
+
+import httpx
+import openai
+import streamlit as st
+
+from okosy_core import config
+from okosy_core.logs import get_logger, redact
+
+logger = get_logger("resilience")
+
+T = TypeVar("T")
+
+
+class UpstreamUnavailableError(Exception):
+    """上流APIが利用できない (混雑・障害・期限切れ) ことを表す例外の基底クラス"""
+
+
+class RetryableError(UpstreamUnavailableError):
+    """上流APIが再試行可能なエラー (OVER_QUERY_LIMIT など) を返した"""
+
+
+class CircuitOpenError(UpstreamUnavailableError):
+    """サーキットブレーカーが開いているため呼び出しを行わなかった"""
+
+
+class DeadlineExceededError(UpstreamUnavailableError):
+    """しおり生成全体の期限内に呼び出しを完了できない"""
+
+
+class RetriesExhaustedError(UpstreamUnavailableError):
+    """再試行可能なエラーが続き、最大試行回数 (または期限) 内に成功しなかった。__cause__ に最後のエラーが入る"""
+
+
+class Deadline:
+    """処理全体の期限。残り時間を各呼び出しのタイムアウトに割り当てるために使う"""
+    def __init__(self, seconds: float):
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def child(self, seconds: float) -> "Deadline":
+        """この期限を超えない範囲で、seconds 秒後を期限とする子デッドラインを作る"""
+        return Deadline(min(seconds, self.remaining()))
+
+
+class CircuitBreaker:
+    """連続失敗が閾値を超えたら一定時間呼び出しを遮断し、その後1件だけ試行を許可する (half-open)"""
+    def __init__(self, name: str, failure_threshold: int, reset_timeout_seconds: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_seconds = reset_timeout_seconds
+        self._consecutive_failures = 0
+        self._opened_at: Optional[float] = None
+        self._half_open_trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at >= self.reset_timeout_seconds:
+                return "half_open"
+            return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_timeout_seconds or self._half_open_trial:
+                return False
+            self._half_open_trial = True # 復旧確認のための1件だけ通す
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._consecutive_failures = 0
+            self._opened_at = None
+            self._half_open_trial = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._consecutive_failures += 1
+            if self._half_open_trial or self._consecutive_failures >= self.failure_threshold:
+                if self._opened_at is None or self._half_open_trial:
+                    logger.info(f"Circuit breaker '{self.name}' opened after {self._consecutive_failures} consecutive failures.")
+                self._opened_at = time.monotonic()
+                self._half_open_trial = False
+
+
+@st.cache_resource(show_spinner=False)
+def _circuit_breaker_registry() -> Dict[str, CircuitBreaker]:
+    return {}
+
+_registry_lock = threading.Lock()
+
+def get_circuit_breaker(upstream: str) -> CircuitBreaker:
+    """上流ごとのサーキットブレーカー (プロセス全体で共有) を返す"""
+    registry = _circuit_breaker_registry()
+    with _registry_lock:
+        breaker = registry.get(upstream)
+        if breaker is None:
+            breaker = CircuitBreaker(upstream, config.CIRCUIT_FAILURE_THRESHOLD, config.CIRCUIT_RESET_SECONDS)
+            registry[upstream] = breaker
+        return breaker
+
+
+def is_retryable_error(error: Exception) -> bool:
+    """再試行で回復が見込めるエラーか (タイムアウト・接続エラー・429・5xx・OVER_QUERY_LIMIT)"""
+    if isinstance(error, RetryableError):
+        return True
+    if isinstance(error, (httpx.TimeoutException, httpx.TransportError)):
+        return True
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code == 429 or error.response.status_code >= 500
+    if isinstance(error, (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code >= 500
+    return False
+
+
+def backoff_delay(attempt: int) -> float:
+    """attempt 回目 (0始まり) の失敗後の待ち時間 (full jitter 付き指数バックオフ)"""
+    return random.uniform(0, min(config.RETRY_MAX_DELAY_SECONDS, config.RETRY_BASE_DELAY_SECONDS * (2 ** attempt)))
+
+
+def call_with_resilience(upstream: str, call: Callable[[float], T], timeout: float,
+                         deadline: Optional[Deadline] = None) -> T:
+    """
+    call(タイムアウト秒) を再試行・サーキットブレーカー付きで実行する。
+    各試行のタイムアウトは timeout と deadline の残り時間の小さい方。再試行不能なエラーはそのまま送出し、
+    再試行しても成功しなかった場合は RetriesExhaustedError (UpstreamUnavailableError) を送出する。
+    """
+    breaker = get_circuit_breaker(upstream)
+    last_error: Optional[Exception] = None
+    for attempt in range(config.RETRY_MAX_ATTEMPTS):
+        if not breaker.allow():
+            raise CircuitOpenError(f"{upstream} は一時的に利用を停止しています (サーキットブレーカー作動中)")
+        attempt_timeout = timeout if deadline is None else min(timeout, deadline.remaining())
+        if attempt_timeout <= 0:
+            raise DeadlineExceededError(f"{upstream} の呼び出し前に処理の期限を過ぎました")
+        try:
+            result = call(attempt_timeout)
+        except Exception as e:
+            if not is_retryable_error(e):
+                breaker.record_success() # 上流自体は応答している (リクエスト内容のエラー)
+                raise
+            breaker.record_failure()
+            last_error = e
+            delay = backoff_delay(attempt)
+            is_last_attempt = attempt + 1 >= config.RETRY_MAX_ATTEMPTS
+            if is_last_attempt or (deadline is not None and delay >= deadline.remaining()):
+                break
+            logger.info(f"Retrying {upstream} after {type(e).__name__} (attempt {attempt + 1}, wait {delay:.2f}s)")
+            time.sleep(delay)
+            continue
+        breaker.record_success()
+        return result
+    assert last_error is not None
+    raise RetriesExhaustedError(
+        f"{upstream} の呼び出しが再試行しても成功しませんでした ({type(last_error).__name__}: {redact(str(last_error))})"
+    ) from last_error
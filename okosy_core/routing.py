@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+"""
+場所の座標からの日ごとの行程 (訪問順) の計算。
+Tool Call で見つかった観光地を日数分のまとまりに分け、各日の訪問順を巡回セールスマン問題の近似
+(最近傍法 + 2-opt) で決める。昼食・夕食・宿泊の候補は各日のルートに近いものを割り当てる。
+距離は NumPy で一度に計算した大円距離 (haversine) の行列を使い、外部APIは呼ばない。
+結果は2回目の OpenAI 呼び出しに「ルート案」として渡す (route_guidance)。
+"""
+import json
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from okosy_core.place_records import PlaceGroup, PlaceRecord
+from okosy_core.logs import get_logger, stage_timer
+
+logger = get_logger("routing")
+
+EARTH_RADIUS_KM = 6371.0088
+# 行程の訪問先ではなく、各日のルートの近くから選ぶ候補の種類
+MEAL_CATEGORIES = {"restaurant", "cafe"}
+LODGING_CATEGORIES = {"lodging"}
+# 1日あたりに割り当てる食事の候補数
+MEAL_CANDIDATES_PER_DAY = 2
+CLUSTER_MAX_ITERATIONS = 20
+
+
+@dataclass
+class DayRoute:
+    """1日分の行程 (訪問順の観光地・近くの食事候補・宿泊候補・観光地間の移動距離)"""
+    day: int
+    stops: List[PlaceRecord]
+    meals: List[PlaceRecord] = field(default_factory=list)
+    lodging: Optional[PlaceRecord] = None
+    distance_km: float = 0.0
+
+
+@dataclass
+class RoutePlan:
+    """日ごとの行程の一覧"""
+    days: List[DayRoute]
+    total_days: int # 旅行日数 (観光地が日数より少ない場合、days は total_days より短い)
+    skipped: int = 0 # 座標が無いため計算に含めなかった場所の数
+
+
+# --- 距離行列 ---
+def haversine_matrix(lats: np.ndarray, lngs: np.ndarray) -> np.ndarray:
+    """緯度・経度 (度) の配列から、全地点間の大円距離 (km) の行列を作る"""
+    lat = np.radians(np.asarray(lats, dtype=float))
+    lng = np.radians(np.asarray(lngs, dtype=float))
+    dlat = lat[:, None] - lat[None, :]
+    dlng = lng[:, None] - lng[None, :]
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat)[:, None] * np.cos(lat)[None, :] * np.sin(dlng / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+# --- 日ごとのまとまりへの分割 (k-medoids) ---
+def _assign_with_capacity(dist: np.ndarray, medoids: List[int], capacity: int) -> np.ndarray:
+    """
+    各地点を、まだ空きのある代表点のうち最も近いものに割り当てる (1まとまり最大 capacity 地点)。
+    代表点自身は必ず自分のまとまりに入れ、残りは代表点との距離が近い組から順に割り当てる
+    """
+    labels = np.full(len(dist), -1)
+    sizes = [1] * len(medoids)
+    for c, medoid in enumerate(medoids):
+        labels[medoid] = c
+    pair_dist = dist[:, medoids]
+    for flat in np.argsort(pair_dist, axis=None, kind="stable"):
+        point, c = divmod(int(flat), len(medoids))
+        if labels[point] == -1 and sizes[c] < capacity:
+            labels[point] = c
+            sizes[c] += 1
+    return labels
+
+def _medoid(dist: np.ndarray, members: np.ndarray) -> int:
+    """members のうち、他の地点への距離の合計が最小の地点"""
+    return int(members[np.argmin(dist[np.ix_(members, members)].sum(axis=1))])
+
+def cluster_by_day(dist: np.ndarray, k: int) -> List[np.ndarray]:
+    """
+    距離行列 dist の地点を k 個のまとまりに分け、各まとまりの地点番号の配列を返す。
+    各まとまりの地点数は ceil(n/k) 以下に抑え、空のまとまりは返さない (同じ座標の地点が重なっていても k 個に分ける)。
+    初期の代表点は互いに最も離れた地点から選ぶ (乱数を使わないため、同じ入力には同じ結果を返す)
+    """
+    n = len(dist)
+    k = max(1, min(k, n))
+    capacity = -(-n // k)
+    medoids = [int(np.argmax(dist.sum(axis=1)))]
+    while len(medoids) < k:
+        # 選択済みの地点は除く (同じ座標の地点が複数あると、残りの地点との距離がすべて 0 になるため)
+        farthest = dist[:, medoids].min(axis=1)
+        farthest[medoids] = -np.inf
+        medoids.append(int(np.argmax(farthest)))
+    labels = _assign_with_capacity(dist, medoids, capacity)
+    for _ in range(CLUSTER_MAX_ITERATIONS):
+        # まとまりの中で、他の地点への距離の合計が最小の地点を代表点にする (空のまとまりは元の代表点のまま)
+        new_medoids = []
+        for c in range(k):
+            members = np.flatnonzero(labels == c)
+            new_medoids.append(_medoid(dist, members) if len(members) else medoids[c])
+        if new_medoids == medoids:
+            break
+        medoids = new_medoids
+        labels = _assign_with_capacity(dist, medoids, capacity)
+    clusters = [np.flatnonzero(labels == c) for c in range(k)]
+    return [members for members in clusters if len(members)]
+
+
+# --- 訪問順 (最近傍法 + 2-opt) ---
+def _path_length(dist: np.ndarray, route: List[int]) -> float:
+    return float(dist[route[:-1], route[1:]].sum()) if len(route) > 1 else 0.0
+
+def order_stops(dist: np.ndarray, nodes: List[int], start: Optional[int] = None) -> List[int]:
+    """
+    nodes を巡る経路 (始点から出発し、戻らない) の訪問順を返す。
+    start を指定するとその地点 (nodes に含まれない地点でもよい) に最も近い地点から始める
+    """
+    if len(nodes) <= 1:
+        return list(nodes)
+    remaining = list(nodes)
+    first = remaining[int(np.argmin(dist[start, remaining]))] if start is not None else remaining[0]
+    route = [first]
+    remaining.remove(first)
+    while remaining: # 最近傍法
+        nearest = remaining[int(np.argmin(dist[route[-1], remaining]))]
+        route.append(nearest)
+        remaining.remove(nearest)
+    # 2-opt: 区間を反転して短くなる限り繰り返す (始点は固定)
+    improved = True
+    while improved:
+        improved = False
+        for i in range(1, len(route) - 1):
+            for j in range(i + 1, len(route)):
+                a, b, c = route[i - 1], route[i], route[j]
+                delta = dist[a, c] - dist[a, b]
+                if j + 1 < len(route):
+                    d = route[j + 1]
+                    delta += dist[b, d] - dist[c, d]
+                if delta < -1e-9:
+                    route[i:j + 1] = reversed(route[i:j + 1])
+                    improved = True
+    return route
+
+
+# --- 行程の計算 ---
+def plan_routes(place_groups: List[PlaceGroup], days: int, origin: Optional[str] = None) -> Optional[RoutePlan]:
+    """
+    場所データから日ごとの行程を計算する。origin は行き先の座標 ("lat,lng")。
+    座標のある観光地が1件も無い場合は None を返す (同じ place_id の場所は1回だけ扱う)
+    """
+    stops: List[PlaceRecord] = []
+    meals: List[PlaceRecord] = []
+    lodgings: List[PlaceRecord] = []
+    seen: set = set()
+    skipped = 0
+    # 観光地を優先して重複を除く (同じ場所が食事と観光地の両方で見つかった場合は観光地として扱う)
+    ordered_groups = sorted(place_groups, key=lambda g: g.category in MEAL_CATEGORIES | LODGING_CATEGORIES)
+    for group in ordered_groups:
+        for record in group.records:
+            key = record.place_id or record.name
+            if key in seen:
+                continue
+            seen.add(key)
+            if record.lat is None or record.lng is None:
+                skipped += 1
+                continue
+            if record.business_status in ("CLOSED_TEMPORARILY", "CLOSED_PERMANENTLY"):
+                continue
+            if group.category in LODGING_CATEGORIES:
+                lodgings.append(record)
+            elif group.category in MEAL_CATEGORIES:
+                meals.append(record)
+            else:
+                stops.append(record)
+    if not stops:
+        return None
+
+    with stage_timer("routing.plan", days=days) as event:
+        # 地点番号: 観光地 + 食事候補 + 宿泊候補 (+ 出発地があれば末尾)
+        points = stops + meals + lodgings
+        lats = [r.lat for r in points]
+        lngs = [r.lng for r in points]
+        origin_index: Optional[int] = None
+        if origin:
+            try:
+                origin_lat, origin_lng = (float(v) for v in origin.split(","))
+                lats.append(origin_lat)
+                lngs.append(origin_lng)
+                origin_index = len(points)
+            except ValueError:
+                logger.warning(f"Invalid origin coordinates for routing: {origin}")
+        dist = haversine_matrix(np.array(lats), np.array(lngs))
+        meal_ids = list(range(len(stops), len(stops) + len(meals)))
+        lodging_ids = list(range(len(stops) + len(meals), len(points)))
+
+        clusters = cluster_by_day(dist[:len(stops), :len(stops)], days) # 観光地は先頭に並んでいるので番号はそのまま使える
+        # 日の順番: 出発地 (無ければ最初のまとまり) から近い順にまとまりをたどる
+        centers = [_medoid(dist, members) for members in clusters]
+        cluster_order = order_stops(dist, centers, origin_index)
+        clusters = [clusters[centers.index(center)] for center in cluster_order]
+
+        day_routes: List[DayRoute] = []
+        used_meals: set = set()
+        previous_end = origin_index
+        for day, members in enumerate(clusters, start=1):
+            route = order_stops(dist, [int(m) for m in members], previous_end)
+            previous_end = route[-1]
+            day_route = DayRoute(day=day, stops=[points[i] for i in route], distance_km=round(_path_length(dist, route), 1))
+            if meal_ids:
+                # ルート上の観光地への最短距離が近い順に、まだ割り当てていない食事候補を選ぶ
+                closeness = dist[np.ix_(meal_ids, route)].min(axis=1)
+                ranked = [meal_ids[i] for i in np.argsort(closeness, kind="stable")]
+                chosen = [i for i in ranked if i not in used_meals][:MEAL_CANDIDATES_PER_DAY] or ranked[:MEAL_CANDIDATES_PER_DAY]
+                used_meals.update(chosen)
+                day_route.meals = [points[i] for i in chosen]
+            if lodging_ids and day < len(clusters):
+                # ルート案の最終日は宿泊を割り当てない (以降の日の宿泊はモデルが検索結果から選ぶ)
+                day_route.lodging = points[lodging_ids[int(np.argmin(dist[route[-1], lodging_ids]))]]
+            day_routes.append(day_route)
+        event["stops"] = len(stops)
+        event["clusters"] = len(day_routes)
+    if len(day_routes) < days:
+        logger.info(f"Only {len(stops)} attractions for {days} days; days {len(day_routes) + 1}-{days} have no planned stops.")
+    return RoutePlan(days=day_routes, total_days=days, skipped=skipped)
+
+
+def _place_ref(record: PlaceRecord) -> Dict[str, Optional[str]]:
+    return {"name": record.name, "place_id": record.place_id}
+
+def route_guidance(plan: RoutePlan) -> str:
+    """2回目の OpenAI 呼び出しに渡すルート案 (日ごとの訪問順の JSON と指示)"""
+    days = []
+    for day_route in plan.days:
+        entry: Dict[str, object] = {
+            "day": day_route.day,
+            "stops": [_place_ref(r) for r in day_route.stops],
+            "distance_km": day_route.distance_km,
+        }
+        if day_route.meals:
+            entry["meal_candidates"] = [_place_ref(r) for r in day_route.meals]
+        if day_route.lodging is not None:
+            entry["lodging"] = _place_ref(day_route.lodging)
+        days.append(entry)
+    unplanned = ""
+    if len(plan.days) < plan.total_days:
+        unplanned = (f"{len(plan.days) + 1}日目〜{plan.total_days}日目は観光地の候補が足りないため、ルート案がありません。"
+                     "これらの日は検索結果やその他のおすすめから自由に組み立ててください。")
+    return (
+        "【移動効率を考えたルート案（参考）】\n"
+        "以下は検索結果の場所の座標から計算した、移動距離が短くなる日ごとの観光地の分け方と訪問順の一例です。"
+        "旅の目的や好み、営業時間と合う範囲でこの分け方・順番を参考にし、昼食・夕食は meal_candidates、宿泊は lodging を候補として検討してください。"
+        "より良い組み合わせがあれば変更してかまいませんが、同じ日に離れた場所を行き来しないようにしてください。"
+        + unplanned + "\n"
+        + json.dumps(days, ensure_ascii=False, separators=(",", ":"))
+    )
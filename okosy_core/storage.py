@@ -0,0 +1,514 @@
+# -*- coding: utf-8 -*-
+"""
+しおり・思い出データの保存先 (Storage)。
+Firestore (FirestoreStore) とローカルの SQLite (SQLiteStore) の2つの実装を、OKOSY_STORAGE_BACKEND で切り替える。
+画面からは get_itinerary_summaries / get_itinerary / get_memories (セッション単位の読み込みキャッシュ経由) と
+save_* / delete_* (キャッシュの破棄を含む) を使う。
+"""
+import base64
+import datetime
+import json
+import sqlite3
+import threading
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+
+import streamlit as st
+
+from okosy_core import config
+from okosy_core.blob_store import delete_memory_blobs, fetch_blob, get_blob_store, memory_blob_key
+from okosy_core.logs import get_logger, stage_timer
+from okosy_core.place_records import PLACES_SCHEMA_VERSION, PlaceGroup, load_place_groups, place_groups_to_json
+
+logger = get_logger("storage")
+
+ProgressCallback = Optional[Callable[[int, Optional[int]], None]]
+
+
+class ItineraryStore:
+    """しおり・思い出データの保存先の共通インターフェース。ID はいずれの実装でも文字列"""
+    def save_itinerary(self, user_id: str, name: str, preferences: dict, generated_content: str,
+                       place_groups: Optional[List[PlaceGroup]], usage: Optional[dict] = None) -> Optional[str]:
+        raise NotImplementedError
+
+    def load_itinerary_summaries(self, user_id: str, page_size: int, start_after: Optional[Any] = None) -> tuple[List[Dict[str, Any]], Optional[Any]]:
+        """(しおり一覧1ページ分 (新しい順), 次ページのカーソル or None) を返す"""
+        raise NotImplementedError
+
+    def load_itinerary(self, user_id: str, itinerary_id: str) -> Optional[Dict[str, Any]]:
+        """しおりの全データを返す。場所データは "place_groups" (PlaceGroup の一覧) に入れる"""
+        raise NotImplementedError
+
+    def delete_itinerary(self, user_id: str, itinerary_id: str, progress_callback: ProgressCallback = None) -> bool:
+        raise NotImplementedError
+
+    def save_memory(self, user_id: str, itinerary_id: str, caption: str,
+                    photo: Optional[Dict[str, Any]] = None, thumbnail: Optional[Dict[str, Any]] = None) -> Optional[str]:
+        raise NotImplementedError
+
+    def load_memories(self, user_id: str, itinerary_id: str) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def delete_memory(self, user_id: str, itinerary_id: str, memory_id: str) -> bool:
+        raise NotImplementedError
+
+    def watch_target(self, key: tuple) -> Optional[Any]:
+        """読み込みキャッシュのキーに対応する変更監視の対象 (監視できない実装は None)"""
+        return None
+
+class FirestoreStore(ItineraryStore):
+    """Firestore に保存する実装 (okosy_core.firestore_store の関数を使う)"""
+    def __init__(self):
+        from okosy_core import firestore_store
+        self._fs = firestore_store
+
+    def save_itinerary(self, user_id, name, preferences, generated_content, place_groups, usage=None):
+        return self._fs.save_itinerary_to_firestore(user_id, name, preferences, generated_content, place_groups, usage=usage)
+
+    def load_itinerary_summaries(self, user_id, page_size, start_after=None):
+        return self._fs.load_itinerary_summaries_from_firestore(user_id, page_size, start_after)
+
+    def load_itinerary(self, user_id, itinerary_id):
+        return self._fs.load_itinerary_from_firestore(user_id, itinerary_id)
+
+    def delete_itinerary(self, user_id, itinerary_id, progress_callback=None):
+        return self._fs.delete_itinerary_from_firestore(user_id, itinerary_id, progress_callback=progress_callback)
+
+    def save_memory(self, user_id, itinerary_id, caption, photo=None, thumbnail=None):
+        return self._fs.save_memory_to_firestore(user_id, itinerary_id, caption, photo, thumbnail)
+
+    def load_memories(self, user_id, itinerary_id):
+        return self._fs.load_memories_from_firestore(user_id, itinerary_id)
+
+    def delete_memory(self, user_id, itinerary_id, memory_id):
+        return self._fs.delete_memory_from_firestore(user_id, itinerary_id, memory_id)
+
+    def watch_target(self, key: tuple) -> Optional[Any]:
+        kind, user_id, *rest = key
+        itineraries = self._fs.itineraries_collection(user_id)
+        if kind == "itinerary_summaries":
+            # 一覧の読み込みと同じく名前・作成日時だけを受け取る (変更のたびにしおり本文をダウンロードしない)
+            return self._fs.itinerary_summaries_query(user_id, config.ITINERARY_PAGE_SIZE)
+        if kind == "itinerary":
+            return itineraries.document(rest[0])
+        if kind == "memories":
+            return itineraries.document(rest[0]).collection("memories")
+        return None
+
+class SQLiteStore(ItineraryStore):
+    """
+    ローカルの SQLite ファイルに保存する実装 (単一ノードでの運用・開発用)。
+    接続は1つを使い回し (WAL モード)、SQL はすべてパラメータ付きの固定文で実行する (sqlite3 の文キャッシュが効く)。
+    思い出の写真は Firestore 版と同じく写真ストレージに保存する。旧形式 (photo 列の BLOB) の行もそのまま読める。
+    場所データは places_data 列に JSON 文字列で保存し、places_schema_version 列に形式の版を持つ。
+    """
+    ITINERARY_COLUMNS = {"user_id": "TEXT", "usage": "TEXT", "places_schema_version": "INTEGER"}
+    MEMORY_COLUMNS = {"photo_ref": "TEXT", "thumbnail_ref": "TEXT", "photo_width": "INTEGER", "photo_height": "INTEGER"}
+
+    def __init__(self, path: str):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS itineraries ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, preferences TEXT, generated_content TEXT,"
+                " places_data TEXT, creation_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS memories ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT, itinerary_id INTEGER NOT NULL, caption TEXT, photo BLOB,"
+                " creation_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP, FOREIGN KEY (itinerary_id) REFERENCES itineraries (id))"
+            )
+            # 認証なし版で作られたファイルには無い列を追加する
+            self._add_missing_columns("itineraries", self.ITINERARY_COLUMNS)
+            self._add_missing_columns("memories", self.MEMORY_COLUMNS)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_itineraries_user_creation ON itineraries(user_id, creation_date)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_memories_itinerary_creation ON memories(itinerary_id, creation_date)")
+        logger.info(f"SQLite store opened: {path}")
+
+    def _add_missing_columns(self, table: str, columns: Dict[str, str]) -> None:
+        existing = {row["name"] for row in self._conn.execute(f"PRAGMA table_info({table})")}
+        for column, column_type in columns.items():
+            if column not in existing:
+                self._conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+                logger.info(f"SQLite store: added column {table}.{column}")
+
+    @staticmethod
+    def _now() -> str:
+        # CURRENT_TIMESTAMP と同じ UTC の書式 (マイクロ秒付き) にし、文字列の比較で時刻順に並ぶようにする
+        return datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S.%f")
+
+    @staticmethod
+    def _parse_timestamp(value: Optional[str]) -> Optional[datetime.datetime]:
+        if not value:
+            return None
+        try:
+            return datetime.datetime.fromisoformat(value).replace(tzinfo=datetime.timezone.utc)
+        except ValueError:
+            return None
+
+    @staticmethod
+    def _row_id(value: str) -> Optional[int]:
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return None
+
+    def save_itinerary(self, user_id, name, preferences, generated_content, place_groups, usage=None):
+        try:
+            with stage_timer("sqlite.save_itinerary"), self._lock, self._conn:
+                cursor = self._conn.execute(
+                    "INSERT INTO itineraries (user_id, name, preferences, generated_content, places_data, places_schema_version,"
+                    " usage, creation_date) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (user_id, name, json.dumps(preferences, ensure_ascii=False), generated_content,
+                     place_groups_to_json(place_groups), PLACES_SCHEMA_VERSION,
+                     json.dumps(usage, ensure_ascii=False) if usage else None, self._now()),
+                )
+            itinerary_id = str(cursor.lastrowid)
+            logger.info(f"Itinerary saved to SQLite for user {user_id}, id: {itinerary_id}")
+            return itinerary_id
+        except sqlite3.Error as e:
+            st.error(f"しおりの保存中にエラー: {e}")
+            logger.exception("SQLiteへのしおり保存中にエラー")
+            return None
+
+    def load_itinerary_summaries(self, user_id, page_size, start_after=None):
+        # カーソルは最後に返した行の (creation_date, id)
+        try:
+            with stage_timer("sqlite.load_itinerary_summaries"), self._lock:
+                if start_after is None:
+                    rows = self._conn.execute(
+                        "SELECT id, name, creation_date FROM itineraries WHERE user_id = ?"
+                        " ORDER BY creation_date DESC, id DESC LIMIT ?",
+                        (user_id, page_size),
+                    ).fetchall()
+                else:
+                    rows = self._conn.execute(
+                        "SELECT id, name, creation_date FROM itineraries WHERE user_id = ? AND (creation_date, id) < (?, ?)"
+                        " ORDER BY creation_date DESC, id DESC LIMIT ?",
+                        (user_id, start_after[0], start_after[1], page_size),
+                    ).fetchall()
+        except sqlite3.Error as e:
+            st.error(f"しおり一覧の読み込み中にエラー: {e}")
+            logger.exception("SQLiteからのしおり一覧読み込み中にエラー")
+            return [], None
+        summaries = [{"id": str(row["id"]), "name": row["name"], "creation_date": self._parse_timestamp(row["creation_date"])}
+                     for row in rows]
+        next_cursor = (rows[-1]["creation_date"], rows[-1]["id"]) if len(rows) == page_size else None
+        return summaries, next_cursor
+
+    def load_itinerary(self, user_id, itinerary_id):
+        row_id = self._row_id(itinerary_id)
+        if row_id is None:
+            return None
+        try:
+            with stage_timer("sqlite.load_itinerary"), self._lock:
+                row = self._conn.execute(
+                    "SELECT id, name, preferences, generated_content, places_data, places_schema_version, usage, creation_date"
+                    " FROM itineraries WHERE id = ? AND user_id = ?",
+                    (row_id, user_id),
+                ).fetchone()
+        except sqlite3.Error as e:
+            st.error(f"しおりの読み込み中にエラー: {e}")
+            logger.exception("SQLiteからのしおり読み込み中にエラー")
+            return None
+        if row is None:
+            return None
+        data = dict(row)
+        data["id"] = str(row["id"])
+        data["creation_date"] = self._parse_timestamp(row["creation_date"])
+        try:
+            data["usage"] = json.loads(row["usage"]) if row["usage"] else None
+        except json.JSONDecodeError:
+            data["usage"] = None
+        try:
+            data["preferences_dict"] = json.loads(data.get("preferences") or "{}")
+        except (json.JSONDecodeError, TypeError):
+            data["preferences_dict"] = {}
+        data["place_groups"] = load_place_groups(row["places_data"])
+        if row["places_data"] and row["places_schema_version"] != PLACES_SCHEMA_VERSION:
+            # 旧形式 (JSON文字列の配列) の行は現在の形式で保存し直す
+            with self._lock, self._conn:
+                self._conn.execute(
+                    "UPDATE itineraries SET places_data = ?, places_schema_version = ? WHERE id = ?",
+                    (place_groups_to_json(data["place_groups"]), PLACES_SCHEMA_VERSION, row_id),
+                )
+            logger.info(f"Migrated places data of itinerary {itinerary_id} to schema version {PLACES_SCHEMA_VERSION}")
+        return data
+
+    def delete_itinerary(self, user_id, itinerary_id, progress_callback=None):
+        row_id = self._row_id(itinerary_id)
+        if row_id is None:
+            return False
+        try:
+            with stage_timer("sqlite.delete_itinerary"):
+                with self._lock:
+                    owner = self._conn.execute("SELECT 1 FROM itineraries WHERE id = ? AND user_id = ?", (row_id, user_id)).fetchone()
+                    memory_refs = self._conn.execute(
+                        "SELECT photo_ref, thumbnail_ref FROM memories WHERE itinerary_id = ?", (row_id,)
+                    ).fetchall()
+                if owner is None:
+                    return False
+                # 写真を先に消す (Firestore 版と同じく、参照の切れた写真が残らないように)
+                for refs in memory_refs:
+                    delete_memory_blobs(dict(refs))
+                with self._lock, self._conn:
+                    self._conn.execute("DELETE FROM memories WHERE itinerary_id = ?", (row_id,))
+                    self._conn.execute("DELETE FROM itineraries WHERE id = ?", (row_id,))
+            if progress_callback:
+                progress_callback(len(memory_refs), len(memory_refs))
+            logger.info(f"Itinerary {itinerary_id} deleted from SQLite for user {user_id} ({len(memory_refs)} memories)")
+            return True
+        except sqlite3.Error as e:
+            st.error(f"しおりの削除中にエラー: {e}")
+            logger.exception("SQLiteからのしおり削除中にエラー")
+            return False
+
+    def save_memory(self, user_id, itinerary_id, caption, photo=None, thumbnail=None):
+        row_id = self._row_id(itinerary_id)
+        if row_id is None:
+            return None
+        try:
+            with stage_timer("sqlite.save_memory"):
+                # 写真のキーに使う ID (行の ID は挿入するまで決まらないため)
+                blob_id = uuid.uuid4().hex
+                refs: Dict[str, Optional[str]] = {"photo": None, "thumbnail": None}
+                blob_store = get_blob_store()
+                for variant, image in (("photo", photo), ("thumbnail", thumbnail)):
+                    if image:
+                        refs[variant] = memory_blob_key(user_id, itinerary_id, blob_id, variant, image["content_type"])
+                        blob_store.put(refs[variant], image["data"], image["content_type"])
+                width, height = photo["size"] if photo else (None, None)
+                with self._lock, self._conn:
+                    cursor = self._conn.execute(
+                        "INSERT INTO memories (itinerary_id, caption, photo_ref, thumbnail_ref, photo_width, photo_height, creation_date)"
+                        " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (row_id, caption, refs["photo"], refs["thumbnail"], width, height, self._now()),
+                    )
+            memory_id = str(cursor.lastrowid)
+            logger.info(f"Memory saved to SQLite for itinerary {itinerary_id}, id: {memory_id}")
+            return memory_id
+        except sqlite3.Error as e:
+            st.error(f"思い出の保存中にエラー: {e}")
+            logger.exception("SQLiteへの思い出保存中にエラー")
+            return None
+
+    def load_memories(self, user_id, itinerary_id):
+        row_id = self._row_id(itinerary_id)
+        if row_id is None:
+            return []
+        try:
+            with stage_timer("sqlite.load_memories"), self._lock:
+                rows = self._conn.execute(
+                    "SELECT m.id, m.caption, m.photo, m.photo_ref, m.thumbnail_ref, m.photo_width, m.photo_height, m.creation_date"
+                    " FROM memories m JOIN itineraries i ON i.id = m.itinerary_id"
+                    " WHERE m.itinerary_id = ? AND i.user_id = ? ORDER BY m.creation_date DESC, m.id DESC",
+                    (row_id, user_id),
+                ).fetchall()
+        except sqlite3.Error as e:
+            st.error(f"思い出の読み込み中にエラー: {e}")
+            logger.exception("SQLiteからの思い出読み込み中にエラー")
+            return []
+        memories = []
+        for row in rows:
+            data = {key: row[key] for key in ("caption", "photo_ref", "thumbnail_ref", "photo_width", "photo_height")}
+            data["id"] = str(row["id"])
+            data["creation_date"] = self._parse_timestamp(row["creation_date"])
+            if row["photo"] is not None and not row["photo_ref"]:
+                data["photo_bytes"] = row["photo"] # 旧形式: 写真を BLOB 列に保存していた行
+            memories.append(data)
+        return memories
+
+    def delete_memory(self, user_id, itinerary_id, memory_id):
+        row_id, memory_row_id = self._row_id(itinerary_id), self._row_id(memory_id)
+        if row_id is None or memory_row_id is None:
+            return False
+        try:
+            with self._lock:
+                refs = self._conn.execute(
+                    "SELECT m.photo_ref, m.thumbnail_ref FROM memories m JOIN itineraries i ON i.id = m.itinerary_id"
+                    " WHERE m.id = ? AND m.itinerary_id = ? AND i.user_id = ?",
+                    (memory_row_id, row_id, user_id),
+                ).fetchone()
+            if refs is None:
+                return False
+            delete_memory_blobs(dict(refs))
+            with self._lock, self._conn:
+                self._conn.execute("DELETE FROM memories WHERE id = ?", (memory_row_id,))
+            logger.info(f"Memory {memory_id} deleted from SQLite for itinerary {itinerary_id}")
+            return True
+        except sqlite3.Error as e:
+            st.error(f"思い出の削除中にエラー: {e}")
+            logger.exception("SQLiteからの思い出削除中にエラー")
+            return False
+
+@st.cache_resource(show_spinner=False)
+def get_storage() -> ItineraryStore:
+    """設定 (OKOSY_STORAGE_BACKEND) に応じたしおりの保存先を返す (プロセス全体で共有)"""
+    if config.STORAGE_BACKEND == "sqlite":
+        return SQLiteStore(config.SQLITE_STORE_PATH)
+    logger.info("Using Firestore itinerary store.")
+    return FirestoreStore()
+
+
+# --- 読み込みキャッシュ (セッション単位) ---
+class StorageReadCache:
+    """
+    保存先からの読み込み結果をセッション内で保持する read-through キャッシュ。
+    キーは ("itinerary_summaries", user_id) / ("itinerary", user_id, itinerary_id) / ("memories", user_id, itinerary_id)。
+    書き込み・削除関数が該当キーを破棄する。リスナーモード (Firestore のみ) では Firestore 側の変更でも破棄される。
+    """
+    def __init__(self, use_snapshot_listeners: bool = False):
+        self.use_snapshot_listeners = use_snapshot_listeners
+        self._entries: Dict[tuple, Any] = {}
+        self._watches: Dict[tuple, Any] = {}
+        self._lock = threading.Lock() # リスナーのコールバックは別スレッドから呼ばれる
+
+    def get(self, key: tuple, loader, watch_target: Optional[Callable[[], Any]] = None) -> Any:
+        """キャッシュ済みの値を返す。なければ loader() で読み込んで保持する (watch_target() はリスナーモードでのみ呼ぶ)"""
+        with self._lock:
+            if key in self._entries:
+                return self._entries[key]
+        value = loader()
+        self.set(key, value)
+        if self.use_snapshot_listeners and watch_target is not None:
+            self._watch(key, watch_target)
+        return value
+
+    def set(self, key: tuple, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = value
+
+    def invalidate(self, *key_prefix: str) -> None:
+        """先頭が key_prefix に一致するキーをすべて破棄する"""
+        with self._lock:
+            for key in [k for k in self._entries if k[:len(key_prefix)] == key_prefix]:
+                del self._entries[key]
+
+    def _watch(self, key: tuple, watch_target: Callable[[], Any]) -> None:
+        with self._lock:
+            if key in self._watches:
+                return
+        is_initial_snapshot = [True]
+        def on_snapshot(*_):
+            # 登録直後の初回スナップショットは読み込み済みの内容と同じなので無視する
+            if is_initial_snapshot[0]:
+                is_initial_snapshot[0] = False
+                return
+            logger.info(f"Firestore change detected, invalidating cache: {key}")
+            self.invalidate(*key)
+        try:
+            target = watch_target()
+            if target is None:
+                return
+            watch = target.on_snapshot(on_snapshot)
+            with self._lock:
+                self._watches[key] = watch
+        except Exception as e:
+            logger.warning(f"Failed to register Firestore snapshot listener for {key}: {e}")
+
+    def close(self) -> None:
+        """登録したスナップショットリスナーをすべて解除する"""
+        with self._lock:
+            watches = list(self._watches.values())
+            self._watches.clear()
+            self._entries.clear()
+        for watch in watches:
+            try:
+                watch.unsubscribe()
+            except Exception as e:
+                logger.warning(f"Failed to unsubscribe Firestore snapshot listener: {e}")
+
+def get_read_cache() -> StorageReadCache:
+    """現在のセッションの読み込みキャッシュを返す"""
+    if "storage_read_cache" not in st.session_state:
+        use_listeners = config.FIRESTORE_SNAPSHOT_LISTENERS and config.STORAGE_BACKEND == "firestore"
+        st.session_state["storage_read_cache"] = StorageReadCache(use_listeners)
+    return st.session_state["storage_read_cache"]
+
+
+# --- 画面から使う読み書き (読み込みキャッシュ経由) ---
+def save_itinerary(user_id: str, name: str, preferences: dict, generated_content: str,
+                   place_groups: Optional[List[PlaceGroup]], usage: Optional[dict] = None) -> Optional[str]:
+    """しおりを保存し、ID を返す (失敗時は None)"""
+    itinerary_id = get_storage().save_itinerary(user_id, name, preferences, generated_content, place_groups, usage)
+    if itinerary_id:
+        get_read_cache().invalidate("itinerary_summaries", user_id)
+    return itinerary_id
+
+def get_itinerary_summaries(user_id: str) -> Dict[str, Any]:
+    """しおり一覧 ({"items": [...], "cursor": 次ページのカーソル}) をキャッシュ経由で取得する"""
+    key = ("itinerary_summaries", user_id)
+    def loader():
+        summaries, next_cursor = get_storage().load_itinerary_summaries(user_id, config.ITINERARY_PAGE_SIZE)
+        return {"items": summaries, "cursor": next_cursor}
+    return get_read_cache().get(key, loader, lambda: get_storage().watch_target(key))
+
+def load_more_itinerary_summaries(user_id: str) -> None:
+    """しおり一覧の次のページを読み込み、キャッシュ済みの一覧に追加する"""
+    current = get_itinerary_summaries(user_id)
+    if current["cursor"] is None:
+        return
+    more_summaries, next_cursor = get_storage().load_itinerary_summaries(user_id, config.ITINERARY_PAGE_SIZE, current["cursor"])
+    get_read_cache().set(("itinerary_summaries", user_id), {"items": current["items"] + more_summaries, "cursor": next_cursor})
+
+def get_itinerary(user_id: str, itinerary_id: str) -> Optional[Dict[str, Any]]:
+    """しおり本文をキャッシュ経由で取得する"""
+    key = ("itinerary", user_id, itinerary_id)
+    return get_read_cache().get(key, lambda: get_storage().load_itinerary(user_id, itinerary_id),
+                                lambda: get_storage().watch_target(key))
+
+def delete_itinerary(user_id: str, itinerary_id: str, progress_callback: ProgressCallback = None) -> bool:
+    """しおりと関連する思い出を削除する"""
+    deleted = get_storage().delete_itinerary(user_id, itinerary_id, progress_callback)
+    read_cache = get_read_cache()
+    if deleted:
+        read_cache.invalidate("itinerary_summaries", user_id)
+    # 失敗時も一部の思い出は削除済みの可能性があるため、キャッシュは破棄しておく
+    read_cache.invalidate("itinerary", user_id, itinerary_id)
+    read_cache.invalidate("memories", user_id, itinerary_id)
+    return deleted
+
+def save_memory(user_id: str, itinerary_id: str, caption: str,
+                photo: Optional[Dict[str, Any]] = None, thumbnail: Optional[Dict[str, Any]] = None) -> Optional[str]:
+    """思い出を保存し、ID を返す (photo / thumbnail は {"data": bytes, "content_type": str, "size": (幅, 高さ)} 形式)"""
+    memory_id = get_storage().save_memory(user_id, itinerary_id, caption, photo, thumbnail)
+    if memory_id:
+        get_read_cache().invalidate("memories", user_id, itinerary_id)
+    return memory_id
+
+def get_memories(user_id: str, itinerary_id: str) -> List[Dict[str, Any]]:
+    """思い出一覧をキャッシュ経由で取得する"""
+    key = ("memories", user_id, itinerary_id)
+    return get_read_cache().get(key, lambda: get_storage().load_memories(user_id, itinerary_id),
+                                lambda: get_storage().watch_target(key))
+
+def delete_memory(user_id: str, itinerary_id: str, memory_id: str) -> bool:
+    """思い出を削除する"""
+    deleted = get_storage().delete_memory(user_id, itinerary_id, memory_id)
+    if deleted:
+        get_read_cache().invalidate("memories", user_id, itinerary_id)
+    return deleted
+
+def load_memory_image(memory: Dict[str, Any], variant: str = "thumbnail") -> Optional[bytes]:
+    """思い出の写真 (variant: "thumbnail" または "photo") を取得する。旧形式 (Firestore の Base64 埋め込み / SQLite の BLOB 列) にも対応"""
+    blob_key = memory.get(f"{variant}_ref") or memory.get("photo_ref")
+    if blob_key:
+        return fetch_blob(blob_key)
+    if memory.get("photo_bytes") is not None:
+        return memory["photo_bytes"]
+    legacy_b64 = memory.get(f"{variant}_base64") or memory.get("photo_base64")
+    if legacy_b64:
+        # デコード結果は(キャッシュされている)思い出データ自体に保持し、再実行のたびにデコードしない
+        decoded_cache = memory.setdefault("_decoded_images", {})
+        if variant not in decoded_cache:
+            try:
+                decoded_cache[variant] = base64.b64decode(legacy_b64)
+            except Exception as img_e:
+                logger.warning(f"Error decoding image from base64 for memory {memory.get('id')}: {img_e}")
+                decoded_cache[variant] = None
+        return decoded_cache[variant]
+    return None
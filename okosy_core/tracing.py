@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+処理段階ごとのスパン (所要時間) の記録。
+logs.stage_timer で計測したスパンをプロセス内のリングバッファに溜め、管理者画面で段階ごとの p50 / p95 / p99 を表示する。
+OKOSY_OTEL_EXPORT を有効にし opentelemetry がインストールされていれば、OpenTelemetry のスパンとしても出力する。
+"""
+import contextlib
+import math
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional
+
+import streamlit as st
+
+from okosy_core import config
+from okosy_core.logs import get_logger
+
+logger = get_logger("tracing")
+
+
+@dataclass
+class Span:
+    """計測済みの処理段階1回分"""
+    stage: str
+    started_at: float # UNIX時刻
+    duration_ms: float
+    ok: bool
+    attributes: Dict[str, Any] = field(default_factory=dict)
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    """昇順に並んだ値の p パーセンタイル (nearest-rank 法)"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class SpanBuffer:
+    """直近のスパンを保持するリングバッファ (スレッドセーフ)"""
+    def __init__(self, max_spans: int):
+        self._spans: deque = deque(maxlen=max_spans)
+        self._lock = threading.Lock()
+
+    def add(self, span: Span) -> None:
+        with self._lock:
+            self._spans.append(span)
+
+    def spans(self) -> List[Span]:
+        with self._lock:
+            return list(self._spans)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._spans.clear()
+
+    def stage_summary(self) -> List[Dict[str, Any]]:
+        """段階ごとの件数・失敗数・p50/p95/p99/最大 (ミリ秒) を、p95 の大きい順に返す"""
+        by_stage: Dict[str, List[Span]] = {}
+        for span in self.spans():
+            by_stage.setdefault(span.stage, []).append(span)
+        summary = []
+        for stage, spans in by_stage.items():
+            durations = sorted(s.duration_ms for s in spans)
+            summary.append({
+                "stage": stage, "count": len(spans), "errors": sum(1 for s in spans if not s.ok),
+                "p50_ms": percentile(durations, 50), "p95_ms": percentile(durations, 95),
+                "p99_ms": percentile(durations, 99), "max_ms": durations[-1],
+            })
+        return sorted(summary, key=lambda row: row["p95_ms"], reverse=True)
+
+
+@st.cache_resource(show_spinner=False)
+def get_span_buffer() -> SpanBuffer:
+    """プロセス全体で共有するスパンのリングバッファを返す"""
+    return SpanBuffer(config.TRACE_BUFFER_SIZE)
+
+
+@st.cache_resource(show_spinner=False)
+def get_otel_tracer() -> Optional[Any]:
+    """OpenTelemetry のトレーサーを返す (無効、または opentelemetry が未インストールなら None)"""
+    if not config.OTEL_EXPORT_ENABLED:
+        return None
+    try:
+        from opentelemetry import trace
+    except ImportError:
+        logger.warning("OKOSY_OTEL_EXPORT is enabled but opentelemetry is not installed; spans are kept in memory only.")
+        return None
+    try:
+        # OTLP エクスポーターがあればそれを使う (未設定なら opentelemetry-instrument などの外部設定に任せる)
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        provider = TracerProvider(resource=Resource.create({"service.name": config.OTEL_SERVICE_NAME}))
+        provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+        trace.set_tracer_provider(provider)
+    except ImportError:
+        pass
+    return trace.get_tracer("okosy")
+
+
+@contextlib.contextmanager
+def otel_span(stage: str) -> Iterator[Optional[Any]]:
+    """OpenTelemetry のスパンを開始する (無効なら None を返すだけ)"""
+    tracer = get_otel_tracer()
+    if tracer is None:
+        yield None
+        return
+    with tracer.start_as_current_span(stage) as span:
+        yield span
+
+
+def record_span(stage: str, duration_ms: float, ok: bool, attributes: Dict[str, Any], otel: Optional[Any] = None) -> None:
+    """計測結果をリングバッファ (と OpenTelemetry のスパン) に記録する"""
+    get_span_buffer().add(Span(stage, time.time() - duration_ms / 1000, duration_ms, ok, attributes))
+    if otel is not None:
+        for key, value in attributes.items():
+            if isinstance(value, (str, bool, int, float)):
+                otel.set_attribute(f"okosy.{key}", value)
+        if not ok:
+            from opentelemetry.trace import Status, StatusCode
+            otel.set_status(Status(StatusCode.ERROR))
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+OpenAI 呼び出しのトークン使用量・推定コスト・レイテンシの記録。
+しおり生成1回分を GenerationUsage にまとめ、しおりと一緒に保存する。管理者画面向けに直近の生成分をプロセス内に保持する。
+"""
+import threading
+import time
+from collections import deque
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional
+
+import streamlit as st
+
+from okosy_core import config
+from okosy_core.logs import get_logger
+
+logger = get_logger("usage")
+
+
+@dataclass
+class CallUsage:
+    """OpenAI 呼び出し1回分の使用量"""
+    stage: str # "first_call" / "second_call" など
+    model: str
+    prompt_tokens: int
+    completion_tokens: int
+    latency_seconds: float
+
+    @property
+    def cost_usd(self) -> float:
+        return estimate_cost_usd(self.prompt_tokens, self.completion_tokens)
+
+
+def estimate_cost_usd(prompt_tokens: int, completion_tokens: int) -> float:
+    """単価 (OPENAI_PRICE_*_PER_1M_TOKENS) からコストを推定する"""
+    return (prompt_tokens * config.OPENAI_PRICE_INPUT_PER_1M_TOKENS
+            + completion_tokens * config.OPENAI_PRICE_OUTPUT_PER_1M_TOKENS) / 1_000_000
+
+
+@dataclass
+class GenerationUsage:
+    """しおり生成1回分の使用量 (呼び出しごとの内訳と合計)"""
+    calls: List[CallUsage] = field(default_factory=list)
+
+    def record(self, stage: str, model: str, usage: Any, latency_seconds: float) -> None:
+        """OpenAI の応答の usage (CompletionUsage または None) を記録する"""
+        prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+        completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+        self.calls.append(CallUsage(stage, model, prompt_tokens, completion_tokens, round(latency_seconds, 3)))
+        logger.info(f"OpenAI usage ({stage}): prompt={prompt_tokens}, completion={completion_tokens}, latency={latency_seconds:.2f}s")
+
+    @property
+    def prompt_tokens(self) -> int:
+        return sum(c.prompt_tokens for c in self.calls)
+
+    @property
+    def completion_tokens(self) -> int:
+        return sum(c.completion_tokens for c in self.calls)
+
+    @property
+    def cost_usd(self) -> float:
+        return sum(c.cost_usd for c in self.calls)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Firestore に保存する形式"""
+        return {
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cost_usd": round(self.cost_usd, 6),
+            "latency_seconds": round(sum(c.latency_seconds for c in self.calls), 3),
+            "calls": [asdict(c) for c in self.calls],
+        }
+
+
+class UsageLog:
+    """直近の生成の使用量 (管理者画面用, スレッドセーフ)"""
+    def __init__(self, max_entries: int):
+        self._entries: deque = deque(maxlen=max_entries)
+        self._lock = threading.Lock()
+
+    def record(self, destination: Optional[str], usage: Dict[str, Any], cached: bool = False) -> None:
+        with self._lock:
+            self._entries.append({"time": time.time(), "destination": destination, "cached": cached, **usage})
+
+    def entries(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return list(self._entries)
+
+
+@st.cache_resource(show_spinner=False)
+def get_usage_log() -> UsageLog:
+    """プロセス全体で共有する使用量ログを返す"""
+    return UsageLog(config.USAGE_LOG_MAX_ENTRIES)
+
+
+def is_admin(email: Optional[str]) -> bool:
+    """管理者 (OKOSY_ADMIN_EMAILS に含まれるメールアドレス) か"""
+    return bool(email) and email.casefold() in config.ADMIN_EMAILS
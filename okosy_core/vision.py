@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""Vision API による画像ラベル抽出"""
+import base64
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+import httpx
+
+from okosy_core import config
+from okosy_core.http_engine import get_http_engine
+from okosy_core.clients import get_vision_credentials
+from okosy_core.images import preprocess_image
+from okosy_core.notices import STREAMLIT_NOTICES
+from okosy_core.resilience import Deadline, UpstreamUnavailableError, call_with_resilience
+from okosy_core.logs import get_logger, preview, stage_timer
+
+logger = get_logger("vision")
+
+
+def split_vision_batches(encoded_images: List[tuple[str, str]]) -> List[List[tuple[str, str]]]:
+    """(ファイル名, Base64) のリストを、images:annotate の枚数・サイズ上限に収まるバッチに分割する"""
+    batches: List[List[tuple[str, str]]] = []
+    current: List[tuple[str, str]] = []
+    current_bytes = 0
+    for name, content in encoded_images:
+        size = len(content) + 200 # features 等のJSONオーバーヘッド分を見込む
+        if current and (len(current) >= config.VISION_MAX_IMAGES_PER_REQUEST or current_bytes + size > config.VISION_MAX_REQUEST_BYTES):
+            batches.append(current)
+            current, current_bytes = [], 0
+        current.append((name, content))
+        current_bytes += size
+    if current:
+        batches.append(current)
+    return batches
+
+def annotate_vision_batch(batch: List[tuple[str, str]], access_token: str,
+                          deadline: Optional[Deadline] = None) -> List[tuple[str, List[str], Optional[str]]]:
+    """1回の images:annotate で複数画像のラベルを取得し、画像ごとに (ファイル名, ラベル, エラー) を返す (ワーカースレッドから呼ばれる)"""
+    endpoint = f"{config.VISION_BASE_URL}/v1/images:annotate"
+    payload = {
+        "requests": [{
+            "image": {"content": content},
+            "features": [{"type": "LABEL_DETECTION", "maxResults": 5}] # 上位5件のラベルを取得
+        } for _, content in batch]
+    }
+    headers = {
+        "Authorization": f"Bearer {access_token}",
+        "Content-Type": "application/json"
+    }
+    def attempt(timeout: float) -> httpx.Response:
+        response = get_http_engine().post(endpoint, headers=headers, json=payload, timeout=timeout)
+        if response.status_code == 429 or response.status_code >= 500:
+            response.raise_for_status() # 再試行対象 (それ以外のエラー応答は下で扱う)
+        return response
+
+    try:
+        # Vision APIにリクエスト送信 (429/5xx・タイムアウトは再試行)
+        with stage_timer("vision.annotate", images=len(batch)) as event:
+            response = call_with_resilience("vision", attempt, config.VISION_TIMEOUT_SECONDS, deadline)
+            event["http_status"] = response.status_code
+    except UpstreamUnavailableError as e:
+        logger.warning(f"Vision API unavailable: {e}")
+        return [(name, [], f"Vision APIが一時的に利用できません: {e}") for name, _ in batch]
+    except httpx.HTTPError as e:
+        logger.warning(f"Vision API HTTP request error: {e}")
+        return [(name, [], f"Vision APIへの接続中にエラーが発生しました: {e}") for name, _ in batch]
+
+    if response.status_code != 200:
+        logger.warning(f"Vision API REST error: {response.status_code}, {preview(response.text, 1000)}")
+        return [(name, [], f"Vision APIエラー (HTTP {response.status_code})") for name, _ in batch]
+
+    # responses はリクエストと同じ順序で返るため、インデックスで画像に対応付ける
+    responses = response.json().get("responses", [])
+    results = []
+    for i, (name, _) in enumerate(batch):
+        image_response = responses[i] if i < len(responses) else None
+        if not image_response:
+            logger.warning(f"Vision API: Empty or invalid response for image {name}")
+            results.append((name, [], "Vision APIから結果が返りませんでした"))
+        elif "error" in image_response:
+            error_message = image_response["error"].get("message", "不明なエラー")
+            logger.warning(f"Vision API error for image {name}: {image_response['error']}")
+            results.append((name, [], error_message))
+        else:
+            labels = [ann["description"] for ann in image_response.get("labelAnnotations", [])]
+            results.append((name, labels, None))
+    return results
+
+@stage_timer("vision.labels")
+def get_vision_labels_from_uploaded_images(images: List[tuple[str, bytes]], deadline: Optional[Deadline] = None, notices=None):
+    """
+    アップロードされた画像 ((ファイル名, バイト列) のリスト) からVision APIでラベルを抽出 (全画像を1リクエストにまとめて送信)。
+    バックグラウンドジョブから呼ぶ場合は notices に NoticeSink を渡す (st.* は使わない)
+    """
+    notices = notices or STREAMLIT_NOTICES
+    if not config.GOOGLE_APPLICATION_CREDENTIALS:
+         notices.warning("Vision APIの利用に必要なライブラリまたは認証情報が不足しています。")
+         return []
+    try:
+        # サービスアカウント認証情報 (プロセス全体で共有し、トークンは期限切れ時のみ更新)
+        access_token = get_vision_credentials().access_token()
+
+        encoded_images: List[tuple[str, str]] = []
+        for i, (name, raw_bytes) in enumerate(images):
+            file_name = name or f"画像{i + 1}"
+            try:
+                # ラベル検出用に縮小してから送信する (帯域とVision APIのレイテンシを削減)
+                image_bytes, _, _ = preprocess_image(raw_bytes, "label")
+            except Exception as prep_e:
+                logger.warning(f"Image preprocessing failed for {file_name}, sending original: {prep_e}")
+                image_bytes = raw_bytes
+            # 画像コンテンツをBase64エンコード
+            encoded_images.append((file_name, base64.b64encode(image_bytes).decode("utf-8")))
+
+        batches = split_vision_batches(encoded_images)
+        if len(batches) <= 1:
+            batch_results = [annotate_vision_batch(batch, access_token, deadline) for batch in batches]
+        else:
+            # 上限によりバッチが分かれた場合は並列に送信する
+            with ThreadPoolExecutor(max_workers=len(batches), thread_name_prefix="okosy-vision") as executor:
+                batch_results = list(executor.map(lambda batch: annotate_vision_batch(batch, access_token, deadline), batches))
+
+        all_labels = []
+        processed_count = 0
+        for file_name, labels, error in (result for results in batch_results for result in results):
+            if error:
+                notices.warning(f"画像「{file_name}」の解析に失敗しました: {error}")
+                continue
+            all_labels.extend(labels)
+            processed_count += 1
+
+        # 重複を除去して(出現順を保ったまま)上位10件までを返す
+        unique_labels = list(dict.fromkeys(all_labels))
+        logger.info(f"Vision API processed {processed_count}/{len(images)} images in {len(batches)} request(s). Found labels: {unique_labels[:10]}")
+        return unique_labels[:10]
+
+    except Exception as e:
+        notices.error(f"Vision APIによるラベル抽出全体でエラーが発生しました: {e}")
+        logger.exception(f"Overall error during Vision API label extraction: {e}")
+        return []
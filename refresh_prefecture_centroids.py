@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+都道府県の代表座標テーブル (assets/prefecture_centroids.json) をオフラインで再生成するスクリプト。
+
+アプリ実行時は Geocoding API を呼ばずにこのテーブルを参照する。
+使い方: python refresh_prefecture_centroids.py [--dry-run]
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+import time
+
+import requests
+from dotenv import load_dotenv
+
+TABLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets", "prefecture_centroids.json")
+GEOCODE_URL = "https://maps.googleapis.com/maps/api/geocode/json"
+
+
+def geocode(address: str, api_key: str) -> dict:
+    """Geocoding API で住所の緯度経度を取得する (失敗時は例外)"""
+    params = {"address": address, "key": api_key, "language": "ja", "region": "JP"}
+    response = requests.get(GEOCODE_URL, params=params, timeout=10)
+    response.raise_for_status()
+    results = response.json()
+    if results.get("status") != "OK" or not results.get("results"):
+        raise RuntimeError(f"Geocoding failed for {address}: Status={results.get('status')}, Error={results.get('error_message', '')}")
+    location = results["results"][0]["geometry"]["location"]
+    return {"lat": round(location["lat"], 4), "lng": round(location["lng"], 4)}
+
+
+def format_table(table: dict) -> str:
+    """1都道府県1行のJSONに整形する (差分を読みやすくするため)"""
+    lines = [f'    {json.dumps(name, ensure_ascii=False)}: {{"lat": {c["lat"]:.4f}, "lng": {c["lng"]:.4f}}}'
+             for name, c in table["prefectures"].items()]
+    return (
+        "{\n"
+        f'  "version": {table["version"]},\n'
+        f'  "source": {json.dumps(table["source"], ensure_ascii=False)},\n'
+        f'  "generated_at": "{table["generated_at"]}",\n'
+        '  "prefectures": {\n' + ",\n".join(lines) + "\n  }\n}\n"
+    )
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="都道府県の代表座標テーブルを Geocoding API で再生成します。")
+    parser.add_argument("--dry-run", action="store_true", help="ファイルを書き換えずに結果だけ表示する")
+    args = parser.parse_args()
+
+    load_dotenv()
+    api_key = os.getenv("GOOGLE_PLACES_API_KEY")
+    if not api_key:
+        print("GOOGLE_PLACES_API_KEY が設定されていません。", file=sys.stderr)
+        return 1
+
+    with open(TABLE_PATH, encoding="utf-8") as f:
+        current = json.load(f)
+
+    prefectures = {}
+    for name in current["prefectures"]:
+        prefectures[name] = geocode(name, api_key)
+        print(f"{name}: {prefectures[name]['lat']},{prefectures[name]['lng']}")
+        time.sleep(0.1) # QPS制限への配慮
+
+    table = {
+        "version": current.get("version", 0) + 1,
+        "source": current.get("source", "Google Geocoding API (language=ja, region=JP)"),
+        "generated_at": datetime.date.today().isoformat(),
+        "prefectures": prefectures,
+    }
+    if args.dry_run:
+        print(format_table(table))
+    else:
+        with open(TABLE_PATH, "w", encoding="utf-8") as f:
+            f.write(format_table(table))
+        print(f"Wrote {len(prefectures)} prefectures to {TABLE_PATH} (version {table['version']})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
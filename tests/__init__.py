@@ -0,0 +1,2 @@
+# -*- coding: utf-8 -*-
+"""okosy_core の単体テスト (外部API・Firestore を使わない純粋なロジックのみ)。実行: python -m pytest tests"""
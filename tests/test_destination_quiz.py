@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""destination_quiz (回答のビットマスクによる都道府県の絞り込みと抽選) のテスト"""
+import random
+
+from okosy_core.destination_quiz import PREFECTURES, QUIZ_QUESTIONS, DestinationQuizIndex
+
+
+def _expected_candidates(answers):
+    """回答に合う都道府県を、ビットマスクを使わずに集合の積で求める"""
+    candidates = set(PREFECTURES)
+    for question in QUIZ_QUESTIONS:
+        option = answers.get(question.key)
+        names = question.mapping.get(option) if option is not None else None
+        if names is not None:
+            candidates &= set(names)
+    return candidates
+
+
+def test_candidate_mask_matches_set_intersection_for_every_answer_combination():
+    index = DestinationQuizIndex()
+    q0, q1, q2 = QUIZ_QUESTIONS
+    for a0 in q0.options:
+        for a1 in q1.options:
+            for a2 in q2.options:
+                answers = {q0.key: a0, q1.key: a1, q2.key: a2}
+                members = {PREFECTURES[i] for i in index.mask_members(index.candidate_mask(answers))}
+                assert members == _expected_candidates(answers)
+
+def test_unanswered_questions_do_not_narrow_candidates():
+    index = DestinationQuizIndex()
+    assert index.candidate_mask({}) == index.all_mask
+    assert index.candidate_mask({"q0_sea_mountain": "どちらでも"}) == index.all_mask
+
+def test_choose_destination_picks_from_candidates():
+    index = DestinationQuizIndex()
+    answers = {"q0_sea_mountain": "山", "q1_style": "ゆったり過ごす", "q2_atmosphere": "和の雰囲気"}
+    rng = random.Random(0)
+    for _ in range(50):
+        name, matched_all = index.choose_destination(answers, {}, rng)
+        assert matched_all
+        assert name in _expected_candidates(answers)
+
+def test_choose_destination_falls_back_to_most_matched_answers():
+    # 「山」かつ「モダン・都会的」の都道府県は埼玉県だけなので、さらに「ゆったり過ごす」を加えると全回答に合う候補は無い
+    index = DestinationQuizIndex()
+    answers = {"q0_sea_mountain": "山", "q1_style": "ゆったり過ごす", "q2_atmosphere": "モダン・都会的"}
+    assert index.candidate_mask(answers) == 0
+    counts = index.matched_answer_counts(answers)
+    best = {PREFECTURES[i] for i in range(len(PREFECTURES)) if counts[i] == counts.max()}
+    rng = random.Random(0)
+    for _ in range(20):
+        name, matched_all = index.choose_destination(answers, {}, rng)
+        assert not matched_all
+        assert name in best
+
+def test_preferences_weight_the_draw():
+    index = DestinationQuizIndex()
+    answers = {"q2_atmosphere": "モダン・都会的"}
+    rng = random.Random(0)
+    art_lover = [index.choose_destination(answers, {"nature": 1, "culture": 1, "art": 5, "welness": 1}, rng)[0] for _ in range(300)]
+    nature_lover = [index.choose_destination(answers, {"nature": 5, "culture": 1, "art": 1, "welness": 1}, rng)[0] for _ in range(300)]
+    assert art_lover.count("東京都") > nature_lover.count("東京都")
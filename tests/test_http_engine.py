@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""http_engine (ホストごとの同時実行数の制限) のテスト"""
+import asyncio
+
+import httpx
+from openai import AsyncOpenAI
+
+from okosy_core.http_engine import AsyncHttpEngine
+
+PER_HOST_LIMIT = 2
+CHAT_COMPLETION = {
+    "id": "chatcmpl-test", "object": "chat.completion", "created": 0, "model": "test-model",
+    "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": "ok"}}],
+    "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+}
+
+
+class ConcurrencyRecorder:
+    """ホストごとの同時実行数の最大値を記録するスタブ上流"""
+    def __init__(self):
+        self.active = {}
+        self.peak = {}
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        host = request.url.host
+        self.active[host] = self.active.get(host, 0) + 1
+        self.peak[host] = max(self.peak.get(host, 0), self.active[host])
+        await asyncio.sleep(0.02)
+        self.active[host] -= 1
+        return httpx.Response(200, json=CHAT_COMPLETION)
+
+def _engine(recorder: ConcurrencyRecorder) -> AsyncHttpEngine:
+    return AsyncHttpEngine(10, PER_HOST_LIMIT, enable_http2=False, transport=httpx.MockTransport(recorder.handle))
+
+
+def test_engine_requests_respect_per_host_limit():
+    recorder = ConcurrencyRecorder()
+    engine = _engine(recorder)
+    async def burst():
+        await asyncio.gather(*(engine.request("GET", f"https://{host}/") for host in ["a.test", "b.test"] * 6))
+    engine.run(burst())
+    assert recorder.peak == {"a.test": PER_HOST_LIMIT, "b.test": PER_HOST_LIMIT}
+
+def test_openai_client_shares_per_host_limit():
+    recorder = ConcurrencyRecorder()
+    engine = _engine(recorder)
+    client = AsyncOpenAI(api_key="test", base_url="https://openai.test/v1", http_client=engine.client, max_retries=0)
+    async def burst():
+        return await asyncio.gather(*(
+            client.chat.completions.create(model="test-model", messages=[{"role": "user", "content": "hi"}])
+            for _ in range(6)
+        ))
+    responses = engine.run(burst())
+    assert [r.choices[0].message.content for r in responses] == ["ok"] * 6
+    assert recorder.peak["openai.test"] == PER_HOST_LIMIT
+
+class ChunkStream(httpx.AsyncByteStream):
+    async def __aiter__(self):
+        yield b"data: {}\n\n"
+
+def test_streamed_response_holds_slot_until_closed():
+    async def handle(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, stream=ChunkStream())
+    engine = AsyncHttpEngine(10, PER_HOST_LIMIT, enable_http2=False, transport=httpx.MockTransport(handle))
+    async def scenario():
+        semaphore = engine._semaphore("a.test")
+        response = await engine.client.send(engine.client.build_request("GET", "https://a.test/"), stream=True)
+        held = PER_HOST_LIMIT - semaphore._value
+        await response.aclose()
+        return held, PER_HOST_LIMIT - semaphore._value
+    assert engine.run(scenario()) == (1, 0)
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""place_records (保存形式の版1 → 版2 の変換と往復) のテスト"""
+import json
+
+from okosy_core.place_records import (
+    PlaceGroup, PlaceRecord, load_place_groups, place_groups_to_documents, place_groups_to_json,
+)
+
+V1_PLACES_DATA = json.dumps([
+    json.dumps([{"name": "清水寺", "address": "京都市東山区", "rating": 4.6, "price_level": None, "place_id": "p1"}],
+               ensure_ascii=False),
+    json.dumps({"message": "条件に合致する場所が見つかりませんでした。"}, ensure_ascii=False),
+    json.dumps({"error": "Google Places API Error: REQUEST_DENIED, "}, ensure_ascii=False),
+], ensure_ascii=False)
+
+
+def test_load_v1_places_data():
+    groups = load_place_groups(V1_PLACES_DATA)
+    assert [g.category for g in groups] == ["unknown"] * 3
+    assert groups[0].records == [PlaceRecord(category="unknown", name="清水寺", address="京都市東山区", rating=4.6, place_id="p1")]
+    assert groups[1].message == "条件に合致する場所が見つかりませんでした。" and not groups[1].records
+    assert groups[2].error.startswith("Google Places API Error")
+
+def test_v1_to_v2_round_trip():
+    groups = load_place_groups(V1_PLACES_DATA)
+    assert load_place_groups(place_groups_to_json(groups)) == groups # JSON 文字列 (SQLite / しおりキャッシュ)
+    assert load_place_groups(place_groups_to_documents(groups)) == groups # 配列・マップ (Firestore)
+
+def test_v2_keeps_optional_detail_fields_and_omits_missing_ones():
+    record = PlaceRecord(category="tourist_attraction", name="金閣寺", place_id="p2", lat=35.04, lng=135.73,
+                         opening_hours=["月曜日: 9時00分～17時00分"])
+    document = PlaceGroup(category="tourist_attraction", query="京都 寺", records=[record]).to_dict()
+    assert document["records"] == [{"name": "金閣寺", "place_id": "p2", "lat": 35.04, "lng": 135.73,
+                                    "opening_hours": ["月曜日: 9時00分～17時00分"]}]
+    assert load_place_groups([document])[0].records == [record]
+
+def test_invalid_places_data_is_ignored():
+    assert load_place_groups(None) == []
+    assert load_place_groups("not json") == []
+    assert load_place_groups(json.dumps({"not": "a list"})) == []
+    group = load_place_groups(json.dumps(["not json"]))[0]
+    assert group.error and not group.records
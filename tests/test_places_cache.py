@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""places.PlacesResponseCache (TTL とメモリ予算による削除) とキャッシュキーの正規化のテスト"""
+import json
+
+import pytest
+
+from okosy_core import places
+from okosy_core.places import PlacesResponseCache, normalize_places_query_key
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(places.time, "monotonic", fake)
+    return fake
+
+def _response(n: int, padding: int = 0) -> dict:
+    return {"status": "OK", "results": [{"name": f"place{n}", "padding": "x" * padding}]}
+
+def _size(value: dict) -> int:
+    return len(json.dumps(value, ensure_ascii=False).encode("utf-8"))
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = PlacesResponseCache(ttl_seconds=60, max_bytes=1_000_000)
+    cache.put(("a",), _response(1))
+    clock.now += 59
+    assert cache.get(("a",)) == _response(1)
+    clock.now += 2
+    assert cache.get(("a",)) is None
+    assert cache._total_bytes == 0
+
+def test_evicts_least_recently_used_within_byte_budget(clock):
+    entry_size = _size(_response(1, padding=100))
+    cache = PlacesResponseCache(ttl_seconds=60, max_bytes=entry_size * 2)
+    cache.put(("a",), _response(1, padding=100))
+    cache.put(("b",), _response(2, padding=100))
+    assert cache.get(("a",)) is not None # a を最近使ったものにする
+    cache.put(("c",), _response(3, padding=100))
+    assert cache.get(("b",)) is None
+    assert cache.get(("a",)) is not None and cache.get(("c",)) is not None
+    assert cache._total_bytes <= cache.max_bytes
+
+def test_oversized_response_is_not_cached(clock):
+    cache = PlacesResponseCache(ttl_seconds=60, max_bytes=50)
+    cache.put(("a",), _response(1, padding=100))
+    assert cache.get(("a",)) is None
+
+def test_replacing_an_entry_updates_the_byte_total(clock):
+    cache = PlacesResponseCache(ttl_seconds=60, max_bytes=1_000_000)
+    cache.put(("a",), _response(1, padding=100))
+    cache.put(("a",), _response(1))
+    assert cache._total_bytes == _size(_response(1))
+
+def test_query_key_normalization():
+    # 全角空白・半角カナ・前後の空白と、約1km未満の座標の差は同じキーになる
+    assert normalize_places_query_key("京都　ラーメン", "35.01161,135.76402", "restaurant") == \
+        normalize_places_query_key(" 京都 ﾗｰﾒﾝ ", "35.0149,135.7649", "restaurant")
+    assert normalize_places_query_key("Kyoto", None, "cafe") == normalize_places_query_key("KYOTO", None, "cafe")
+    assert normalize_places_query_key("京都", None, "cafe") != normalize_places_query_key("京都", None, "restaurant")
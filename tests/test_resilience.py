@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""resilience (再試行・サーキットブレーカー・期限) のテスト"""
+import itertools
+
+import httpx
+import pytest
+
+from okosy_core import config, resilience
+from okosy_core.resilience import (
+    CircuitBreaker, CircuitOpenError, Deadline, DeadlineExceededError, RetriesExhaustedError, RetryableError,
+    UpstreamUnavailableError, call_with_resilience,
+)
+
+_upstream_ids = itertools.count()
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(config, "RETRY_MAX_ATTEMPTS", 3)
+    monkeypatch.setattr(config, "CIRCUIT_FAILURE_THRESHOLD", 5)
+    monkeypatch.setattr(config, "CIRCUIT_RESET_SECONDS", 30.0)
+    monkeypatch.setattr(resilience.time, "sleep", lambda seconds: None)
+
+@pytest.fixture
+def upstream() -> str:
+    """テストごとに別のサーキットブレーカーを使うための上流名"""
+    return f"test-upstream-{next(_upstream_ids)}"
+
+def _status_error(status_code: int) -> httpx.HTTPStatusError:
+    request = httpx.Request("GET", "https://upstream.test/?key=secret-api-key")
+    return httpx.HTTPStatusError(str(status_code), request=request, response=httpx.Response(status_code, request=request))
+
+class FlakyCall:
+    """指定したエラーを順に送出し、尽きたら "ok" を返す呼び出し"""
+    def __init__(self, *errors: Exception):
+        self.errors = list(errors)
+        self.timeouts = []
+
+    def __call__(self, timeout: float) -> str:
+        self.timeouts.append(timeout)
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+
+def test_retries_retryable_errors_until_success(upstream):
+    call = FlakyCall(_status_error(503), RetryableError("OVER_QUERY_LIMIT"))
+    assert call_with_resilience(upstream, call, timeout=5) == "ok"
+    assert len(call.timeouts) == 3
+
+def test_exhausted_retries_raise_upstream_unavailable(upstream):
+    last = _status_error(429)
+    call = FlakyCall(_status_error(503), httpx.ReadTimeout("timeout"), last)
+    with pytest.raises(RetriesExhaustedError) as excinfo:
+        call_with_resilience(upstream, call, timeout=5)
+    assert isinstance(excinfo.value, UpstreamUnavailableError)
+    assert excinfo.value.__cause__ is last
+    assert "secret-api-key" not in str(excinfo.value)
+
+def test_non_retryable_errors_are_raised_immediately(upstream):
+    error = _status_error(400)
+    call = FlakyCall(error)
+    with pytest.raises(httpx.HTTPStatusError) as excinfo:
+        call_with_resilience(upstream, call, timeout=5)
+    assert excinfo.value is error
+    assert len(call.timeouts) == 1
+    assert resilience.get_circuit_breaker(upstream).state == "closed"
+
+def test_circuit_opens_after_consecutive_failures(upstream, monkeypatch):
+    monkeypatch.setattr(config, "CIRCUIT_FAILURE_THRESHOLD", 3)
+    with pytest.raises(RetriesExhaustedError):
+        call_with_resilience(upstream, FlakyCall(*[_status_error(500)] * 3), timeout=5)
+    call = FlakyCall()
+    with pytest.raises(CircuitOpenError):
+        call_with_resilience(upstream, call, timeout=5)
+    assert call.timeouts == [] # 遮断中は上流を呼ばない
+
+def test_attempt_timeout_is_capped_by_deadline(upstream):
+    call = FlakyCall()
+    call_with_resilience(upstream, call, timeout=30, deadline=Deadline(2))
+    assert 0 < call.timeouts[0] <= 2
+
+def test_expired_deadline_raises_before_calling(upstream):
+    call = FlakyCall()
+    with pytest.raises(DeadlineExceededError):
+        call_with_resilience(upstream, call, timeout=5, deadline=Deadline(0))
+    assert call.timeouts == []
+
+def test_child_deadline_never_outlives_parent():
+    parent = Deadline(1)
+    assert parent.child(10).remaining() <= 1
+    assert parent.child(0.5).remaining() <= 0.5
+
+
+class TestCircuitBreaker:
+    def _breaker(self, monkeypatch, threshold=2, reset=30.0):
+        self.now = 100.0
+        monkeypatch.setattr(resilience.time, "monotonic", lambda: self.now)
+        return CircuitBreaker("test", threshold, reset)
+
+    def test_half_open_allows_a_single_trial(self, monkeypatch):
+        breaker = self._breaker(monkeypatch)
+        breaker.record_failure()
+        breaker.record_failure()
+        assert breaker.state == "open" and not breaker.allow()
+        self.now += 30
+        assert breaker.state == "half_open"
+        assert breaker.allow()
+        assert not breaker.allow() # 復旧確認中は1件だけ
+
+    def test_successful_trial_closes_the_circuit(self, monkeypatch):
+        breaker = self._breaker(monkeypatch)
+        breaker.record_failure()
+        breaker.record_failure()
+        self.now += 30
+        assert breaker.allow()
+        breaker.record_success()
+        assert breaker.state == "closed" and breaker.allow()
+
+    def test_failed_trial_reopens_the_circuit(self, monkeypatch):
+        breaker = self._breaker(monkeypatch)
+        breaker.record_failure()
+        breaker.record_failure()
+        self.now += 30
+        assert breaker.allow()
+        breaker.record_failure()
+        assert breaker.state == "open" and not breaker.allow()
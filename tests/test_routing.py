@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""routing (日ごとのまとまりへの分割と行程の計算) のテスト"""
+import numpy as np
+
+from okosy_core.place_records import PlaceGroup, PlaceRecord
+from okosy_core.routing import cluster_by_day, haversine_matrix, plan_routes, route_guidance
+
+
+def _attractions(coords):
+    return PlaceGroup(category="tourist_attraction", records=[
+        PlaceRecord(category="tourist_attraction", name=f"spot{i}", place_id=f"p{i}", lat=lat, lng=lng)
+        for i, (lat, lng) in enumerate(coords)
+    ])
+
+def _dist(coords):
+    coords = np.array(coords, dtype=float)
+    return haversine_matrix(coords[:, 0], coords[:, 1])
+
+
+def test_cluster_by_day_balances_clusters():
+    rng = np.random.default_rng(0)
+    coords = np.column_stack([35 + rng.random(12), 135 + rng.random(12)])
+    clusters = cluster_by_day(_dist(coords), 3)
+    assert sorted(len(c) for c in clusters) == [4, 4, 4]
+    assert sorted(int(i) for c in clusters for i in c) == list(range(12))
+
+def test_cluster_by_day_caps_days_at_point_count():
+    clusters = cluster_by_day(_dist([(35.0, 135.0), (35.5, 135.5)]), 5)
+    assert len(clusters) == 2
+
+def test_cluster_by_day_handles_identical_coordinates():
+    clusters = cluster_by_day(_dist([(35.0, 135.0), (35.0, 135.0)]), 2)
+    assert sorted(int(i) for c in clusters for i in c) == [0, 1]
+    assert all(len(c) == 1 for c in clusters)
+
+    clusters = cluster_by_day(_dist([(35.0, 135.0), (35.0, 135.0), (36.0, 136.0)]), 3)
+    assert len(clusters) == 3
+    assert all(len(c) == 1 for c in clusters)
+
+
+def test_plan_routes_with_identical_coordinates():
+    plan = plan_routes([_attractions([(35.0, 135.0), (35.0, 135.0), (36.0, 136.0)])], 3)
+    assert plan is not None
+    assert [len(d.stops) for d in plan.days] == [1, 1, 1]
+
+def test_plan_routes_without_coordinates_returns_none():
+    group = PlaceGroup(category="tourist_attraction", records=[PlaceRecord(category="tourist_attraction", name="a")])
+    assert plan_routes([group], 2) is None
+
+def test_plan_routes_assigns_meals_and_lodging():
+    groups = [
+        _attractions([(35.00, 135.00), (35.01, 135.01), (36.00, 136.00), (36.01, 136.01)]),
+        PlaceGroup(category="restaurant", records=[
+            PlaceRecord(category="restaurant", name="near1", place_id="r1", lat=35.005, lng=135.005),
+            PlaceRecord(category="restaurant", name="near2", place_id="r2", lat=36.005, lng=136.005),
+        ]),
+        PlaceGroup(category="lodging", records=[
+            PlaceRecord(category="lodging", name="hotel", place_id="h1", lat=35.02, lng=135.02),
+        ]),
+    ]
+    plan = plan_routes(groups, 2, origin="35.0,135.0")
+    assert [len(d.stops) for d in plan.days] == [2, 2]
+    assert {s.place_id for s in plan.days[0].stops} == {"p0", "p1"} # 出発地に近いまとまりが1日目
+    assert plan.days[0].meals[0].place_id == "r1"
+    assert plan.days[0].lodging is not None and plan.days[-1].lodging is None
+
+def test_route_guidance_names_unplanned_days():
+    plan = plan_routes([_attractions([(35.0, 135.0), (35.5, 135.5)])], 4)
+    assert len(plan.days) == 2 and plan.total_days == 4
+    assert "3日目〜4日目" in route_guidance(plan)